@@ -58,6 +58,9 @@ class UnapprovedVideosFeed(BaseVideosFeed):
 
 
 class UnapprovedUserVideosFeed(UnapprovedVideosFeed):
+    streaming = False
+    cache_item_fragments = False
+
     def title(self):
         return "%s: %s" % (
             Site.objects.get_current().name, _('Unapproved User Submissions'))
@@ -19,46 +19,95 @@ import os
 
 from django.conf import settings
 
+from localtv import utils
 from localtv.models import SiteLocation, Video, Category
-from localtv.settings import ENABLE_CHANGE_STAMPS
 
+#: Values which are the same for every request to a site, keyed by name and
+#: site id. Each is stored along with the cache versions it was computed
+#: under; the signal handlers in :mod:`localtv.models` bump those versions
+#: whenever a video or category is saved or deleted.
+_site_values = {}
 
-def localtv(request):
-    sitelocation = SiteLocation.objects.get_current()
 
-    display_submit_button = sitelocation.display_submit_button
-    if display_submit_button:
-        if request.user.is_anonymous() and \
-                sitelocation.submission_requires_login:
-            display_submit_button = False
-    else:
-        if request.user_is_admin():
-            display_submit_button = True
+def _get_site_value(name, version_names, func):
+    """
+    Returns the process-local value for ``name`` on the current site, calling
+    ``func`` to compute it if it hasn't been computed yet or if any of the
+    cache versions for ``version_names`` have changed since.
+
+    """
+    key = (name, settings.SITE_ID)
+    versions = utils.get_cache_versions(*version_names)
+    if key in _site_values:
+        cached_versions, value = _site_values[key]
+        if cached_versions == versions:
+            return value
+    value = func()
+    _site_values[key] = (versions, value)
+    return value
+
 
+def _lazy(func):
+    """
+    Wraps ``func`` so that it is called at most once, the first time the
+    wrapper is called. Templates call any callable they're given, so context
+    values wrapped this way cost nothing unless a template uses them.
+
+    """
+    result = []
+    def wrapper():
+        if not result:
+            result.append(func())
+        return result[0]
+    return wrapper
+
+
+def _get_cache_invalidator():
     if getattr(settings, 'LOCALTV_ENABLE_CHANGE_STAMPS', False):
         try:
-            cache_invalidator = os.stat(
+            return os.stat(
                 os.path.join(settings.MEDIA_ROOT,
                              '.video-published-stamp')).st_mtime
         except OSError:
-            cache_invalidator = None
-    else:
+            return None
+
+    def last_modified():
         try:
-            cache_invalidator = str(Video.objects.order_by(
+            return str(Video.objects.order_by(
                     '-when_modified').values_list(
                     'when_modified', flat=True)[0])
         except IndexError:
-            cache_invalidator = None
+            return None
+    return _get_site_value('cache_invalidator',
+                           ['site:%i' % settings.SITE_ID], last_modified)
+
+
+def _get_categories():
+    def root_categories():
+        return list(Category.objects.filter(site=settings.SITE_ID,
+                                            parent=None))
+    return _get_site_value('categories',
+                           ['categories:%i' % settings.SITE_ID],
+                           root_categories)
+
+
+def localtv(request):
+    sitelocation = SiteLocation.objects.get_current()
+
+    def display_submit_button():
+        if sitelocation.display_submit_button:
+            return not (request.user.is_anonymous() and
+                        sitelocation.submission_requires_login)
+        return request.user_is_admin()
 
     return  {
         'mc_version': '1.2',
         'sitelocation': sitelocation,
-        'user_is_admin': request.user_is_admin(),
-        'categories':  Category.objects.filter(site=sitelocation.site,
-                                                      parent=None),
-        'cache_invalidator': cache_invalidator,
+        'user_is_admin': request.user_is_admin,
+        'categories': _lazy(_get_categories),
+        'cache_invalidator': _lazy(_get_cache_invalidator),
 
-        'display_submit_button': display_submit_button,
+        'display_submit_button': _lazy(display_submit_button),
 
         'settings': settings,
 
@@ -15,13 +15,45 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+
 from django.utils import feedgenerator, simplejson
+from django.utils.xmlutils import SimplerXMLGenerator
+
+
+class StreamingFeedMixin(object):
+    """
+    Lets a feed be written a chunk of items at a time, rather than from
+    :attr:`items`. Since the items aren't known when the feed's root elements
+    are written, the feed's update date must be set as :attr:`latest_date`
+    instead.
+
+    Generators using this define ``item_fragment(item)``, which returns
+    ``item`` rendered as it would be written to the feed, and
+    ``write_chunks(item_chunks, encoding)``, which yields the feed in pieces
+    from an iterable of lists of items. Items which are dictionaries with a
+    ``fragment`` (and a ``pubdate``) are written as that fragment.
 
+    """
+    latest_date = None
 
-class ThumbnailFeedGenerator(feedgenerator.Atom1Feed):
+    def latest_post_date(self):
+        if self.latest_date is not None:
+            return self.latest_date
+        return super(StreamingFeedMixin, self).latest_post_date()
+
+
+class ThumbnailFeedGenerator(StreamingFeedMixin, feedgenerator.Atom1Feed):
     def add_root_elements(self, handler):
         # First. let the superclass add its own essential root elements.
         super(ThumbnailFeedGenerator, self).add_root_elements(handler)
+        if self.feed.get('next_link'):
+            handler.addQuickElement(u'link', u'', {
+                    u'rel': u'next',
+                    u'href': self.feed['next_link']})
 
         # Second, add the necessary information for this feed to be identified
         # as an OpenSearch feed.
@@ -37,6 +69,24 @@ class ThumbnailFeedGenerator(feedgenerator.Atom1Feed):
         attrs['xmlns:opensearch'] = 'http://a9.com/-/spec/opensearch/1.1/'
         return attrs
 
+    def item_fragment(self, item):
+        outfile = StringIO.StringIO()
+        handler = SimplerXMLGenerator(outfile, 'utf-8')
+        handler.startElement(u"entry", self.item_attributes(item))
+        self.add_item_elements(handler, item)
+        handler.endElement(u"entry")
+        return outfile.getvalue()
+
+    def write_items(self, handler):
+        for item in self.items:
+            if 'fragment' in item:
+                # Already rendered; write it as-is.
+                handler.ignorableWhitespace(item['fragment'])
+            else:
+                handler.startElement(u"entry", self.item_attributes(item))
+                self.add_item_elements(handler, item)
+                handler.endElement(u"entry")
+
     def add_item_elements(self, handler, item):
         feedgenerator.Atom1Feed.add_item_elements(self, handler, item)
         if 'thumbnail' in item:
@@ -52,7 +102,29 @@ class ThumbnailFeedGenerator(feedgenerator.Atom1Feed):
             handler.characters(item.get('embed_code', ''))
             handler.endElement('media:player')
 
-class JSONGenerator(feedgenerator.SyndicationFeed):
+    def write_chunks(self, item_chunks, encoding):
+        outfile = StringIO.StringIO()
+
+        def flush():
+            data = outfile.getvalue()
+            outfile.seek(0)
+            outfile.truncate()
+            return data
+
+        handler = SimplerXMLGenerator(outfile, encoding)
+        handler.startDocument()
+        handler.startElement(u'feed', self.root_attributes())
+        self.add_root_elements(handler)
+        yield flush()
+        for items in item_chunks:
+            self.items = items
+            self.write_items(handler)
+            self.items = []
+            yield flush()
+        handler.endElement(u"feed")
+        yield flush()
+
+class JSONGenerator(StreamingFeedMixin, feedgenerator.SyndicationFeed):
     mime_type = 'application/json'
     def write(self, outfile, encoding):
         json = {}
@@ -60,18 +132,45 @@ class JSONGenerator(feedgenerator.SyndicationFeed):
         self.write_items(json)
         simplejson.dump(json, outfile, encoding=encoding)
 
+    def write_chunks(self, item_chunks, encoding):
+        json = {}
+        self.add_root_elements(json)
+        # Leave the object open for the items.
+        yield simplejson.dumps(json, encoding=encoding)[:-1] + ', "items": ['
+        separator = ''
+        for items in item_chunks:
+            json_items = []
+            for item in items:
+                self.add_item_elements(json_items, item)
+            if json_items:
+                yield separator + ', '.join(
+                    simplejson.dumps(json_item, encoding=encoding)
+                    for json_item in json_items)
+                separator = ', '
+        yield ']}'
+
     def add_root_elements(self, json):
         json['title'] = self.feed['title']
         json['link'] = self.feed['link']
         json['id'] = self.feed['id']
         json['updated'] = unicode(self.latest_post_date())
+        if self.feed.get('next_link'):
+            json['next'] = self.feed['next_link']
 
     def write_items(self, json):
         json['items'] = []
         for item in self.items:
             self.add_item_elements(json['items'], item)
 
+    def item_fragment(self, item):
+        json_items = []
+        self.add_item_elements(json_items, item)
+        return json_items[0]
+
     def add_item_elements(self, json_items, item):
+        if 'fragment' in item:
+            json_items.append(item['fragment'])
+            return
         json_item = {}
         json_item['title'] = item['title']
         json_item['link'] = item['link']
@@ -15,24 +15,32 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import itertools
 import urllib
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.contrib.syndication.views import Feed as FeedView, add_domain
 from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.files.storage import default_storage
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.utils.encoding import iri_to_uri, force_unicode
 from django.utils.translation import ugettext as _
 from django.utils.tzinfo import FixedOffset
+from django.views.decorators.http import condition
 from tagging.models import Tag
 
+from localtv import settings as lsettings
+from localtv import utils
 from localtv.feeds.feedgenerator import ThumbnailFeedGenerator, JSONGenerator
 from localtv.models import Video, Category, Feed
 from localtv.playlists.models import Playlist
-from localtv.search.utils import SortFilterViewMixin
+from localtv.search.utils import (SortFilterViewMixin, get_result_count,
+                                  get_sort_version_names, make_cursor)
 from localtv.templatetags.filters import simpletimesince
 
 
@@ -46,35 +54,73 @@ class BaseVideosFeed(FeedView, SortFilterViewMixin):
     feed_type = ThumbnailFeedGenerator
     default_sort = None
     default_filter = None
+    #: Whether feeds with more than ``LOCALTV_FEED_STREAMING_THRESHOLD``
+    #: items are streamed. Only feeds which use :meth:`items` can be.
+    streaming = True
+    #: Whether each video's rendered item is cached, so that it can be
+    #: reused by every feed the video appears in. Only feeds which use
+    #: :meth:`items` can do this.
+    cache_item_fragments = True
 
     def __init__(self, json=False):
         if json:
             self.feed_type = JSONGenerator
 
-    def _get_cache_key(self, vary):
+    def _get_cache_version_names(self, *args):
+        """
+        Returns the names of the cache versions (see
+        :func:`localtv.utils.get_cache_versions`) which this feed is cached
+        under, given the view's arguments. Every feed lists the site's videos;
+        feeds of a particular object add that object's version.
+
+        """
+        return ['site:%i' % settings.SITE_ID]
+
+    def _get_cache_key(self, request, *args):
+        version_names = self._get_cache_version_names(*args)
+        version_names += [name for name in get_sort_version_names(
+                self._get_sort(request)) if name not in version_names]
+        vary = (
+            self.feed_type.__name__,
+            request.is_secure(),
+            args,
+            # The whole query string, since the sort and filters change the
+            # feed as well as the OpenSearch parameters.
+            sorted(request.GET.lists()),
+            utils.get_cache_versions(*version_names),
+        )
         return u'localtv_feed_cache:%(domain)s:%(class)s:%(vary)s' % {
             'domain': Site.objects.get_current().domain,
             'class': self.__class__.__name__,
-            'vary': force_unicode(vary).replace(' ', '')
+            'vary': hashlib.md5(repr(vary)).hexdigest(),
         }
 
+    def _get_etag_parts(self, request, *args, **kwargs):
+        parts = super(BaseVideosFeed, self)._get_etag_parts(request, *args,
+                                                            **kwargs)
+        # Feeds of an object change when the object is saved.
+        parts.append(utils.get_cache_versions(
+                *self._get_cache_version_names(*args)))
+        return parts
+
     def __call__(self, request, *args, **kwargs):
+        # Unchanged feeds get a 304 without being searched or rendered.
+        return condition(etag_func=self._get_etag,
+                         last_modified_func=self._get_last_modified_header)(
+            self._get_response)(request, *args, **kwargs)
+
+    def _get_response(self, request, *args, **kwargs):
         is_json = self.feed_type is JSONGenerator
         jsoncallback = request.GET.get('jsoncallback')
         is_jsonp = is_json and bool(jsoncallback)
-        vary = (
-            is_json,
-            is_jsonp,
-            request.GET.get('count'),
-            request.GET.get('startIndex'),
-            # We need to vary on start-index as well since
-            # :meth:`_get_opensearch_data` uses it as an alternate source for
-            # startIndex.
-            request.GET.get('start-index'),
-            request.GET.get('startPage')
-        )
-        cache_key = self._get_cache_key(vary)
-
+        if (self.streaming and self._normalize_param(request, 'count',
+                                default=LOCALTV_FEED_LENGTH) >
+            lsettings.FEED_STREAMING_THRESHOLD):
+            # Large feeds are streamed rather than cached.
+            return self._streaming_response(request, jsoncallback if is_jsonp
+                                            else None, *args, **kwargs)
+
+        cache_key = self._get_cache_key(request, *args)
         response = cache.get(cache_key)
         if response is None:
             response = super(BaseVideosFeed, self).__call__(request,
@@ -82,9 +128,72 @@ class BaseVideosFeed(FeedView, SortFilterViewMixin):
             if is_jsonp:
                 response = HttpResponse(u"%s(%s);" % (jsoncallback,
                             response.content), mimetype='text/javascript')
-            cache.set(cache_key, response, 15*60)
+            # JSON feeds include relative times, so they can only be cached
+            # for as long as the items.
+            cache.set(cache_key, response,
+                      lsettings.FEED_ITEM_CACHE_TIMEOUT if is_json
+                      else lsettings.FEED_CACHE_TIMEOUT)
         return response
 
+    def _streaming_response(self, request, jsoncallback, *args, **kwargs):
+        """
+        Returns a response which renders the feed a chunk of items at a time
+        as it is sent, so that only one chunk of videos is in memory at once.
+
+        """
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+        sqs = self._get_searchqueryset(obj)
+        sort = self._get_sort(request)
+        cursor = self._get_cursor(request)
+        opensearch = self._get_opensearch_data(obj)
+        chunk_sqs, start = self._seek(sqs, sort, cursor)
+        if start is None:
+            start = opensearch['startindex']
+            opensearch['totalresults'] = get_result_count(sqs)
+        # Build the feed without any items, for its root elements.
+        obj['items'] = []
+        feedgen = self.get_feed(obj, request)
+        latest = sqs._clone()
+        latest.query.clear_order_by()
+        for result in latest.order_by('-best_date')[:1]:
+            feedgen.latest_date = result.best_date.replace(
+                tzinfo=FixedOffset(0))
+
+        def item_chunks():
+            chunk_start, chunk_cursor, chunk_qs = start, cursor, chunk_sqs
+            remaining = opensearch['itemsperpage']
+            while remaining > 0:
+                chunk_size = min(remaining,
+                                 lsettings.FEED_STREAMING_THRESHOLD)
+                results = chunk_qs._clone().load_all()[
+                    chunk_start:chunk_start + chunk_size]
+                if not results:
+                    break
+                obj['items'] = [result.object for result in results
+                                if result is not None]
+                yield self.get_feed(obj, request).items
+                remaining -= chunk_size
+                # Move on from the end of the chunk, rather than by an
+                # offset, where the sort allows it.
+                chunk_cursor = self._get_next_cursor(
+                    sort, results, chunk_cursor, searchqueryset=sqs,
+                    start=chunk_start)
+                if chunk_cursor is None:
+                    chunk_start += chunk_size
+                else:
+                    chunk_qs, chunk_start = self._seek(sqs, sort,
+                                                       chunk_cursor)
+
+        content = feedgen.write_chunks(item_chunks(), 'utf-8')
+        if jsoncallback:
+            return HttpResponse(itertools.chain([u'%s(' % jsoncallback],
+                                                content, [u');']),
+                                mimetype='text/javascript')
+        return HttpResponse(content, mimetype=feedgen.mime_type)
+
     def get_object(self, request, *args, **kwargs):
         """
         Returns a dictionary containing all information that must be propagated
@@ -103,10 +212,92 @@ class BaseVideosFeed(FeedView, SortFilterViewMixin):
         :attr:`feed.opensearch_data`.
 
         """
-        feed = super(BaseVideosFeed, self).get_feed(obj, request)
+        if not self.cache_item_fragments:
+            feed = super(BaseVideosFeed, self).get_feed(obj, request)
+            feed.opensearch_data = self._get_opensearch_data(obj)
+            self._add_next_link(feed, obj, request)
+            return feed
+
+        # Only the videos which don't have a cached fragment are handled by
+        # the normal feed machinery.
+        had_items, old_items = 'items' in obj, obj.get('items')
+        videos = self.items(obj)
+        version = utils.get_cache_versions('sitelocation:%i' %
+                                           settings.SITE_ID)[0]
+        keys = dict((video.pk, self._get_fragment_key(video, request,
+                                                      version))
+                    for video in videos)
+        fragments = cache.get_many(keys.values())
+        obj['items'] = [video for video in videos
+                        if keys[video.pk] not in fragments]
+        try:
+            feed = super(BaseVideosFeed, self).get_feed(obj, request)
+        finally:
+            if had_items:
+                obj['items'] = old_items
+            else:
+                del obj['items']
         feed.opensearch_data = self._get_opensearch_data(obj)
+
+        rendered = iter(feed.items)
+        new_fragments = {}
+        items = []
+        for video in videos:
+            key = keys[video.pk]
+            if key in fragments:
+                pubdate, fragment = fragments[key]
+            else:
+                item = rendered.next()
+                # The pubdate's tzinfo doesn't pickle.
+                pubdate = item['pubdate'] and item['pubdate'].replace(
+                    tzinfo=None)
+                fragment = feed.item_fragment(item)
+                new_fragments[key] = (pubdate, fragment)
+            if pubdate is not None:
+                pubdate = pubdate.replace(tzinfo=FixedOffset(0))
+            items.append({'pubdate': pubdate, 'fragment': fragment})
+        if new_fragments:
+            cache.set_many(new_fragments, lsettings.FEED_ITEM_CACHE_TIMEOUT)
+        feed.items = items
+        self._add_next_link(feed, obj, request)
         return feed
 
+    def _add_next_link(self, feed, obj, request):
+        """
+        Links ``feed`` to the page which follows it, with an ``after`` token
+        in place of the start parameters, if :meth:`items` found one.
+
+        """
+        cursor = obj.get('next_cursor')
+        if cursor is None:
+            return
+        querydict = request.GET.copy()
+        for param in ('startIndex', 'start-index', 'startPage'):
+            querydict.pop(param, None)
+        querydict['after'] = make_cursor(*cursor)
+        feed.feed['next_link'] = add_domain(
+            Site.objects.get_current().domain,
+            u'%s?%s' % (request.path, querydict.urlencode()),
+            request.is_secure())
+
+    def _get_fragment_key(self, video, request, version):
+        """
+        Returns the cache key for ``video``'s rendered item in this type of
+        feed. Saving the video changes its ``when_modified``, and so the key;
+        saving the site's settings changes ``version``, the SiteLocation's
+        cache version.
+
+        """
+        return (u'localtv_feed_item:%(domain)s:%(type)s:%(secure)i:%(pk)i:'
+                u'%(modified)s:%(version)s' % {
+                'domain': Site.objects.get_current().domain,
+                'type': self.feed_type.__name__,
+                'secure': request.is_secure(),
+                'pk': video.pk,
+                'modified': video.when_modified.isoformat(),
+                'version': version,
+                })
+
     def items(self, obj):
         """
         Handles a list or queryset of items fetched with :meth:`_actual_items`
@@ -118,18 +309,42 @@ class BaseVideosFeed(FeedView, SortFilterViewMixin):
 
         More info at http://www.opensearch.org/Specifications/OpenSearch/1.1#OpenSearch_1.1_parameters
 
+        If ``obj`` has its ``items`` set (by :meth:`_streaming_response`),
+        those are returned instead.
+
+        The ``after`` parameter, with a token from the feed's ``next`` link,
+        is used instead of the start parameters when the feed is sorted. It
+        skips straight to the following results, and the total isn't counted.
+
+        """
+        if 'items' in obj:
+            return obj['items']
+        sqs = self._get_searchqueryset(obj)
+        sort = self._get_sort(obj['request'])
+        cursor = self._get_cursor(obj['request'])
+
+        opensearch = self._get_opensearch_data(obj)
+        sqs, start = self._seek(sqs, sort, cursor)
+        if start is None:
+            start = opensearch['startindex']
+            opensearch['totalresults'] = get_result_count(sqs)
+        end = start + opensearch['itemsperpage']
+        results = sqs.load_all()[start:end]
+        if len(results) == opensearch['itemsperpage']:
+            obj['next_cursor'] = self._get_next_cursor(
+                sort, results, cursor, searchqueryset=sqs, start=start)
+        return [result.object for result in results if result is not None]
+
+    def _get_searchqueryset(self, obj):
+        """
+        Returns the sorted and filtered SearchQuerySet for the feed.
+
         """
         sqs = self._query(self._get_query(obj['request']))
         sqs = self._sort(sqs, self._get_sort(obj['request']))
         filter_dict, xxx = self._get_filter_info(obj['request'], [obj.get('obj')])
         sqs, xxx = self._filter(sqs, **filter_dict)
-
-        opensearch = self._get_opensearch_data(obj)
-        start = opensearch['startindex']
-        end = start + opensearch['itemsperpage']
-        opensearch['totalresults'] = len(sqs)
-        sqs = sqs.load_all()[start:end]
-        return [result.object for result in sqs if result is not None]
+        return sqs
 
     def _get_opensearch_data(self, obj):
         """
@@ -139,8 +354,9 @@ class BaseVideosFeed(FeedView, SortFilterViewMixin):
         if 'opensearch_data' not in obj:
             request = obj['request']
 
-            count = self._normalize_param(request, 'count',
-                                default=LOCALTV_FEED_LENGTH)
+            count = min(self._normalize_param(request, 'count',
+                                default=LOCALTV_FEED_LENGTH),
+                        lsettings.FEED_MAX_COUNT)
 
             # The spec says to use startIndex, but vidscraper seems to send out
             # start-index. I don't really know what's up with that.
@@ -279,6 +495,10 @@ class CategoryVideosFeed(BaseVideosFeed):
     default_filter = 'category'
     default_sort = '-date'
 
+    def _get_cache_version_names(self, slug):
+        return BaseVideosFeed._get_cache_version_names(self, slug) + [
+            'category:%i:%s' % (settings.SITE_ID, slug)]
+
     def get_object(self, request, slug):
         obj = BaseVideosFeed.get_object(self, request, slug)
         obj['obj'] = Category.objects.get(
@@ -298,6 +518,10 @@ class AuthorVideosFeed(BaseVideosFeed):
     default_filter = 'author'
     default_sort = '-date'
 
+    def _get_cache_version_names(self, pk):
+        return BaseVideosFeed._get_cache_version_names(self, pk) + [
+            'author:%s' % pk]
+
     def get_object(self, request, pk):
         obj = BaseVideosFeed.get_object(self, request, pk)
         obj['obj'] = User.objects.get(pk=pk)
@@ -327,6 +551,10 @@ class FeedVideosFeed(BaseVideosFeed):
     default_filter = 'feed'
     default_sort = '-date'
 
+    def _get_cache_version_names(self, pk):
+        return BaseVideosFeed._get_cache_version_names(self, pk) + [
+            'feed:%s' % pk]
+
     def get_object(self, request, pk):
         obj = BaseVideosFeed.get_object(self, request, pk)
         obj['obj'] = Feed.objects.get(pk=pk)
@@ -345,6 +573,10 @@ class TagVideosFeed(BaseVideosFeed):
     default_filter = 'tag'
     default_sort = '-date'
 
+    def _get_cache_version_names(self, name):
+        return BaseVideosFeed._get_cache_version_names(self, name) + [
+            'tag:%s' % name]
+
     def get_object(self, request, name):
         obj = BaseVideosFeed.get_object(self, request, name)
         obj['obj'] = Tag.objects.get(name=name)
@@ -377,6 +609,14 @@ class SearchVideosFeed(BaseVideosFeed):
 
 
 class PlaylistVideosFeed(BaseVideosFeed):
+    # Playlists in their own order are listed from the database rather than
+    # the index.
+    streaming = False
+
+    def _get_cache_version_names(self, pk):
+        return BaseVideosFeed._get_cache_version_names(self, pk) + [
+            'playlist:%s' % pk]
+
     def get_object(self, request, pk):
         obj = BaseVideosFeed.get_object(self, request, pk)
         obj['obj'] = Playlist.objects.get(pk=pk)
@@ -391,6 +631,8 @@ class PlaylistVideosFeed(BaseVideosFeed):
         :meth:`items`.
 
         """
+        if 'items' in obj:
+            return obj['items']
         sort = self._get_sort(obj['request'])
         if sort == 'order':
             # TODO: This probably breaks if a video is in multiple playlists.
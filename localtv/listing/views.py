@@ -22,14 +22,18 @@ from django.contrib.sites.models import Site
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator, Page
 from django.http import Http404
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
 from django.views.generic import ListView
 from django.conf import settings
 from voting.models import Vote
 
 import localtv.settings
+from localtv import utils
 from localtv.models import Video, Category
 from localtv.search.forms import VideoSearchForm
-from localtv.search.utils import SortFilterViewMixin, SearchQuerysetSliceHack
+from localtv.search.utils import (SortFilterViewMixin, SearchQuerysetSliceHack,
+                                  make_cursor)
 
 
 VIDEOS_PER_PAGE = getattr(settings, 'VIDEOS_PER_PAGE', 15)
@@ -54,6 +58,58 @@ class VideoSearchView(ListView, SortFilterViewMixin):
     #: Period of time within which the video was approved.
     approved_since = None
 
+    def dispatch(self, request, *args, **kwargs):
+        # Unchanged listings get a 304 without being searched or rendered.
+        view = condition(etag_func=self._get_etag,
+                         last_modified_func=self._get_anonymous_last_modified)(
+            super(VideoSearchView, self).dispatch)
+        return vary_on_cookie(view)(request, *args, **kwargs)
+
+    def _get_anonymous_last_modified(self, request, *args, **kwargs):
+        # Unlike the ETag, Last-Modified can't tell users apart, so only
+        # anonymous users can be sent a 304 for If-Modified-Since alone.
+        if request.user.is_authenticated():
+            return None
+        return self._get_last_modified_header(request, *args, **kwargs)
+
+    def _get_cache_version_names(self, **kwargs):
+        """
+        Returns the names of the cache versions (see
+        :func:`localtv.utils.get_cache_versions`) of the object which the
+        listing is filtered by default, given the view's arguments.
+
+        """
+        if self.default_filter == 'category':
+            return ['category:%i:%s' % (settings.SITE_ID, kwargs['slug'])]
+        elif self.default_filter in ('author', 'feed'):
+            return ['%s:%s' % (self.default_filter, kwargs['pk'])]
+        elif self.default_filter == 'tag':
+            return ['tag:%s' % kwargs['name']]
+        return []
+
+    def _get_etag_parts(self, request, *args, **kwargs):
+        parts = super(VideoSearchView, self)._get_etag_parts(request, *args,
+                                                             **kwargs)
+        # The page can differ for each user, and a listing of recently
+        # approved videos changes as they age out of it.
+        version_names = self._get_cache_version_names(**kwargs)
+        parts.extend([self.template_name, request.user.pk,
+                      utils.get_cache_versions(*version_names)])
+        if self.approved_since is not None:
+            parts.append(datetime.date.today())
+        return parts
+
+    def _get_approved_cutoff(self):
+        """
+        Returns the time after which videos must have been approved to be
+        listed. This is counted from the start of the day, like the ETag, so
+        that the query (and its cached result count) is the same all day.
+
+        """
+        today = datetime.datetime.combine(datetime.date.today(),
+                                          datetime.time())
+        return today - self.approved_since
+
     def get_paginate_by(self, queryset):
         paginate_by = self.request.GET.get('count')
         if paginate_by:
@@ -84,13 +140,51 @@ class VideoSearchView(ListView, SortFilterViewMixin):
         if self.approved_since is not None:
             sqs = sqs.exclude(
                 when_approved=self._empty_value['approved']
-            ).filter(when_approved__gt=(
-                            datetime.datetime.now() - self.approved_since))
+            ).filter(when_approved__gt=self._get_approved_cutoff())
+
+        # With an ``after`` cursor, :meth:`paginate_queryset` starts from
+        # the cursor rather than from a page number.
+        self._cursor = self._get_cursor(self.request)
+        sqs, self._cursor_start = self._seek(sqs, self._get_sort(self.request),
+                                             self._cursor)
+        self._next_cursor = None
 
+        count_max_age = localtv.settings.RESULT_COUNT_ESTIMATE_AGE
+        if localtv.settings.LISTING_FROM_INDEX:
+            return SearchQuerysetSliceHack(sqs, from_index=True,
+                                           count_max_age=count_max_age)
         # :meth:`SearchQuerySet.load_all` sets the queryset up to load all, but
         # doesn't actually perform any loading; this will only happen when the
         # cache is filled.
-        return SearchQuerysetSliceHack(sqs.load_all())
+        return SearchQuerysetSliceHack(sqs.load_all(),
+                                       count_max_age=count_max_age)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates as usual, unless there's an ``after`` cursor, in which case
+        the page following the cursor is returned as the only page, without
+        counting the results. Either way, the cursor for the next page is
+        stored for :meth:`get_context_data`.
+
+        """
+        sort = self._get_sort(self.request)
+        if self._cursor_start is None:
+            paginator, page, object_list, is_paginated = super(
+                VideoSearchView, self).paginate_queryset(queryset, page_size)
+            if page.has_next():
+                self._next_cursor = self._get_next_cursor(
+                    sort, queryset.last_results,
+                    searchqueryset=queryset.searchqueryset,
+                    start=page.start_index() - 1)
+            return paginator, page, object_list, is_paginated
+
+        object_list = queryset[self._cursor_start:
+                               self._cursor_start + page_size]
+        if len(queryset.last_results) == page_size:
+            self._next_cursor = self._get_next_cursor(
+                sort, queryset.last_results, self._cursor)
+        paginator = Paginator(object_list, page_size)
+        return paginator, paginator.page(1), object_list, False
 
     def get_context_data(self, **kwargs):
         """
@@ -116,6 +210,7 @@ class VideoSearchView(ListView, SortFilterViewMixin):
             querydict = self.request.GET.copy()
             querydict.pop('sort', None)
             querydict.pop('page', None)
+            querydict.pop('after', None)
             if s == sort:
                 # Reverse the current ordering if the sort is active.
                 querydict['sort'] = ''.join(('' if desc else '-', s))
@@ -125,6 +220,13 @@ class VideoSearchView(ListView, SortFilterViewMixin):
             sort_links[s] = ''.join(('?', querydict.urlencode()))
         context['sort_links'] = sort_links
 
+        context['next_page_url'] = None
+        if self._next_cursor is not None:
+            querydict = self.request.GET.copy()
+            querydict.pop('page', None)
+            querydict['after'] = make_cursor(*self._next_cursor)
+            context['next_page_url'] = ''.join(('?', querydict.urlencode()))
+
         context['filters'] = self._filter_dict
         context['filter_form'] = self.filter_form
         if self.default_filter in self._filter_dict:
@@ -0,0 +1,284 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2012 Participatory Culture Foundation
+#
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max, Min, Q
+from haystack import site
+from haystack.query import SearchQuerySet
+
+from localtv import utils
+from localtv.models import Video
+from localtv.tasks import DatabaseLockError, LockError
+
+#: The file (in ``MEDIA_ROOT``) which stores the ``when_modified`` and pk of
+#: the last video which was indexed.
+CHECKPOINT_FILENAME = '.update_index_checkpoint'
+#: Videos modified this long before the checkpoint are indexed again, in case
+#: they were saved in a transaction which committed late.
+CHECKPOINT_OVERLAP = datetime.timedelta(minutes=1)
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+#: The number of times a locked index is retried before giving up.
+LOCK_RETRIES = 8
+
+
+def checkpoint_path():
+    return os.path.join(settings.MEDIA_ROOT, CHECKPOINT_FILENAME)
+
+
+def read_checkpoint():
+    try:
+        fp = open(checkpoint_path())
+    except IOError:
+        return None
+    try:
+        data = json.load(fp)
+    finally:
+        fp.close()
+    return (datetime.datetime.strptime(data['when_modified'], DATETIME_FORMAT),
+            data['pk'])
+
+
+def write_checkpoint(when_modified, pk):
+    # Write to a temporary file and rename it, so that a crash can't leave a
+    # truncated checkpoint behind.
+    path = checkpoint_path()
+    tmp_path = '%s.%d' % (path, os.getpid())
+    fp = open(tmp_path, 'w')
+    try:
+        json.dump({'when_modified': when_modified.strftime(DATETIME_FORMAT),
+                   'pk': pk}, fp)
+    finally:
+        fp.close()
+    os.rename(tmp_path, path)
+
+
+def retry_on_lock(func, *args):
+    """
+    Calls ``func`` with ``args``, retrying with a random backoff if the index
+    is locked by another process.
+    """
+    for attempt in xrange(LOCK_RETRIES):
+        try:
+            return func(*args)
+        except (DatabaseLockError, LockError):
+            if attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(random.random() * (2 ** min(attempt, 4)))
+
+
+class PreparedIndex(object):
+    """
+    Stands in for the video search index when writing ``documents`` (a
+    dictionary of search documents keyed by pk) which were already prepared,
+    possibly by another process. Everything except preparing documents is
+    passed on to the real index.
+    """
+    def __init__(self, search_index, documents):
+        self.search_index = search_index
+        self.documents = documents
+
+    def full_prepare(self, video):
+        return self.documents[video.pk]
+
+    def __getattr__(self, name):
+        return getattr(self.search_index, name)
+
+
+def prepare_videos(videos):
+    """
+    Prepares the search documents for ``videos``, a list of ``(pk, status)``
+    tuples. Returns a ``(documents, inactive_pks)`` tuple of the documents of
+    the active videos, keyed by pk, and the pks of the other videos.
+    """
+    search_index = site.get_index(Video)
+    active_pks = [pk for pk, status in videos if status == Video.ACTIVE]
+    inactive_pks = [pk for pk, status in videos if status != Video.ACTIVE]
+    documents = {}
+    if active_pks:
+        for video in search_index.index_queryset().filter(pk__in=active_pks):
+            documents[video.pk] = search_index.full_prepare(video)
+    return documents, inactive_pks
+
+
+def write_videos(documents, inactive_pks):
+    """
+    Writes the ``documents`` returned by :func:`prepare_videos` with a single
+    backend update, and removes any of the ``inactive_pks`` which are still
+    in the index.
+    """
+    search_index = site.get_index(Video)
+    if documents:
+        # Unsaved videos are enough for the backend to identify documents.
+        retry_on_lock(search_index.backend.update,
+                      PreparedIndex(search_index, documents),
+                      [Video(pk=pk) for pk in sorted(documents)])
+    if inactive_pks:
+        if settings.HAYSTACK_SEARCH_ENGINE == 'xapian':
+            # The pk_hack field shadows the model's pk/django_id because
+            # xapian-haystack's django_id filtering is broken.
+            haystack_filter = {'pk_hack__in': inactive_pks}
+        else:
+            haystack_filter = {'django_id__in': inactive_pks}
+        if SearchQuerySet().models(Video).filter(**haystack_filter).count():
+            for pk in inactive_pks:
+                retry_on_lock(search_index.remove_object, Video(pk=pk))
+    # Feeds are read from the index, so anything cached for them is stale.
+    utils.bump_cache_version('site:%i' % settings.SITE_ID)
+
+
+def index_videos(videos):
+    """
+    Brings the index up to date for ``videos``, a list of ``(pk, status)``
+    tuples. Active videos are written with a single backend update; any of the
+    other videos which are still in the index are removed.
+    """
+    write_videos(*prepare_videos(videos))
+
+
+def prepare_pk_range(pk_range):
+    """
+    Returns :func:`prepare_videos` for every video with a pk from the start
+    of ``pk_range`` up to, but not including, its end. This is run by the
+    worker processes of full updates.
+    """
+    start, end = pk_range
+    return prepare_videos(list(Video.objects.filter(
+                pk__gte=start, pk__lt=end).values_list('pk', 'status')))
+
+
+def index_pk_range(start, end, batch_size, verbosity=1):
+    """
+    Indexes every video with a pk from ``start`` up to, but not including,
+    ``end``.
+    """
+    videos = Video.objects.filter(pk__gte=start, pk__lt=end).order_by('pk')
+    last_pk = start - 1
+    while True:
+        batch = list(videos.filter(pk__gt=last_pk).values_list(
+                'pk', 'status')[:batch_size])
+        if not batch:
+            break
+        index_videos(batch)
+        last_pk = batch[-1][0]
+        if verbosity >= 2:
+            print 'indexed %i videos up to pk %i' % (len(batch), last_pk)
+
+
+class Command(BaseCommand):
+    help = ('Updates the search index for videos which have changed since the '
+            'last run.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500,
+                    help='Number of videos to index at a time.'),
+        make_option('--full', action='store_true', dest='full',
+                    default=False,
+                    help='Index every video, ignoring the checkpoint.'),
+        make_option('--workers', type='int', dest='workers', default=1,
+                    help=('With --full, the number of processes which prepare '
+                          'documents for this one to write.')),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        batch_size = options['batch_size']
+        if options['full']:
+            self.handle_full(batch_size, options['workers'], verbosity)
+        else:
+            self.handle_incremental(batch_size, verbosity)
+
+    def handle_incremental(self, batch_size, verbosity):
+        """
+        Indexes the videos modified since the checkpoint, in order of
+        ``when_modified``, saving the checkpoint after each batch so that an
+        interrupted run picks up where it left off.
+        """
+        updated_field = site.get_index(Video).get_updated_field()
+        changed = Video.objects.order_by(updated_field, 'pk').values_list(
+            'pk', 'status', updated_field)
+        checkpoint = read_checkpoint()
+        if checkpoint is not None:
+            changed = changed.filter(**{'%s__gte' % updated_field:
+                                        checkpoint[0] - CHECKPOINT_OVERLAP})
+        videos = changed
+        count = 0
+        while True:
+            batch = list(videos[:batch_size])
+            if not batch:
+                break
+            index_videos([(pk, status) for pk, status, modified in batch])
+            last_pk, last_status, last_modified = batch[-1]
+            write_checkpoint(last_modified, last_pk)
+            count += len(batch)
+            # Keyset pagination on (when_modified, pk).
+            videos = changed.filter(
+                Q(**{'%s__gt' % updated_field: last_modified}) |
+                Q(**{updated_field: last_modified, 'pk__gt': last_pk}))
+        if verbosity >= 1:
+            print 'indexed %i changed videos' % count
+
+    def handle_full(self, batch_size, workers, verbosity):
+        """
+        Indexes every video. With more than one worker, the documents are
+        prepared by that many processes, each taking ``batch_size`` pks at a
+        time, and written by this one, so that the workers never contend for
+        the index's write lock.
+        """
+        started = datetime.datetime.now()
+        bounds = Video.objects.aggregate(start=Min('pk'), end=Max('pk'))
+        if bounds['start'] is not None:
+            start, end = bounds['start'], bounds['end'] + 1
+            if workers <= 1:
+                index_pk_range(start, end, batch_size, verbosity)
+            else:
+                pk_ranges = [(range_start, min(range_start + batch_size, end))
+                             for range_start in xrange(start, end,
+                                                       batch_size)]
+                # Each worker needs its own database connection.
+                connection.close()
+                pool = multiprocessing.Pool(workers)
+                try:
+                    results = pool.imap(prepare_pk_range, pk_ranges)
+                    for (range_start, range_end), (documents, inactive_pks) \
+                            in itertools.izip(pk_ranges, results):
+                        write_videos(documents, inactive_pks)
+                        if verbosity >= 2:
+                            print 'indexed %i videos up to pk %i' % (
+                                len(documents) + len(inactive_pks),
+                                range_end - 1)
+                except Exception:
+                    pool.terminate()
+                    raise
+                else:
+                    pool.close()
+                finally:
+                    pool.join()
+        # Everything modified before we started has been indexed.
+        write_checkpoint(started, 0)
+        if verbosity >= 1:
+            print 'indexed all videos'
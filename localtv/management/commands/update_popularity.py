@@ -0,0 +1,44 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2010, 2011, 2012 Participatory Culture Foundation
+# 
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+# 
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+# 
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from localtv.management import site_too_old
+
+class Command(NoArgsCommand):
+
+    help = ('Recalculates which videos are popular from the watches in the '
+            'last LOCALTV_POPULAR_WINDOW days.')
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild',
+                    default=False,
+                    help=('Count the hourly watch buckets again from the '
+                          'individual watches first.')),
+    )
+
+    def handle_noargs(self, **options):
+        if site_too_old():
+            return
+
+        from localtv import tasks
+        from localtv.models import WatchBucket
+
+        if options['rebuild']:
+            WatchBucket.rebuild()
+        tasks.update_popularity.delay(
+            using=tasks.CELERY_USING)
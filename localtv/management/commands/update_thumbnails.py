@@ -15,33 +15,69 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import multiprocessing
 import traceback
+from optparse import make_option
 
 from django.core.files.storage import default_storage
 from django.core.management.base import NoArgsCommand
+from django.db import connection
 from django.db.models import Q
 
 from localtv.management import site_too_old
 from localtv import models
 
+
+def update_thumbnail(pk, verbosity=0):
+    """
+    Saves the thumbnail for the video with the given pk, if the original is
+    missing from storage.
+    """
+    v = models.Video.objects.get(pk=pk)
+    path = v.get_original_thumb_storage_path()
+    if not default_storage.exists(path):
+        if verbosity >= 1:
+            print 'saving', v, '(%i)' % v.pk
+        try:
+            # resave the thumbnail
+            v.save_thumbnail()
+        except Exception:
+            traceback.print_exc()
+
+
+def _update_thumbnail_star(args):
+    return update_thumbnail(*args)
+
+
 class Command(NoArgsCommand):
 
     args = ''
+    option_list = NoArgsCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=1,
+                    help=('The number of processes to download and resize '
+                          'thumbnails in.')),
+    )
 
-    def handle_noargs(self, verbosity=0, **options):
+    def handle_noargs(self, verbosity=0, processes=1, **options):
         if site_too_old():
             return
+        verbosity = int(verbosity)
         has_thumbnail = Q(has_thumbnail=True)
         has_thumbnail_url = ~Q(thumbnail_url='')
-        for v in models.Video.objects.filter(has_thumbnail |
-                                             has_thumbnail_url):
-            path = v.get_original_thumb_storage_path()
-            if not default_storage.exists(path):
-                if verbosity >= 1:
-                    print 'saving', v, '(%i)' % v.pk
-                try:
-                    # resave the thumbnail
-                    v.save_thumbnail()
-                except Exception:
-                    traceback.print_exc()
-
+        pks = models.Video.objects.filter(has_thumbnail |
+                                          has_thumbnail_url).values_list(
+            'pk', flat=True)
+        if processes <= 1:
+            for pk in pks.iterator():
+                update_thumbnail(pk, verbosity)
+            return
+        # Each process needs its own database connection.
+        pks = list(pks)
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        try:
+            pool.map(_update_thumbnail_star,
+                     [(pk, verbosity) for pk in pks], chunksize=20)
+        finally:
+            pool.close()
+            pool.join()
@@ -17,13 +17,14 @@
 
 import datetime
 import email.utils
+import hashlib
 import httplib
 import itertools
 import re
-import urllib
 import urllib2
 import mimetypes
 import base64
+import cPickle
 import os
 import logging
 import sys
@@ -36,13 +37,14 @@ except ImportError:
 import time
 from BeautifulSoup import BeautifulSoup
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.comments.moderation import CommentModerator, moderator
 from django.contrib.sites.models import Site
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.core.mail import EmailMessage
@@ -143,13 +145,9 @@ class Thumbnailable(models.Model):
             raise CannotOpenImageUrl('An image could not be loaded')
 
         # save an unresized version, overwriting if necessary
-        delete_if_exists(
-            self.get_original_thumb_storage_path())
-
         self.thumbnail_extension = pil_image.format.lower()
-        default_storage.save(
-            self.get_original_thumb_storage_path(),
-            content_thumb)
+        self.store_thumbnail_file(self.get_original_thumb_storage_path(),
+                                  content_thumb)
 
         if hasattr(content_thumb, 'temporary_file_path'):
             # might have gotten moved by Django's storage system, so it might
@@ -176,14 +174,25 @@ class Thumbnailable(models.Model):
         if resized_images is None:
             resized_images = utils.resize_image_returning_list_of_strings(
                 thumb, self.THUMB_SIZES)
-        for ( (width, height), data) in resized_images:
-            # write file, deleting old thumb if it exists
-            cf_image = ContentFile(data)
-            delete_if_exists(
-                self.get_resized_thumb_storage_path(width, height))
-            default_storage.save(
+
+        def save_resized_image(resized_image):
+            (width, height), data = resized_image
+            self.store_thumbnail_file(
                 self.get_resized_thumb_storage_path(width, height),
-                cf_image)
+                ContentFile(data))
+
+        # The storage round trips are independent, so they're done
+        # concurrently.
+        utils.thread_map(save_resized_image, resized_images,
+                         lsettings.THUMBNAIL_WRITE_THREADS)
+
+    def store_thumbnail_file(self, path, content):
+        """
+        Writes one of the thumbnail files to the default file storage system,
+        replacing the old file if it exists.
+        """
+        delete_if_exists(path)
+        default_storage.save(path, content)
 
     def get_original_thumb_storage_path(self):
         """
@@ -203,12 +212,15 @@ class Thumbnailable(models.Model):
             self._meta.object_name.lower(),
             self.id, width, height)
 
-    def delete_thumbnails(self):
-        self.has_thumbnail = False
+    def delete_thumbnail_files(self):
         delete_if_exists(self.get_original_thumb_storage_path())
         for size in self.THUMB_SIZES:
             delete_if_exists(
                 self.get_resized_thumb_storage_path(*size[:2]))
+
+    def delete_thumbnails(self):
+        self.has_thumbnail = False
+        self.delete_thumbnail_files()
         self.thumbnail_extension = ''
         self.save()
 
@@ -217,27 +229,98 @@ class Thumbnailable(models.Model):
         super(Thumbnailable, self).delete(*args, **kwargs)
 
 
+class RemoteThumbnail(models.Model):
+    """
+    The cache validators from the last time a thumbnail URL was downloaded,
+    so that it can be requested again conditionally.
+
+    fields:
+     - url_hash: the SHA1 of the URL, which can be too long to index
+     - etag: the ETag header of the response
+     - last_modified: the Last-Modified header of the response
+     - content_hash: the SHA1 of the image
+    """
+    url_hash = models.CharField(max_length=40, unique=True)
+    etag = models.CharField(max_length=250, blank=True)
+    last_modified = models.CharField(max_length=50, blank=True)
+    content_hash = models.CharField(max_length=40, blank=True)
+
+
+#: The SiteLocations used by this process, keyed on ``(db, site_id)``. Each
+#: value is a ``(version, checked, site_location)`` tuple, where ``checked`` is
+#: when ``version`` was last compared with the shared cache version.
 SITE_LOCATION_CACHE = {}
+#: Pickled copies of the SiteLocations in ``SITE_LOCATION_CACHE``, keyed the
+#: same way, as ``(version, pickled)`` tuples. Each request unpickles its own
+#: copy, so changes a request makes without saving don't leak into the next.
+SITE_LOCATION_DATA = {}
+#: The sites whose SiteLocation was saved or deleted inside a transaction
+#: during the current request. Their cache version is bumped again once the
+#: request has finished and the transaction is committed, since another
+#: process could have cached the old row under the version bumped before.
+SITE_LOCATION_PENDING = set()
+
+
+def _site_location_version_name(site_id):
+    return 'sitelocation:%i' % site_id
 
 
 class SiteLocationManager(models.Manager):
-    def get_current(self):
-        sid = settings.SITE_ID
+    def _get_cached(self, site_id, fetch):
+        """
+        Returns the SiteLocation for ``site_id``, or the result of ``fetch``
+        if it isn't cached.
+
+        SiteLocations are cached in three tiers: the live object for the
+        current request, a pickled copy for this process and a copy in the
+        shared cache. The shared cache version for the site is bumped
+        whenever it's saved, and the other processes notice the next time
+        they check it.
+
+        """
+        key = (self._db, site_id)
+        now = time.time()
         try:
-            # Dig it out of the cache.
-            current_site_location = SITE_LOCATION_CACHE[(self._db, sid)]
+            version, checked, site_location = SITE_LOCATION_CACHE[key]
         except KeyError:
-            # Not in the cache? Time to put it in the cache.
+            version = None
+        else:
+            if now - checked < lsettings.SITE_LOCATION_CHECK_INTERVAL:
+                return site_location
+
+        current_version = utils.get_cache_versions(
+            _site_location_version_name(site_id))[0]
+        if version == current_version:
+            SITE_LOCATION_CACHE[key] = (version, now, site_location)
+            return site_location
+
+        data_version, pickled = SITE_LOCATION_DATA.get(key, (None, None))
+        if data_version != current_version:
+            cache_key = 'localtv:sitelocation:%s:%i:%s' % (
+                self._db, site_id, current_version)
+            pickled = cache.get(cache_key)
+            if pickled is None:
+                site_location = fetch()
+                pickled = cPickle.dumps(site_location,
+                                        cPickle.HIGHEST_PROTOCOL)
+                cache.set(cache_key, pickled,
+                          lsettings.SITE_LOCATION_CACHE_TIMEOUT)
+            SITE_LOCATION_DATA[key] = (current_version, pickled)
+        site_location = cPickle.loads(pickled)
+        SITE_LOCATION_CACHE[key] = (current_version, now, site_location)
+        return site_location
+
+    def get_current(self):
+        sid = settings.SITE_ID
+        def fetch():
             try:
                 # If it is in the DB, get it.
-                current_site_location = self.select_related().get(site__pk=sid)
+                return self.select_related().get(site__pk=sid)
             except SiteLocation.DoesNotExist:
                 # Otherwise, create it.
-                current_site_location = self.create(
+                return self.create(
                     site=Site.objects.db_manager(self._db).get_current())
-
-            SITE_LOCATION_CACHE[(self._db, sid)] = current_site_location
-        return current_site_location
+        return self._get_cached(sid, fetch)
 
     def get(self, **kwargs):
         if 'site' in kwargs:
@@ -245,17 +328,22 @@ class SiteLocationManager(models.Manager):
             if not isinstance(site, (int, long, basestring)):
                 site = site.id
             site = int(site)
-            try:
-                return SITE_LOCATION_CACHE[(self._db, site)]
-            except KeyError:
-                pass
-        site_location = models.Manager.get(self, **kwargs)
-        SITE_LOCATION_CACHE[(self._db, site_location.site_id)] = site_location
-        return site_location
+            return self._get_cached(
+                site, lambda: models.Manager.get(self, **kwargs))
+        return models.Manager.get(self, **kwargs)
 
     def clear_cache(self):
-        global SITE_LOCATION_CACHE
-        SITE_LOCATION_CACHE = {}
+        """
+        Forgets every SiteLocation cached by this process, and invalidates
+        the shared cache for them and the current site.
+
+        """
+        site_ids = set(site_id for db, site_id in SITE_LOCATION_CACHE)
+        site_ids.add(settings.SITE_ID)
+        utils.bump_cache_version(*[_site_location_version_name(site_id)
+                                   for site_id in site_ids])
+        SITE_LOCATION_CACHE.clear()
+        SITE_LOCATION_DATA.clear()
 
 
 class SingletonManager(models.Manager):
@@ -457,10 +545,6 @@ class SiteLocation(Thumbnailable):
 
         return bool(self.admins.filter(pk=user.pk).count())
 
-    def save(self, *args, **kwargs):
-        SITE_LOCATION_CACHE[self.site_id] = self
-        return models.Model.save(self, *args, **kwargs)
-
     def get_tier(self):
         return localtv.tiers.Tier(self.tier_name, self)
 
@@ -686,6 +770,86 @@ class WidgetSettings(Thumbnailable):
         return prefix % suffix
 
 
+class VideoDuplicateIndex(object):
+    """
+    An in-memory index of the guids and website urls of a site's videos, used
+    to classify the videos found during an import without querying the
+    database once per video. The site's videos are loaded with a single query
+    the first time a video is classified.
+
+    """
+    #: The video is not in the index.
+    NEW = 'new'
+    #: The video is only in the index as rejected videos, which should be
+    #: deleted before it is imported again.
+    REJECTED_DUPLICATE = 'rejected-duplicate'
+    #: A video with the same guid is in the index.
+    DUPLICATE_GUID = 'duplicate-guid'
+    #: A video with the same website url is in the index.
+    DUPLICATE_LINK = 'duplicate-link'
+
+    def __init__(self, site_pk, using='default'):
+        self.site_pk = site_pk
+        self.using = using
+        self.guids = None
+        self.links = None
+
+    def load(self):
+        """
+        Loads the guids and website urls of all the site's videos. Each value
+        maps to a list of ``(pk, is_rejected)`` tuples.
+
+        """
+        self.guids = {}
+        self.links = {}
+        videos = Video.objects.using(self.using).filter(site=self.site_pk
+                                ).values_list('pk', 'guid', 'website_url',
+                                              'status')
+        for pk, guid, link, status in videos.iterator():
+            entry = (pk, status == Video.REJECTED)
+            if guid:
+                self.guids.setdefault(guid, []).append(entry)
+            if link:
+                self.links.setdefault(link, []).append(entry)
+
+    def classify(self, vidscraper_video, clear_rejected=False):
+        """
+        Returns a tuple ``(classification, rejected_pks)`` for the
+        ``vidscraper_video``. ``rejected_pks`` is a list of the pks of rejected
+        videos with the same guid or website url, which need to be deleted
+        whether or not the video is imported; it will only be non-empty if
+        ``clear_rejected`` is ``True``. They are removed from the index.
+
+        Videos classified as :attr:`NEW` or :attr:`REJECTED_DUPLICATE` aren't
+        added to the index, since they may still fail to be imported; the
+        import task checks them for duplicates again once they're loaded.
+
+        """
+        if self.guids is None:
+            self.load()
+        rejected_pks = []
+        classification = None
+        lookups = ((vidscraper_video.guid, self.guids, self.DUPLICATE_GUID),
+                   (vidscraper_video.link, self.links, self.DUPLICATE_LINK))
+        for value, index, duplicate in lookups:
+            if not value or value not in index:
+                continue
+            entries = index[value]
+            if clear_rejected:
+                rejected_pks.extend(pk for pk, is_rejected in entries
+                                    if is_rejected)
+                entries = index[value] = [entry for entry in entries
+                                          if not entry[1]]
+            if entries and classification is None:
+                classification = duplicate
+
+        if classification is not None:
+            return classification, rejected_pks
+        if rejected_pks:
+            return self.REJECTED_DUPLICATE, rejected_pks
+        return self.NEW, []
+
+
 class Source(Thumbnailable):
     """
     An abstract base class to represent things which are sources of multiple
@@ -719,21 +883,36 @@ class Source(Thumbnailable):
         If ``clear_rejected`` is ``True``, rejected versions of videos that are
         found in the ``video_iter`` will be deleted and re-imported.
 
+        Videos are checked against a :class:`VideoDuplicateIndex` of the site's
+        videos, and the new ones are handed to the import tasks in chunks of
+        ``LOCALTV_IMPORT_CHUNK_SIZE``.
+
         """
         author_pks = list(self.auto_authors.values_list('pk', flat=True))
         category_pks = list(self.auto_categories.values_list('pk', flat=True))
 
         import_opts = source_import.__class__._meta
 
-        from localtv.tasks import video_from_vidscraper_video, mark_import_pending
+        from localtv.tasks import video_from_vidscraper_videos, mark_import_pending
 
         total_videos = 0
-
-        for vidscraper_video in video_iter:
-            total_videos += 1
+        chunk = []
+        rejected_pks = []
+        skips = []
+        duplicates = VideoDuplicateIndex(self.site_id, using)
+
+        def enqueue_chunk(chunk):
+            if rejected_pks:
+                Video.objects.using(using).filter(pk__in=rejected_pks).delete()
+                del rejected_pks[:]
+            if skips:
+                source_import.handle_skips(skips, using=using)
+                del skips[:]
+            if not chunk:
+                return
             try:
-                video_from_vidscraper_video.delay(
-                    vidscraper_video,
+                video_from_vidscraper_videos.delay(
+                    chunk,
                     site_pk=self.site_id,
                     import_app_label=import_opts.app_label,
                     import_model=import_opts.module_name,
@@ -744,13 +923,32 @@ class Source(Thumbnailable):
                     clear_rejected=clear_rejected,
                     using=using)
             except:
-                source_import.handle_error(
-                    'Import task creation failed for %r' % (
-                        vidscraper_video.url,),
-                    is_skip=True,
-                    with_exception=True,
+                tb = traceback.format_exc()
+                source_import.handle_skips(
+                    [('Import task creation failed for %r' % (
+                        vidscraper_video.url,), tb)
+                     for vidscraper_video in chunk],
                     using=using)
 
+        for vidscraper_video in video_iter:
+            total_videos += 1
+            classification, pks = duplicates.classify(vidscraper_video,
+                                                      clear_rejected)
+            rejected_pks.extend(pks)
+            if classification == VideoDuplicateIndex.DUPLICATE_GUID:
+                skips.append(('Skipping %r: duplicate guid.' %
+                              vidscraper_video.url, ''))
+            elif classification == VideoDuplicateIndex.DUPLICATE_LINK:
+                skips.append(('Skipping %r: duplicate link.' %
+                              vidscraper_video.url, ''))
+            else:
+                chunk.append(vidscraper_video)
+            if (len(chunk) >= lsettings.IMPORT_CHUNK_SIZE or
+                len(skips) >= lsettings.IMPORT_CHUNK_SIZE):
+                enqueue_chunk(chunk)
+                chunk = []
+        enqueue_chunk(chunk)
+
         source_import.__class__._default_manager.using(using).filter(
             pk=source_import.pk
         ).update(
@@ -1209,6 +1407,34 @@ class SourceImport(models.Model):
             self.__class__._default_manager.using(using).filter(pk=self.pk
                         ).update(videos_skipped=models.F('videos_skipped') + 1)
 
+    def handle_skips(self, skips, using='default'):
+        """
+        Bulk version of :meth:`handle_error` for skipped videos. Each error is
+        logged with the default logger, and all of them are written to the
+        database with a single insert.
+
+        :param skips: A list of ``(message, traceback)`` tuples, where
+                      ``traceback`` is a formatted traceback or an empty
+                      string.
+        :param using: The database to use. Default: 'default'.
+
+        """
+        if not skips:
+            return
+        errors = []
+        for message, tb in skips:
+            if tb:
+                logging.warn('%s\n%s', message, tb)
+            else:
+                logging.warn(message)
+            errors.append(self.errors.model(message=message,
+                                            source_import=self,
+                                            traceback=tb,
+                                            is_skip=True))
+        utils.bulk_insert(self.errors.model, errors, using=using)
+        self.__class__._default_manager.using(using).filter(pk=self.pk
+                ).update(videos_skipped=models.F('videos_skipped') + len(skips))
+
     def get_index_creation_kwargs(self, video, vidscraper_video):
         return {
             'source_import': self,
@@ -1230,6 +1456,26 @@ class SourceImport(models.Model):
         self.__class__._default_manager.using(using).filter(pk=self.pk
                     ).update(videos_imported=models.F('videos_imported') + 1)
 
+    def handle_videos(self, videos, using='default'):
+        """
+        Bulk version of :meth:`handle_video`; creates all the index instances
+        with a single insert.
+
+        :param videos: A list of ``(video, vidscraper_video)`` tuples.
+        :param using: The database alias to use. Default: 'default'
+
+        """
+        if not videos:
+            return
+        index_model = self.indexes.model
+        utils.bulk_insert(index_model,
+                          [index_model(**self.get_index_creation_kwargs(
+                                                video, vidscraper_video))
+                           for video, vidscraper_video in videos],
+                          using=using)
+        self.__class__._default_manager.using(using).filter(pk=self.pk
+            ).update(videos_imported=models.F('videos_imported') + len(videos))
+
 
 class FeedImport(SourceImport):
     source = models.ForeignKey(Feed, related_name='imports')
@@ -1548,6 +1794,29 @@ localtv_watch.timestamp > %s"""},
         )
 
 
+    def with_recent_watches(self):
+        """
+        Returns a QuerySet of videos annotated with a ``watch_count`` of the
+        watches in the popularity window, read from :class:`WatchCount`.
+        """
+        return self.extra(
+            select={'watch_count': """COALESCE((SELECT recent FROM
+localtv_watchcount WHERE localtv_watchcount.video_id = localtv_video.id),
+0)"""})
+
+    def with_total_watches(self):
+        """
+        Returns a QuerySet of videos annotated with a ``watch_count`` of all
+        watches, read from :class:`WatchCount`. Videos without a
+        :class:`WatchCount` fall back to counting their watches.
+        """
+        return self.extra(
+            select={'watch_count': """COALESCE((SELECT total FROM
+localtv_watchcount WHERE localtv_watchcount.video_id = localtv_video.id),
+(SELECT COUNT(*) FROM localtv_watch WHERE
+localtv_watch.video_id = localtv_video.id))"""})
+
+
 class VideoManager(models.Manager):
 
     def get_query_set(self):
@@ -1559,6 +1828,25 @@ class VideoManager(models.Manager):
     def popular_since(self, *args, **kwargs):
         return self.get_query_set().popular_since(*args, **kwargs)
 
+    def get_last_modified(self):
+        """
+        Returns the time of the most recent change to any video, or ``None``
+        if there are no videos. If ``LOCALTV_ENABLE_CHANGE_STAMPS`` is set,
+        this is read from the video-published stamp instead of the database.
+
+        """
+        if lsettings.ENABLE_CHANGE_STAMPS:
+            try:
+                return datetime.datetime.fromtimestamp(os.stat(
+                        os.path.join(settings.MEDIA_ROOT,
+                                     '.video-published-stamp')).st_mtime)
+            except OSError:
+                pass
+        for when_modified in self.order_by('-when_modified').values_list(
+            'when_modified', flat=True)[:1]:
+            return when_modified
+        return None
+
     def get_sitelocation_videos(self, sitelocation=None):
         """
         Returns a QuerySet of videos which are active and tied to the
@@ -1599,14 +1887,33 @@ class VideoManager(models.Manager):
     def get_popular_videos(self, sitelocation=None):
         """
         Returns a ``QuerySet`` of active videos considered "popular" for the
-        current sitelocation.
+        current sitelocation, i.e. ordered by the number of watches in the
+        last ``LOCALTV_POPULAR_WINDOW`` days. Videos without a
+        :class:`WatchCount` are left out, since NULLs sort first in descending
+        order on some databases.
 
         """
-        return self.get_latest_videos(sitelocation).with_watch_count().order_by(
-            '-watch_count',
+        return self.get_latest_videos(sitelocation).filter(
+            watchcount__isnull=False).order_by(
+            '-watchcount__recent',
             '-best_date'
         )
 
+    def get_related_videos(self, video, limit=None):
+        """
+        Returns a ``QuerySet`` of up to ``limit`` of the active videos related
+        to ``video``, most closely related first, as worked out by
+        :func:`localtv.tasks.update_related_videos`. Their feeds and searches
+        are loaded with them, since their thumbnails can come from either.
+
+        """
+        videos = self.filter(status=Video.ACTIVE,
+                             related_by__video=video).select_related(
+            'feed', 'search').order_by('-related_by__score')
+        if limit is not None:
+            videos = videos[:limit]
+        return videos
+
     def get_category_videos(self, category, sitelocation=None):
         """
         Returns a ``QuerySet`` of active videos considered part of the selected
@@ -1698,6 +2005,9 @@ class Video(Thumbnailable, VideoBase):
      - thumbnail_extension: extension of the *internal* thumbnail, saved on the
        server (usually paired with the id, so we can determine "1123.jpg" or
        "1186.png"
+     - thumbnail_hash: the SHA1 of the thumbnail image. Thumbnails are stored
+       under their hash, so videos with the same image share one set of
+       files.
      - user: if not None, the user who submitted this video
      - search: if not None, the SavedSearch from which this video came
      - video_service_user: if not blank, the username of the user on the video
@@ -1752,6 +2062,8 @@ class Video(Thumbnailable, VideoBase):
                                default='')
     notes = models.TextField(blank=True)
     calculated_source_type = models.CharField(max_length=255, blank=True, default='')
+    thumbnail_hash = models.CharField(max_length=40, blank=True,
+                                      db_index=True)
 
     objects = VideoManager()
 
@@ -1906,14 +2218,40 @@ class Video(Thumbnailable, VideoBase):
     def save_thumbnail(self):
         """
         Automatically run the entire file saving process... provided we have a
-        thumbnail_url, that is.
+        thumbnail_url, that is. If the thumbnail was downloaded before, it is
+        only downloaded again if the server says it has changed.
         """
         if not self.thumbnail_url:
             return
 
+        url = utils.quote_unicode_url(self.thumbnail_url)
+        url_hash = hashlib.sha1(url).hexdigest()
+        remote_thumbnails = RemoteThumbnail.objects.using(self._state.db)
+        remote, created = remote_thumbnails.get_or_create(url_hash=url_hash)
+
+        request = urllib2.Request(url)
+        if (self.has_thumbnail and remote.content_hash and
+            remote.content_hash == self.thumbnail_hash and
+            default_storage.exists(self.get_original_thumb_storage_path())):
+            if remote.etag:
+                request.add_header('If-None-Match', remote.etag)
+            if remote.last_modified:
+                request.add_header('If-Modified-Since', remote.last_modified)
         try:
-            content_thumb = ContentFile(urllib.urlopen(
-                    utils.quote_unicode_url(self.thumbnail_url)).read())
+            response = urllib2.urlopen(request)
+            content_thumb = ContentFile(response.read())
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                # We already have this thumbnail.
+                return
+            if 400 <= e.code < 500:
+                # Trying again won't help; like an image which can't be
+                # opened, this is only logged.
+                logging.warning('HTTP %i loading %r', e.code,
+                                self.thumbnail_url)
+                return
+            raise CannotOpenImageUrl('HTTP %i loading %s' % (
+                    e.code, self.thumbnail_url))
         except IOError:
             raise CannotOpenImageUrl('IOError loading %s' % self.thumbnail_url)
         except httplib.InvalidURL:
@@ -1922,11 +2260,96 @@ class Video(Thumbnailable, VideoBase):
             self.has_thumbnail = False
             self.save()
         else:
+            headers = response.info()
+            remote_thumbnails.filter(pk=remote.pk).update(
+                etag=headers.get('ETag', '')[:250],
+                last_modified=headers.get('Last-Modified', '')[:50],
+                content_hash=utils.hash_file_obj(content_thumb,
+                                                 close_it=False))
+            content_thumb.seek(0)
             try:
                 self.save_thumbnail_from_file(content_thumb)
             except Exception:
                 logging.exception("Error while getting " + repr(self.thumbnail_url))
 
+    def save_thumbnail_from_file(self, content_thumb, resize=True):
+        """
+        Stores the thumbnail under the SHA1 of its contents. If the video
+        already has this thumbnail, or another video does, the stored files
+        are used instead of being resized and saved again.
+        """
+        thumbnail_hash = utils.hash_file_obj(content_thumb, close_it=False)
+        content_thumb.seek(0)
+        old_hash, old_extension = (self.thumbnail_hash,
+                                   self.thumbnail_extension)
+        if (thumbnail_hash == old_hash and self.has_thumbnail and
+            default_storage.exists(self.get_original_thumb_storage_path())):
+            return
+
+        self.thumbnail_hash = thumbnail_hash
+        for extension in Video.objects.using(self._state.db).filter(
+            thumbnail_hash=thumbnail_hash, has_thumbnail=True).exclude(
+            pk=self.pk).values_list('thumbnail_extension', flat=True)[:1]:
+            self.thumbnail_extension = extension
+            if default_storage.exists(self.get_original_thumb_storage_path()):
+                self.has_thumbnail = True
+                self.save()
+                break
+        else:
+            super(Video, self).save_thumbnail_from_file(content_thumb, resize)
+
+        if old_hash != thumbnail_hash and (old_hash or old_extension):
+            # Clean up the old files, unless another video uses them.
+            old = Video(pk=self.pk, thumbnail_hash=old_hash,
+                        thumbnail_extension=old_extension)
+            old._state.db = self._state.db
+            old.delete_thumbnail_files()
+
+    def store_thumbnail_file(self, path, content):
+        """
+        Files stored by hash have the same contents whichever video stores
+        them, so they're never replaced. Replacing them would race with other
+        videos storing the same thumbnail: one could delete the file the other
+        had just saved, or have its own copy saved under another name.
+        """
+        if not self.thumbnail_hash:
+            return super(Video, self).store_thumbnail_file(path, content)
+        if default_storage.exists(path):
+            return
+        name = default_storage.save(path, content)
+        if name != path:
+            # Another video saved the file first.
+            default_storage.delete(name)
+
+    def _thumbnail_hash_path(self, filename):
+        return 'localtv/video_thumbs/by_hash/%s/%s/%s' % (
+            self.thumbnail_hash[:2], self.thumbnail_hash, filename)
+
+    def get_original_thumb_storage_path(self):
+        if not self.thumbnail_hash:
+            return super(Video, self).get_original_thumb_storage_path()
+        return self._thumbnail_hash_path('orig.%s' % self.thumbnail_extension)
+
+    def get_resized_thumb_storage_path(self, width, height):
+        if not self.thumbnail_hash:
+            return super(Video, self).get_resized_thumb_storage_path(width,
+                                                                    height)
+        return self._thumbnail_hash_path('%sx%s.png' % (width, height))
+
+    def delete_thumbnail_files(self):
+        if self.thumbnail_hash and Video.objects.using(self._state.db).filter(
+            thumbnail_hash=self.thumbnail_hash).exclude(pk=self.pk).exists():
+            # Other videos still use these files.
+            return
+        super(Video, self).delete_thumbnail_files()
+
+    def delete_thumbnails(self):
+        self.has_thumbnail = False
+        self.delete_thumbnail_files()
+        self.thumbnail_extension = ''
+        self.thumbnail_hash = ''
+        self.save()
+
     def submitter(self):
         """
         Return the user that submitted this video.  If necessary, use the
@@ -1971,6 +2394,32 @@ class Video(Thumbnailable, VideoBase):
         else:
             return 'posted'
 
+    def _related_list(self, field):
+        """
+        Returns a list of the video's ``field`` (``tags``, ``categories`` or
+        ``authors``). If the video was loaded with
+        :class:`localtv.search_indexes.VideoReadQuerySet`, as search results
+        are, the list was already fetched along with the other videos';
+        otherwise it's queried.
+
+        """
+        related_lists = getattr(self, '_related_lists', {})
+        if field in related_lists:
+            return related_lists[field]
+        return list(getattr(self, field).all())
+
+    @property
+    def tag_list(self):
+        return self._related_list('tags')
+
+    @property
+    def category_list(self):
+        return self._related_list('categories')
+
+    @property
+    def author_list(self):
+        return self._related_list('authors')
+
     def voting_enabled(self):
         if not lsettings.voting_enabled():
             return False
@@ -2014,6 +2463,24 @@ def video__video_service(self):
         if re.search(regexp, url, re.I):
             return service
 
+#: Cache keys for the watch buffer, formatted with the site's id; see
+#: :meth:`Watch.buffer`.
+WATCH_SEQUENCE_KEY = 'localtv:watches:%i:sequence'
+WATCH_FLUSHED_KEY = 'localtv:watches:%i:flushed'
+WATCH_SLOT_KEY = 'localtv:watches:%i:slot:%i'
+WATCH_FLUSH_SCHEDULED_KEY = 'localtv:watches:%i:flush_scheduled'
+WATCH_FLUSH_LOCK_KEY = 'localtv:watches:%i:flush_lock'
+WATCH_COUNT_LOCK_KEY = 'localtv:watches:%i:count_lock'
+#: A buffered watch's slot is numbered before it's written, so a missing slot
+#: is only given up on (as evicted) once a later slot is this old.
+WATCH_SLOT_GRACE_PERIOD = datetime.timedelta(seconds=10)
+#: Set to the time at which :func:`localtv.tasks.update_popularity` last
+#: changed any video's popularity on the site whose id it's formatted with.
+POPULARITY_UPDATED_KEY = 'localtv:popularity_updated:%i'
+#: How long the watch buffer's counters are kept (memcached's maximum).
+WATCH_COUNTER_TIMEOUT = 30 * 24 * 60 * 60
+
+
 class Watch(models.Model):
     """
     Record of a video being watched.
@@ -2023,11 +2490,14 @@ class Watch(models.Model):
      - timestamp: when watched
      - user: user that watched it, if any
      - ip_address: IP address of the user
+     - counted: whether the watch has been added to the video's
+       :class:`WatchCount` and :class:`WatchBucket`
     """
     video = models.ForeignKey(Video)
     timestamp = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey('auth.User', blank=True, null=True)
     ip_address = models.IPAddressField()
+    counted = models.BooleanField(default=False, db_index=True)
 
     @classmethod
     def add(Class, request, video):
@@ -2035,6 +2505,9 @@ class Watch(models.Model):
         Adds a record of a watched video to the database.  If the request came
         from localhost, check to see if it was forwarded to (hopefully) get the
         right IP address.
+
+        Unless the watch is buffered, it's saved without touching the video's
+        counts; :meth:`count_saved` adds it to them later.
         """
         ip = request.META.get('REMOTE_ADDR', '0.0.0.0')
         if not ipv4_re.match(ip):
@@ -2045,11 +2518,357 @@ class Watch(models.Model):
         else:
             user = None
 
+        if lsettings.BUFFER_WATCHES:
+            try:
+                Class.buffer(video.pk, user and user.pk, ip)
+            except ValueError:
+                # The cache couldn't number the slot, so nothing was buffered;
+                # save the watch directly instead.
+                logging.warning('Could not buffer watch of video %i',
+                                video.pk, exc_info=True)
+            else:
+                return
+
         try:
             Class(video=video, user=user, ip_address=ip).save()
         except Exception:
             pass
 
+    @classmethod
+    def buffer(Class, video_pk, user_pk, ip_address):
+        """
+        Adds a record of a watched video to a buffer in the cache, and
+        schedules :func:`localtv.tasks.flush_watches` to write the buffer to
+        the database in bulk. Each watch is stored in its own slot, numbered
+        with an atomic ``incr`` of a sequence counter. Each site has its own
+        buffer, so sites can share a cache.
+
+        The cache must be shared by every process which serves requests or
+        runs the flush, so the locmem, dummy and other per-process caches
+        can't be used.
+
+        If the flush can't be scheduled, the watch stays buffered for the
+        flush scheduled by a later watch.
+
+        :raises: ``ValueError`` if the cache doesn't support ``incr``, or is
+                 unavailable.
+        """
+        site_id = settings.SITE_ID
+        slot_timeout = lsettings.WATCH_FLUSH_INTERVAL * 10
+        sequence_key = WATCH_SEQUENCE_KEY % site_id
+        scheduled_key = WATCH_FLUSH_SCHEDULED_KEY % site_id
+        cache.add(sequence_key, 0, WATCH_COUNTER_TIMEOUT)
+        slot = cache.incr(sequence_key)
+        cache.set(WATCH_SLOT_KEY % (site_id, slot),
+                  (video_pk, user_pk, ip_address, datetime.datetime.now()),
+                  slot_timeout)
+        if cache.add(scheduled_key, True, slot_timeout):
+            from localtv.tasks import flush_watches, CELERY_USING
+            try:
+                flush_watches.apply_async(
+                    kwargs={'using': CELERY_USING},
+                    countdown=lsettings.WATCH_FLUSH_INTERVAL)
+            except IOError:
+                # Let the next watch try to schedule the flush.
+                cache.delete(scheduled_key)
+                logging.warning('Could not schedule flush_watches',
+                                exc_info=True)
+
+    @classmethod
+    def flush_buffer(Class, using='default'):
+        """
+        Writes up to ``LOCALTV_WATCH_FLUSH_BATCH_SIZE`` buffered watches to
+        the database with a single insert, and adds them to the videos'
+        :class:`WatchCount`. Watches whose slots have been evicted from the
+        cache are lost.
+
+        The range of slots to write is claimed while holding a lock in the
+        cache, so concurrent flushes never write the same watch twice. A
+        missing slot may still be about to be written by :meth:`buffer`; the
+        flush stops there and leaves it, and the slots after it, for the next
+        flush, unless a later slot is older than
+        :data:`WATCH_SLOT_GRACE_PERIOD`.
+
+        Returns a tuple of a list of the pks of the videos which were watched,
+        and a boolean which is ``True`` if there are more watches to flush
+        now, or ``None`` if another flush is running.
+        """
+        site_id = settings.SITE_ID
+        lock_key = WATCH_FLUSH_LOCK_KEY % site_id
+        flushed_key = WATCH_FLUSHED_KEY % site_id
+        lock_timeout = lsettings.WATCH_FLUSH_INTERVAL * 10
+        if not cache.add(lock_key, True, lock_timeout):
+            return [], None
+        try:
+            sequence = cache.get(WATCH_SEQUENCE_KEY % site_id) or 0
+            flushed = cache.get(flushed_key)
+            if flushed is None or flushed > sequence:
+                # The counters were evicted; anything older than the slot
+                # timeout is gone anyway.
+                flushed = max(0, sequence - lsettings.WATCH_FLUSH_BATCH_SIZE)
+            end = min(sequence, flushed + lsettings.WATCH_FLUSH_BATCH_SIZE)
+            if end <= flushed:
+                return [], False
+            keys = [WATCH_SLOT_KEY % (site_id, slot)
+                    for slot in xrange(flushed + 1, end + 1)]
+            buffered = cache.get_many(keys)
+
+            grace_start = datetime.datetime.now() - WATCH_SLOT_GRACE_PERIOD
+            last_old = -1
+            for index, key in enumerate(keys):
+                if key in buffered and buffered[key][3] < grace_start:
+                    last_old = index
+            claimed = len(keys)
+            for index, key in enumerate(keys):
+                if key not in buffered and index > last_old:
+                    claimed = index
+                    break
+            keys = keys[:claimed]
+            if keys:
+                cache.set(flushed_key, flushed + claimed,
+                          WATCH_COUNTER_TIMEOUT)
+                cache.delete_many(keys)
+        finally:
+            cache.delete(lock_key)
+
+        watches = [buffered[key] for key in keys if key in buffered]
+        video_pks = set(Video.objects.using(using).filter(
+                pk__in=set(watch[0] for watch in watches)
+                ).values_list('pk', flat=True))
+        instances = [Class(video_id=video_pk, user_id=user_pk,
+                           ip_address=ip_address, timestamp=timestamp,
+                           counted=True)
+                     for video_pk, user_pk, ip_address, timestamp in watches
+                     # The video may have been deleted in the meantime.
+                     if video_pk in video_pks]
+        utils.bulk_insert(Class, instances, using=using)
+        watched_pks = Class._add_to_counts(
+            [(watch.video_id, watch.timestamp) for watch in instances],
+            using)
+        # If the flush stopped at a missing slot, whoever is writing it will
+        # schedule the next flush.
+        return watched_pks, flushed + claimed == end < sequence
+
+    @classmethod
+    def count_saved(Class, using='default'):
+        """
+        Adds up to ``LOCALTV_WATCH_FLUSH_BATCH_SIZE`` of the watches which
+        were saved without being counted to the videos' :class:`WatchCount`
+        and :class:`WatchBucket`, with one update per video and hour rather
+        than per watch, and marks them as counted.
+
+        Returns a tuple like :meth:`flush_buffer`'s.
+        """
+        lock_key = WATCH_COUNT_LOCK_KEY % settings.SITE_ID
+        lock_timeout = lsettings.WATCH_FLUSH_INTERVAL * 10
+        if not cache.add(lock_key, True, lock_timeout):
+            return [], None
+        try:
+            watches = Class.objects.using(using)
+            rows = list(watches.filter(counted=False).order_by(
+                    'pk').values_list('pk', 'video', 'timestamp')[
+                    :lsettings.WATCH_FLUSH_BATCH_SIZE])
+            if not rows:
+                return [], False
+            with transaction.commit_on_success(using=using):
+                # Marked first, so that a WatchCount created from the counted
+                # watches includes these.
+                watches.filter(pk__in=[row[0] for row in rows]).update(
+                    counted=True)
+                watched_pks = Class._add_to_counts(
+                    [row[1:] for row in rows], using)
+        finally:
+            cache.delete(lock_key)
+        return watched_pks, len(rows) == lsettings.WATCH_FLUSH_BATCH_SIZE
+
+    @staticmethod
+    def _add_to_counts(watches, using):
+        """
+        Adds ``watches``, a list of ``(video_pk, timestamp)`` tuples, to the
+        videos' :class:`WatchCount` and :class:`WatchBucket`. Returns the pks
+        of the videos.
+        """
+        counts = {}
+        hourly_counts = {}
+        for video_pk, timestamp in watches:
+            counts[video_pk] = counts.get(video_pk, 0) + 1
+            key = (video_pk, WatchBucket.hour_for(timestamp))
+            hourly_counts[key] = hourly_counts.get(key, 0) + 1
+        for video_pk, count in counts.items():
+            WatchCount.add(video_pk, count, using=using)
+        for (video_pk, hour), count in hourly_counts.items():
+            WatchBucket.add(video_pk, hour, count, using=using)
+        return counts.keys()
+
+
+class WatchCount(models.Model):
+    """
+    The number of times a video has been watched, kept up to date as watches
+    are flushed from the buffer, or counted by
+    :func:`localtv.tasks.update_popularity`, so that it never needs to be
+    counted.
+
+    fields:
+     - video: the Video that was watched
+     - total: the number of watches
+     - recent: the number of watches in the last ``LOCALTV_POPULAR_WINDOW``
+       days, which is what makes a video popular. Watches are added as they
+       are counted, and :func:`localtv.tasks.update_popularity` drops the
+       ones which have left the window.
+    """
+    video = models.OneToOneField(Video)
+    total = models.PositiveIntegerField(default=0)
+    recent = models.PositiveIntegerField(default=0, db_index=True)
+
+    @classmethod
+    def add(cls, video_pk, count, using='default'):
+        """
+        Adds ``count`` watches to the counts for the video. If the video
+        doesn't have a :class:`WatchCount` yet, it is created from the
+        counted :class:`Watch` records, which include the ones being added.
+        """
+        watch_counts = cls.objects.using(using).filter(video=video_pk)
+        if watch_counts.update(total=models.F('total') + count,
+                               recent=models.F('recent') + count):
+            return
+        watches = Watch.objects.using(using).filter(video=video_pk,
+                                                    counted=True)
+        watch_count, created = cls.objects.db_manager(using).get_or_create(
+            video_id=video_pk,
+            defaults={'total': watches.count(),
+                      'recent': watches.filter(
+                        timestamp__gte=WatchBucket.window_start()).count()})
+        if not created:
+            watch_counts.update(total=models.F('total') + count,
+                                recent=models.F('recent') + count)
+
+
+class WatchBucket(models.Model):
+    """
+    The number of times a video was watched in a given hour. Summing the
+    buckets in the popularity window gives :attr:`WatchCount.recent` without
+    counting individual watches.
+
+    fields:
+     - video: the Video that was watched
+     - hour: the start of the hour
+     - count: the number of watches in that hour
+    """
+    video = models.ForeignKey(Video)
+    hour = models.DateTimeField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('video', 'hour')
+
+    @staticmethod
+    def hour_for(timestamp):
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def window_start(cls):
+        """
+        Returns the start of the first bucket in the popularity window.
+        """
+        return cls.hour_for(datetime.datetime.now() - datetime.timedelta(
+                days=lsettings.POPULAR_WINDOW))
+
+    @classmethod
+    def add(cls, video_pk, timestamp, count, using='default'):
+        """
+        Adds ``count`` watches to the bucket for ``timestamp``'s hour.
+        """
+        hour = cls.hour_for(timestamp)
+        buckets = cls.objects.using(using).filter(video=video_pk, hour=hour)
+        if buckets.update(count=models.F('count') + count):
+            return
+        bucket, created = cls.objects.db_manager(using).get_or_create(
+            video_id=video_pk, hour=hour, defaults={'count': count})
+        if not created:
+            buckets.update(count=models.F('count') + count)
+
+    @classmethod
+    def rebuild(cls, using='default'):
+        """
+        Replaces the buckets in the popularity window with buckets counted
+        from the counted :class:`Watch` records, e.g. after the buckets were
+        introduced.
+        """
+        start = cls.window_start()
+        counts = {}
+        for video_pk, timestamp in Watch.objects.using(using).filter(
+            timestamp__gte=start, counted=True).values_list(
+            'video', 'timestamp').iterator():
+            key = (video_pk, cls.hour_for(timestamp))
+            counts[key] = counts.get(key, 0) + 1
+        cls.objects.using(using).filter(hour__gte=start).delete()
+        utils.bulk_insert(cls, [cls(video_id=video_pk, hour=hour, count=count)
+                                for (video_pk, hour), count in counts.items()],
+                          using=using)
+
+
+class RelatedVideo(models.Model):
+    """
+    One of the videos most like another, as worked out by
+    :func:`localtv.tasks.update_related_videos`. Each video has up to
+    ``LOCALTV_RELATED_VIDEOS_COUNT`` of these, or a single one without a
+    related video if it has been scored and isn't related to any video.
+
+    fields:
+     - video: the Video which the related video is shown with
+     - related: the related Video, if any
+     - score: how closely the videos are related; higher is closer
+    """
+    video = models.ForeignKey(Video, related_name='relations')
+    related = models.ForeignKey(Video, related_name='related_by', null=True)
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['-score']
+
+
+class QueuedIndexUpdate(models.Model):
+    """
+    A search index update which is waiting to be processed. There is at most
+    one row per instance, so repeated saves of the same instance are coalesced
+    into a single index update.
+
+    fields:
+     - app_label, model_name, object_pk: the instance to update
+     - is_removal: whether the instance should be removed from the index
+     - queued: when the update was last requested
+     - watches_only: whether the update was only queued because the
+       instance's watch counts changed
+    """
+    app_label = models.CharField(max_length=100)
+    model_name = models.CharField(max_length=100)
+    object_pk = models.PositiveIntegerField()
+    is_removal = models.BooleanField(default=False)
+    queued = models.DateTimeField(db_index=True)
+    watches_only = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('app_label', 'model_name', 'object_pk')
+
+    @classmethod
+    def enqueue(cls, app_label, model_name, pk, is_removal, using='default',
+                watches_only=False):
+        """
+        Records that the index for the given instance needs to be updated,
+        replacing any update which is already queued for it. An update stays
+        ``watches_only`` only if every request for it was.
+        """
+        now = datetime.datetime.now()
+        update, created = cls.objects.db_manager(using).get_or_create(
+            app_label=app_label, model_name=model_name, object_pk=pk,
+            defaults={'is_removal': is_removal, 'queued': now,
+                      'watches_only': watches_only})
+        if not created:
+            changes = {'is_removal': is_removal, 'queued': now}
+            if not watches_only:
+                changes['watches_only'] = False
+            cls.objects.using(using).filter(pk=update.pk).update(**changes)
+
 
 class VideoModerator(CommentModerator):
 
@@ -2132,7 +2951,13 @@ tagging.register(Video)
 tagging.register(OriginalVideo)
 
 def finished(sender, **kwargs):
-    SiteLocation.objects.clear_cache()
+    if SITE_LOCATION_PENDING:
+        utils.bump_cache_version(*[_site_location_version_name(site_id)
+                                   for site_id in SITE_LOCATION_PENDING])
+        SITE_LOCATION_PENDING.clear()
+    # Each request gets its own copy of the SiteLocation; the pickled copies
+    # are kept until the shared cache version changes.
+    SITE_LOCATION_CACHE.clear()
 request_finished.connect(finished)
 
 def tag_unicode(self):
@@ -2214,6 +3039,15 @@ def create_email_notices(app, created_models, verbosity, **kwargs):
 
 models.signals.post_syncdb.connect(create_email_notices)
 
+def video_watch_count_post_save(sender, instance, created=False, raw=False,
+                                **kwargs):
+    # Every video gets a WatchCount, so that ordering by popularity doesn't
+    # need an outer join.
+    if created and not raw:
+        WatchCount.objects.db_manager(instance._state.db).get_or_create(
+            video=instance)
+models.signals.post_save.connect(video_watch_count_post_save, sender=Video)
+
 def delete_comments(sender, instance, **kwargs):
     from django.contrib.comments import get_model
     get_model().objects.filter(object_pk=instance.pk,
@@ -2223,6 +3057,257 @@ def delete_comments(sender, instance, **kwargs):
 models.signals.pre_delete.connect(delete_comments,
                                   sender=Video)
 
+### Changed fields. Some listeners only need to act when particular fields of
+### an instance change, so the fields which each save changes are recorded
+### before it's made.
+
+#: The fields of each model which :func:`changed_fields_signal_listener`
+#: checks. Videos store their authors' names, their feed's name and their
+#: feed's or search's thumbnail in the search index, and search keywords
+#: match the fields in :data:`localtv.search.keywords.FIELDS`.
+TRACKED_FIELDS = {
+    User: ('username', 'first_name', 'last_name'),
+    Feed: ('name', 'has_thumbnail', 'thumbnail_extension'),
+    SavedSearch: ('query_string', 'has_thumbnail', 'thumbnail_extension'),
+    Category: ('name', 'slug'),
+}
+
+def changed_fields_signal_listener(sender, instance, raw=False, using=None,
+                                   **kwargs):
+    """
+    Sets ``instance._changed_fields`` to the set of the sender's
+    :data:`TRACKED_FIELDS` which the save changes; for new instances, that's
+    all of them.
+
+    """
+    field_names = TRACKED_FIELDS[sender]
+    changed = set(field_names)
+    if instance.pk is not None and not raw:
+        for values in sender._default_manager.using(using).filter(
+            pk=instance.pk).values_list(*field_names):
+            changed = set(name for name, value in zip(field_names, values)
+                          if getattr(instance, name) != value)
+    instance._changed_fields = changed
+for sender in TRACKED_FIELDS:
+    models.signals.pre_save.connect(changed_fields_signal_listener,
+                                    sender=sender)
+
+def tracked_fields_changed(instance, field_names, signal=None):
+    """
+    Returns whether the save or deletion of ``instance`` which sent
+    ``signal`` changed any of ``field_names``. Deletions, and saves of
+    models without :data:`TRACKED_FIELDS`, always count as changes.
+
+    """
+    if signal is models.signals.post_delete:
+        return True
+    changed = getattr(instance, '_changed_fields', None)
+    return changed is None or bool(changed.intersection(field_names))
+
+### Cache versions. Feeds are cached under the version of their site plus the
+### version of the object they list (see localtv.utils.get_cache_versions), so
+### these handlers invalidate them as soon as something they show changes.
+
+def site_cache_version_signal_listener(sender, instance, raw=False,
+                                       **kwargs):
+    if not raw:
+        utils.bump_cache_version('site:%i' % instance.site_id)
+models.signals.post_save.connect(site_cache_version_signal_listener,
+                                 sender=Video)
+models.signals.post_delete.connect(site_cache_version_signal_listener,
+                                   sender=Video)
+models.signals.post_save.connect(site_cache_version_signal_listener,
+                                 sender=SiteLocation)
+
+#: The most video pks which are recorded for a change to a site's videos;
+#: larger changes are recorded as changing every video.
+VIDEO_CHANGES_LIMIT = 1000
+#: How long the videos changed by each bump of a site's videos cache version
+#: are kept.
+VIDEO_CHANGES_TIMEOUT = 60 * 60
+#: The most bumps of a site's videos cache version which
+#: :func:`get_changed_videos` will catch up with.
+VIDEO_CHANGES_HISTORY = 100
+
+def _video_changes_key(site_id, version):
+    return 'localtv:video_changes:%i:%i' % (site_id, version)
+
+def bump_videos_cache_version(site_id, video_pks=None):
+    """
+    Invalidates what's cached from the videos of the site with ``site_id``,
+    such as the search suggestion indexes. Saves and deletions of videos, and
+    changes to their authors and tags, do this through signals; changes made
+    with ``update()`` or bulk inserts have to call it themselves.
+
+    ``video_pks`` are the pks of the videos which changed, which are recorded
+    so that whatever was built from the site's videos can be updated rather
+    than rebuilt (see :func:`get_changed_videos`). If they're ``None``, every
+    video is treated as having changed.
+
+    """
+    version, = utils.bump_cache_version('videos:%i' % site_id)
+    if video_pks is not None:
+        video_pks = list(video_pks)
+        if len(video_pks) <= VIDEO_CHANGES_LIMIT:
+            cache.set(_video_changes_key(site_id, version), video_pks,
+                      VIDEO_CHANGES_TIMEOUT)
+
+def get_changed_videos(site_id, old_version, new_version):
+    """
+    Returns a set of the pks of the videos on the site with ``site_id`` which
+    changed between two of its videos cache versions, or ``None`` if that
+    isn't known.
+
+    """
+    if not 0 <= new_version - old_version <= VIDEO_CHANGES_HISTORY:
+        return None
+    keys = [_video_changes_key(site_id, version)
+            for version in xrange(old_version + 1, new_version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        # Either the changes weren't known, or they've expired.
+        return None
+    video_pks = set()
+    for key in keys:
+        video_pks.update(changes[key])
+    return video_pks
+
+def videos_cache_version_signal_listener(sender, instance, raw=False,
+                                         **kwargs):
+    # Unlike the site's version, this isn't bumped when watches are indexed.
+    if not raw:
+        bump_videos_cache_version(instance.site_id, [instance.pk])
+models.signals.post_save.connect(videos_cache_version_signal_listener,
+                                 sender=Video)
+models.signals.post_delete.connect(videos_cache_version_signal_listener,
+                                   sender=Video)
+
+def video_authors_cache_version_signal_listener(sender, instance, action,
+                                                reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_videos_cache_version(instance.site_id, [instance.pk])
+    elif pk_set:
+        site_videos = {}
+        for site_id, video_pk in Video.objects.filter(
+                pk__in=pk_set).values_list('site', 'pk'):
+            site_videos.setdefault(site_id, []).append(video_pk)
+        for site_id, video_pks in site_videos.items():
+            bump_videos_cache_version(site_id, video_pks)
+    else:
+        # A user's videos were all cleared.
+        for site_id in Site.objects.values_list('pk', flat=True):
+            bump_videos_cache_version(site_id)
+models.signals.m2m_changed.connect(video_authors_cache_version_signal_listener,
+                                   sender=Video.authors.through)
+
+def video_tags_cache_version_signal_listener(sender, instance, raw=False,
+                                             **kwargs):
+    if raw or instance.content_type_id != ContentType.objects.db_manager(
+        instance._state.db).get_for_model(Video).pk:
+        return
+    for site_id in Video.objects.using(instance._state.db).filter(
+        pk=instance.object_id).values_list('site', flat=True):
+        bump_videos_cache_version(site_id, [instance.object_id])
+models.signals.post_save.connect(video_tags_cache_version_signal_listener,
+                                 sender=tagging.models.TaggedItem)
+models.signals.post_delete.connect(video_tags_cache_version_signal_listener,
+                                   sender=tagging.models.TaggedItem)
+
+def site_location_cache_signal_listener(sender, instance, **kwargs):
+    # Fixtures are loaded raw, and they can change SiteLocations too.
+    if sender is Site:
+        site_id = instance.pk
+    else:
+        site_id = instance.site_id
+    name = _site_location_version_name(site_id)
+    utils.bump_cache_version(name)
+    if transaction.is_managed(using=kwargs.get('using')):
+        SITE_LOCATION_PENDING.add(site_id)
+    for key in SITE_LOCATION_DATA.keys():
+        if key[1] == site_id:
+            del SITE_LOCATION_DATA[key]
+    for key, (version, checked, site_location) in SITE_LOCATION_CACHE.items():
+        if key[1] != site_id:
+            continue
+        if site_location is instance:
+            # Keep using the saved object, rather than loading a copy of it.
+            SITE_LOCATION_CACHE[key] = (
+                utils.get_cache_versions(name)[0], time.time(),
+                site_location)
+        else:
+            del SITE_LOCATION_CACHE[key]
+models.signals.post_save.connect(site_location_cache_signal_listener,
+                                 sender=SiteLocation)
+models.signals.post_delete.connect(site_location_cache_signal_listener,
+                                   sender=SiteLocation)
+models.signals.post_save.connect(site_location_cache_signal_listener,
+                                 sender=Site)
+
+def category_cache_version_signal_listener(sender, instance, raw=False,
+                                           **kwargs):
+    if not raw:
+        names = ['category:%i:%s' % (instance.site_id, instance.slug),
+                 'categories:%i' % instance.site_id]
+        if tracked_fields_changed(instance, ('name', 'slug'),
+                                  kwargs.get('signal')):
+            names.append('search_keywords:category')
+        utils.bump_cache_version(*names)
+models.signals.post_save.connect(category_cache_version_signal_listener,
+                                 sender=Category)
+models.signals.post_delete.connect(category_cache_version_signal_listener,
+                                   sender=Category)
+
+def feed_cache_version_signal_listener(sender, instance, raw=False,
+                                       **kwargs):
+    if not raw:
+        names = ['feed:%i' % instance.pk]
+        # Feeds are saved every time they're polled, which doesn't change
+        # what search keywords match.
+        if tracked_fields_changed(instance, ('name',), kwargs.get('signal')):
+            names.append('search_keywords:feed')
+        utils.bump_cache_version(*names)
+models.signals.post_save.connect(feed_cache_version_signal_listener,
+                                 sender=Feed)
+models.signals.post_delete.connect(feed_cache_version_signal_listener,
+                                   sender=Feed)
+
+def author_cache_version_signal_listener(sender, instance, raw=False,
+                                         **kwargs):
+    if not raw:
+        names = ['author:%i' % instance.pk]
+        # Users are saved every time they log in, which doesn't change what
+        # search keywords match. Playlist paths include their user's
+        # username.
+        if tracked_fields_changed(instance, ('username',),
+                                  kwargs.get('signal')):
+            names.extend(['search_keywords:user', 'search_keywords:playlist'])
+        utils.bump_cache_version(*names)
+models.signals.post_save.connect(author_cache_version_signal_listener,
+                                 sender=User)
+models.signals.post_delete.connect(author_cache_version_signal_listener,
+                                   sender=User)
+
+def tag_cache_version_signal_listener(sender, instance, raw=False, **kwargs):
+    if not raw:
+        utils.bump_cache_version('tag:%s' % instance.name,
+                                 'search_keywords:tag')
+models.signals.post_save.connect(tag_cache_version_signal_listener,
+                                 sender=tagging.models.Tag)
+models.signals.post_delete.connect(tag_cache_version_signal_listener,
+                                   sender=tagging.models.Tag)
+
+def search_keywords_cache_version_signal_listener(sender, instance,
+                                                  raw=False, **kwargs):
+    if not raw and tracked_fields_changed(instance, ('query_string',),
+                                          kwargs.get('signal')):
+        utils.bump_cache_version('search_keywords:savedsearch')
+models.signals.post_save.connect(search_keywords_cache_version_signal_listener,
+                                 sender=SavedSearch)
+models.signals.post_delete.connect(
+    search_keywords_cache_version_signal_listener, sender=SavedSearch)
+
 ### register pre-save handler for Tiers and payment due dates
 models.signals.pre_save.connect(localtv.tiers.pre_save_set_payment_due_date,
                                 sender=SiteLocation)
@@ -16,10 +16,11 @@
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.template import Context, loader
 
 from localtv.models import Video
+from localtv.utils import bump_cache_version
 
 
 class Playlist(models.Model):
@@ -70,6 +71,8 @@ class Playlist(models.Model):
                                       video=video).values_list('pk',
                                                                flat=True).get()
              for video in video_set])
+        # Reordering doesn't send any signals.
+        bump_cache_version('playlist:%i' % self.pk)
 
     @property
     def video_set(self):
@@ -149,3 +152,16 @@ def send_notification(sender, instance, raw, created, **kwargs):
                     sitelocation=SiteLocation.objects.get_current())
 
 post_save.connect(send_notification, sender=Playlist)
+
+def playlist_cache_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        playlist_id = (instance.pk if isinstance(instance, Playlist)
+                       else instance.playlist_id)
+        bump_cache_version('playlist:%i' % playlist_id)
+        if isinstance(instance, Playlist):
+            bump_cache_version('search_keywords:playlist')
+
+post_save.connect(playlist_cache_version, sender=Playlist)
+post_delete.connect(playlist_cache_version, sender=Playlist)
+post_save.connect(playlist_cache_version, sender=PlaylistItem)
+post_delete.connect(playlist_cache_version, sender=PlaylistItem)
@@ -0,0 +1,334 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2012 Participatory Culture Foundation
+#
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Works out which videos are related, for :class:`localtv.models.RelatedVideo`.
+
+Each active video is described by a sparse vector of the things it has:
+tags, categories, authors, its feed and the people who recently watched it.
+Each feature is weighted by its kind and by how rare it is, and videos are
+related by the cosine similarity of their vectors. Only the pairs of videos
+which share a feature are ever scored.
+
+"""
+
+import datetime
+import heapq
+import math
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from tagging.models import TaggedItem
+
+from localtv import settings as lsettings
+from localtv.models import Video, Watch, RelatedVideo
+
+#: How much each kind of feature counts towards two videos being related,
+#: before weighting by how rare the feature is. Anonymous watchers are told
+#: apart by their IP address.
+FEATURE_WEIGHTS = {
+    'tag': 1.0,
+    'category': 1.5,
+    'author': 2.0,
+    'feed': 1.0,
+    'watcher': 0.5,
+    'anonymous_watcher': 0.5,
+}
+#: Features which more videos than this have are ignored when scoring. They
+#: say little about any one pair of videos, and would make scoring
+#: quadratic in the number of videos.
+MAX_FEATURE_VIDEOS = 1000
+
+
+def _active_videos(site_id, using):
+    return Video.objects.using(using).filter(site=site_id,
+                                              status=Video.ACTIVE)
+
+
+def _feature_querysets(site_id, using):
+    """
+    Returns a list of ``(kind, queryset, video_field, value_field)`` tuples,
+    one for each kind of feature of the active videos on the site.
+
+    """
+    videos = _active_videos(site_id, using)
+    content_type = ContentType.objects.db_manager(using).get_for_model(Video)
+    window_start = datetime.datetime.now() - datetime.timedelta(
+        days=lsettings.RELATED_VIDEOS_WATCH_WINDOW)
+    watches = Watch.objects.using(using).filter(
+        video__site=site_id, video__status=Video.ACTIVE,
+        timestamp__gte=window_start)
+    return [
+        ('feed', videos.filter(feed__isnull=False), 'pk', 'feed'),
+        ('tag', TaggedItem._default_manager.using(using).filter(
+                content_type=content_type,
+                object_id__in=videos.order_by().values('pk')), 'object_id', 'tag'),
+        ('category', Video.categories.through._default_manager.using(
+                using).filter(video__site=site_id,
+                              video__status=Video.ACTIVE),
+         'video', 'category'),
+        ('author', Video.authors.through._default_manager.using(
+                using).filter(video__site=site_id,
+                              video__status=Video.ACTIVE),
+         'video', 'user'),
+        ('watcher', watches.filter(user__isnull=False), 'video', 'user'),
+        ('anonymous_watcher', watches.filter(user__isnull=True).exclude(
+                ip_address='0.0.0.0'), 'video', 'ip_address'),
+    ]
+
+
+def _filtered_querysets(site_id, using, features=None):
+    """
+    Yields the :func:`_feature_querysets` filtered to only the values of
+    ``features``, if it's given.
+
+    """
+    for kind, queryset, video_field, value_field in _feature_querysets(
+            site_id, using):
+        if features is not None:
+            values = [value for feature_kind, value in features
+                      if feature_kind == kind]
+            if not values:
+                continue
+            queryset = queryset.filter(**{'%s__in' % value_field: values})
+        yield kind, queryset, video_field, value_field
+
+
+def _feature_rows(site_id, using, video_pks=None, features=None):
+    """
+    Yields a ``(video_pk, feature)`` tuple for each feature of each active
+    video on the site, optionally only for ``video_pks`` and ``features``.
+    Watchers may be repeated.
+
+    """
+    for kind, queryset, video_field, value_field in _filtered_querysets(
+            site_id, using, features):
+        if video_pks is not None:
+            queryset = queryset.filter(**{'%s__in' % video_field: video_pks})
+        for video_pk, value in queryset.values_list(
+                video_field, value_field).iterator():
+            yield int(video_pk), (kind, value)
+
+
+def _feature_counts(site_id, features, using):
+    """
+    Returns a ``{feature: count}`` dictionary of how many of the active
+    videos on the site have each of ``features``.
+
+    """
+    counts = {}
+    for kind, queryset, video_field, value_field in _filtered_querysets(
+            site_id, using, features):
+        for value, count in queryset.order_by().values(value_field).annotate(
+                count=Count(video_field, distinct=True)).values_list(
+                value_field, 'count'):
+            counts[(kind, value)] = count
+    return counts
+
+
+def _get_vectors(site_id, using, video_pks=None):
+    """
+    Returns a ``(vectors, counts)`` tuple for the active videos on the site,
+    or only those in ``video_pks``: their weighted feature vectors, and how
+    many of the site's active videos have each of their features.
+
+    """
+    videos = _active_videos(site_id, using)
+    if video_pks is not None:
+        video_pks = list(video_pks)
+        videos = videos.filter(pk__in=video_pks)
+    vectors = dict((video_pk, {})
+                   for video_pk in videos.values_list('pk', flat=True))
+    if not vectors:
+        return vectors, {}
+    for video_pk, feature in _feature_rows(site_id, using, video_pks):
+        vector = vectors.get(video_pk)
+        if vector is not None:
+            vector[feature] = 1
+
+    if video_pks is None:
+        counts = {}
+        for vector in vectors.itervalues():
+            for feature in vector:
+                counts[feature] = counts.get(feature, 0) + 1
+        total = len(vectors)
+    else:
+        counts = _feature_counts(site_id, set(
+                feature for vector in vectors.itervalues()
+                for feature in vector), using)
+        total = _active_videos(site_id, using).count()
+    # Weight each feature by the inverse of how many videos have it.
+    for vector in vectors.itervalues():
+        for feature in vector:
+            vector[feature] = (FEATURE_WEIGHTS[feature[0]] *
+                               math.log(1 + float(total) / counts[feature]))
+    return vectors, counts
+
+
+def get_feature_vectors(site_id, using='default'):
+    """
+    Returns a ``{video_pk: {feature: weight}}`` dictionary of the weighted
+    feature vectors of the active videos on the site. Features are ``(kind,
+    value)`` tuples.
+
+    """
+    return _get_vectors(site_id, using)[0]
+
+
+class _Scorer(object):
+    """
+    Scores the similarity of videos from their ``vectors``. ``counts`` are
+    how many videos have each feature; by default, the number of ``vectors``
+    which do.
+
+    """
+    def __init__(self, vectors, counts=None):
+        self.vectors = vectors
+        self.postings = {}
+        self.norms = {}
+        for video_pk, vector in vectors.iteritems():
+            for feature in vector:
+                self.postings.setdefault(feature, []).append(video_pk)
+            self.norms[video_pk] = math.sqrt(
+                sum(weight * weight for weight in vector.itervalues()))
+        if counts is None:
+            counts = dict((feature, len(video_pks))
+                          for feature, video_pks in self.postings.iteritems())
+        self.counts = counts
+
+    def scores(self, video_pk):
+        """
+        Returns a ``{video_pk: score}`` dictionary of the similarity of
+        ``video_pk`` to every video which shares a feature with it.
+
+        """
+        vector = self.vectors[video_pk]
+        # The dot products with every video which shares a feature.
+        scores = {}
+        for feature, weight in vector.iteritems():
+            if self.counts[feature] > MAX_FEATURE_VIDEOS:
+                continue
+            for other_pk in self.postings[feature]:
+                if other_pk != video_pk:
+                    scores[other_pk] = (
+                        scores.get(other_pk, 0) +
+                        weight * self.vectors[other_pk][feature])
+        norm = self.norms[video_pk]
+        return dict((other_pk, score / (norm * self.norms[other_pk]))
+                    for other_pk, score in scores.iteritems())
+
+
+def _best(scores, count):
+    return heapq.nlargest(count, ((score, other_pk)
+                                  for other_pk, score in scores.iteritems()))
+
+
+def get_related_videos(vectors, video_pks, count):
+    """
+    Returns a ``{video_pk: [(score, related_pk), ...]}`` dictionary of the
+    ``count`` videos most closely related to each of ``video_pks``, best
+    first, from the ``vectors`` returned by :func:`get_feature_vectors`.
+
+    """
+    scorer = _Scorer(vectors)
+    return dict((video_pk, _best(scorer.scores(video_pk), count))
+                for video_pk in video_pks if video_pk in vectors)
+
+
+def _sharing_pks(site_id, vectors, counts, using):
+    """
+    Returns the pks of the active videos on the site which share a feature
+    with any of ``vectors``, other than features too common to be scored.
+
+    """
+    shared = set(feature for vector in vectors.itervalues()
+                 for feature in vector
+                 if counts[feature] <= MAX_FEATURE_VIDEOS)
+    if not shared:
+        return set()
+    return set(video_pk for video_pk, feature in _feature_rows(
+            site_id, using, features=shared))
+
+
+def _add_vectors(site_id, video_pks, vectors, counts, using):
+    """
+    Adds the vectors of those of ``video_pks`` which aren't in ``vectors``
+    yet, and the counts of their features, to ``vectors`` and ``counts``.
+
+    """
+    new_vectors, new_counts = _get_vectors(site_id, using,
+                                           set(video_pks) - set(vectors))
+    vectors.update(new_vectors)
+    counts.update(new_counts)
+
+
+def get_changed_related_videos(site_id, video_pks, removed_pks, count,
+                               using='default'):
+    """
+    Returns the related videos, like :func:`get_related_videos`, of the
+    active videos in ``video_pks`` which have changed, and of the videos
+    whose related videos they change: those which share a feature with them,
+    or were related to them or to the no longer active ``removed_pks``.
+
+    Only the vectors of those videos, and of the videos which share a
+    feature with the changed videos or with the videos which were related to
+    them, are built. A video which only shares a feature with a changed video
+    keeps its current :class:`RelatedVideo` records, with the changed video
+    scored and added to them. A video which was related to a changed or
+    removed video is scored again against every video it shares a feature
+    with, since another video may need to take that one's place.
+
+    """
+    vectors, counts = _get_vectors(site_id, using, video_pks)
+    changed_pks = set(vectors)
+    stale_pks = set(video_pks) | set(removed_pks)
+    relations = RelatedVideo.objects.using(using).filter(
+        video__site=site_id, video__status=Video.ACTIVE)
+    rescored_pks = set(relations.filter(
+            related__in=list(stale_pks)).values_list('video', flat=True))
+    rescored_pks -= changed_pks
+    neighbour_pks = _sharing_pks(site_id, vectors, counts, using)
+    neighbour_pks -= changed_pks | rescored_pks
+    _add_vectors(site_id, neighbour_pks | rescored_pks, vectors, counts,
+                 using)
+    rescored_pks &= set(vectors)
+    _add_vectors(site_id, _sharing_pks(
+            site_id, dict((video_pk, vectors[video_pk])
+                          for video_pk in rescored_pks), counts, using),
+                 vectors, counts, using)
+    scorer = _Scorer(vectors, counts)
+
+    related = {}
+    neighbour_scores = dict((video_pk, {}) for video_pk in neighbour_pks
+                            if video_pk in vectors)
+    for video_pk in changed_pks:
+        scores = scorer.scores(video_pk)
+        related[video_pk] = _best(scores, count)
+        for other_pk, score in scores.iteritems():
+            if other_pk in neighbour_scores:
+                neighbour_scores[other_pk][video_pk] = score
+    for video_pk in rescored_pks:
+        related[video_pk] = _best(scorer.scores(video_pk), count)
+    # None of these videos' related videos are stale, so any other video
+    # scores lower than the ones they already have.
+    for video_pk, related_pk, score in relations.filter(
+            video__in=list(neighbour_scores), related__isnull=False
+            ).values_list('video', 'related', 'score'):
+        neighbour_scores[video_pk].setdefault(related_pk, score)
+    for video_pk, scores in neighbour_scores.iteritems():
+        related[video_pk] = _best(scores, count)
+    return related
@@ -0,0 +1,262 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2012 Participatory Culture Foundation
+#
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+An in-process index of the names, slugs, usernames and query strings which
+search keywords and listing filters use to refer to objects, so that they
+can be turned into pks without querying the database.
+
+The models of a site which stay small (categories, feeds, saved searches
+and playlists) are loaded into memory whole. Users and tags aren't scoped by
+site and grow with every import, so they are looked up one value at a time
+instead, and the results (including misses) are remembered.
+
+Each index is rebuilt, or its lookups forgotten, when an object of its model
+is saved or deleted in this process. Other processes bump a shared cache
+version for the model, which is checked at most every
+``LOCALTV_KEYWORD_INDEX_CHECK_INTERVAL`` seconds.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_save, post_delete
+from tagging.models import Tag
+
+from localtv import settings as lsettings
+from localtv import utils
+from localtv.models import (Category, Feed, SavedSearch,
+                            tracked_fields_changed)
+from localtv.playlists.models import Playlist
+
+#: The fields which are indexed for each model, in the order in which
+#: :meth:`KeywordIndex.resolve` tries them. A playlist's ``path`` is the
+#: ``username/slug`` form used by ``playlist:`` keywords.
+FIELDS = {
+    Category: ('name', 'slug'),
+    Feed: ('name',),
+    SavedSearch: ('query_string',),
+    Tag: ('name',),
+    User: ('username',),
+    Playlist: ('path',),
+}
+#: The models which are looked up with :class:`KeywordLookups` rather than
+#: loaded into a :class:`KeywordIndex`.
+LOOKUP_MODELS = (Tag, User)
+_indexes = {}
+
+
+def version_name(model):
+    """
+    Returns the name of the cache version which is bumped when an instance of
+    ``model`` is saved or deleted.
+
+    """
+    return 'search_keywords:%s' % model._meta.module_name
+
+
+class KeywordIndex(object):
+    """
+    Maps the values of the indexed fields of ``model`` on a site to the pks
+    of the instances which have them.
+
+    """
+    def __init__(self, model, site_id, version):
+        self.model = model
+        self.version = version
+        self.checked = time.time()
+        self.fields = FIELDS[model]
+        self.pks = set()
+        self.exact = dict((field, {}) for field in self.fields)
+        self.folded = dict((field, {}) for field in self.fields)
+
+        queryset = model._default_manager.order_by('pk')
+        try:
+            model._meta.get_field_by_name('site')
+        except FieldDoesNotExist:
+            pass
+        else:
+            queryset = queryset.filter(site=site_id)
+        if model is Playlist:
+            rows = ((pk, u'%s/%s' % (username, slug))
+                    for pk, username, slug in queryset.values_list(
+                        'pk', 'user__username', 'slug'))
+        else:
+            rows = queryset.values_list('pk', *self.fields)
+
+        for row in rows:
+            pk = row[0]
+            self.pks.add(pk)
+            for field, value in zip(self.fields, row[1:]):
+                if value is None:
+                    continue
+                self.exact[field].setdefault(value, []).append(pk)
+                self.folded[field].setdefault(value.lower(), pk)
+
+    def lookup(self, field, value):
+        """
+        Returns a list of the pks of the instances whose ``field`` is exactly
+        ``value``. ``field`` may also be ``'pk'``.
+
+        """
+        if field == 'pk':
+            try:
+                pk = int(value)
+            except (TypeError, ValueError):
+                return []
+            return [pk] if pk in self.pks else []
+        return list(self.exact[field].get(value, ()))
+
+    def resolve(self, value):
+        """
+        Returns the pk of the instance which a search keyword's ``value``
+        refers to, or ``None``. Each field is tried in turn, first exactly
+        and then case-insensitively, followed by the pk.
+
+        """
+        for field in self.fields:
+            pks = self.exact[field].get(value)
+            if pks:
+                return pks[0]
+            pk = self.folded[field].get(value.lower())
+            if pk is not None:
+                return pk
+        if value.isdigit() and int(value) in self.pks:
+            return int(value)
+        return None
+
+
+class KeywordLookups(object):
+    """
+    Has the same methods as :class:`KeywordIndex`, but queries the database
+    for each value, remembering the last ``LOCALTV_KEYWORD_LOOKUP_CACHE_SIZE``
+    results.
+
+    """
+    def __init__(self, model, site_id, version):
+        self.model = model
+        self.version = version
+        self.checked = time.time()
+        self.fields = FIELDS[model]
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, key, get_result):
+        with self.lock:
+            try:
+                # Move the result to the end, as the most recently used.
+                result = self.results.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.results[key] = result
+                return result
+        result = get_result()
+        with self.lock:
+            self.results[key] = result
+            if len(self.results) > lsettings.KEYWORD_LOOKUP_CACHE_SIZE:
+                self.results.popitem(last=False)
+        return result
+
+    def _pks(self, **kwargs):
+        return self.model._default_manager.filter(**kwargs).order_by(
+            'pk').values_list('pk', flat=True)
+
+    def lookup(self, field, value):
+        """
+        Returns a list of the pks of the instances whose ``field`` is exactly
+        ``value``. ``field`` may also be ``'pk'``.
+
+        """
+        if field == 'pk':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return []
+        elif field not in self.fields:
+            raise KeyError(field)
+        return list(self._remember(('lookup', field, value),
+                                   lambda: list(self._pks(**{field: value}))))
+
+    def _resolve(self, value):
+        for field in self.fields:
+            pks = (list(self._pks(**{field: value})[:1]) or
+                   list(self._pks(**{'%s__iexact' % field: value})[:1]))
+            if pks:
+                return pks[0]
+        if value.isdigit() and self._pks(pk=int(value)).exists():
+            return int(value)
+        return None
+
+    def resolve(self, value):
+        """
+        Returns the pk of the instance which a search keyword's ``value``
+        refers to, or ``None``. Each field is tried in turn, first exactly
+        and then case-insensitively, followed by the pk.
+
+        """
+        return self._remember(('resolve', value),
+                              lambda: self._resolve(value))
+
+
+def get_index(model):
+    """
+    Returns an up-to-date :class:`KeywordIndex` for ``model`` on the current
+    site, or a :class:`KeywordLookups` for the :data:`LOOKUP_MODELS`.
+
+    """
+    key = (model, settings.SITE_ID)
+    index = _indexes.get(key)
+    now = time.time()
+    if (index is not None and
+        now - index.checked < lsettings.KEYWORD_INDEX_CHECK_INTERVAL):
+        return index
+    version = utils.get_cache_versions(version_name(model))[0]
+    if index is None or index.version != version:
+        if model in LOOKUP_MODELS:
+            index = KeywordLookups(model, settings.SITE_ID, version)
+        else:
+            index = KeywordIndex(model, settings.SITE_ID, version)
+        _indexes[key] = index
+    else:
+        index.checked = now
+    return index
+
+
+def clear_cache():
+    """Forgets every index built by this process."""
+    _indexes.clear()
+
+
+def _clear_model_indexes(sender, instance, **kwargs):
+    if not tracked_fields_changed(instance, FIELDS[sender],
+                                  kwargs.get('signal')):
+        return
+    # Playlist paths include their user's username.
+    models = (sender, Playlist) if sender is User else (sender,)
+    for key in _indexes.keys():
+        if key[0] in models:
+            del _indexes[key]
+
+for model in FIELDS:
+    post_save.connect(_clear_model_indexes, sender=model)
+    post_delete.connect(_clear_model_indexes, sender=model)
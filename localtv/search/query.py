@@ -15,14 +15,40 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import operator
+import re
+
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.sites.models import Site
+from django.core.cache import cache
 from haystack.query import SearchQuerySet, SQ
 
 from tagging.models import Tag
+from localtv import settings as lsettings
+from localtv import utils
 from localtv.models import Feed, Category, SavedSearch
 from localtv.playlists.models import Playlist
-from localtv.search import shlex
+from localtv.search import keywords, shlex
+
+#: For each search keyword, the model it refers to and the index field which
+#: is filtered on. ``user:`` matches either of two index fields, so it is
+#: handled separately.
+KEYWORDS = {
+    'category': (Category, 'categories'),
+    'feed': (Feed, 'feed'),
+    'search': (SavedSearch, 'search'),
+    'tag': (Tag, 'tags'),
+    'user': (User, None),
+    'playlist': (Playlist, 'playlists'),
+}
+#: The most compiled queries each process keeps before starting over.
+PLAN_CACHE_SIZE = 1000
+# Finds the words in a query which might be keywords. Words which turn out
+# not to be, such as those in quoted phrases, only make a plan depend on more
+# models than it needs to.
+_keyword_re = re.compile(r'([a-z]+):')
+_plans = {}
 
 
 class SmartSearchQuerySet(SearchQuerySet):
@@ -45,6 +71,9 @@ class SmartSearchQuerySet(SearchQuerySet):
     * {one of these terms}
     * -"not this term"
 
+    Queries are compiled into a plan (see :meth:`compile`), which is cached
+    until one of the objects the keywords refer to changes.
+
     """
     def tokenize(self, query):
         or_stack = []
@@ -102,109 +131,97 @@ class SmartSearchQuerySet(SearchQuerySet):
         while or_stack:
             yield or_stack.pop()
 
-    def _get_object(self, model, token, *fields):
+    def _build_plan(self, tokens):
+        plan = []
+        for token in tokens:
+            if not isinstance(token, basestring):
+                group = self._build_plan(token)
+                if group:
+                    plan.append(('or', group))
+                continue
+            negative = token.startswith('-')
+            if negative:
+                token = token[1:]
+            if not token:
+                continue
+            if ':' in token:
+                keyword, rest = token.split(':', 1)
+                keyword = keyword.lower()
+                if keyword in KEYWORDS:
+                    model, index_field = KEYWORDS[keyword]
+                    pk = keywords.get_index(model).resolve(rest)
+                    if pk is None:
+                        # Keywords which don't match anything are ignored.
+                        pass
+                    elif keyword == 'user':
+                        plan.append(('user', negative, pk))
+                    else:
+                        plan.append(('field', negative, index_field, pk))
+                    continue
+            plan.append(('content', negative, token))
+        return plan
+
+    def compile(self, query_string):
         """
-        Tries various fields to get an object.
+        Compiles ``query_string`` into a plan: a list of nodes, each of which
+        is one of:
+
+        * ``('content', negative, text)``
+        * ``('field', negative, index_field, pk)``
+        * ``('user', negative, pk)``
+        * ``('or', nodes)``
+
+        The keywords in the query are resolved with
+        :mod:`localtv.search.keywords`. Plans are cached, by this process and
+        in the shared cache, until an object of one of the models which the
+        query's keywords refer to changes.
 
         """
-        default_kwargs = {}
+        normalized = u' '.join(query_string.split())
+        keyword_names = sorted(set(_keyword_re.findall(normalized.lower())
+                                   ).intersection(KEYWORDS))
+        versions = utils.get_cache_versions(*[
+                keywords.version_name(KEYWORDS[keyword_name][0])
+                for keyword_name in keyword_names])
+        key = 'localtv:search_plan:%s' % hashlib.md5((
+            u'%i:%s:%s' % (settings.SITE_ID, versions, normalized)
+            ).encode('utf8')).hexdigest()
         try:
-            model._meta.get_field_by_name('site')
-        except Exception:
+            return _plans[key]
+        except KeyError:
             pass
+        plan = cache.get(key)
+        if plan is None:
+            plan = self._build_plan(list(self.tokenize(normalized)))
+            cache.set(key, plan, lsettings.SEARCH_PLAN_CACHE_TIMEOUT)
+        if len(_plans) >= PLAN_CACHE_SIZE:
+            _plans.clear()
+        _plans[key] = plan
+        return plan
+
+    def _plan_to_sq(self, node, clean):
+        kind = node[0]
+        if kind == 'or':
+            return reduce(operator.or_, [self._plan_to_sq(child, clean)
+                                         for child in node[1]])
+        negative = node[1]
+        if kind == 'content':
+            sq = SQ(content=clean(node[2]))
+        elif kind == 'user':
+            sq = SQ(user=node[2]) | SQ(authors=node[2])
         else:
-            default_kwargs['site'] = Site.objects.get_current()
-        if 'pk' not in fields:
-            fields = fields + ('pk',)
-
-        for field in fields:
-            methods = ['exact']
-            if field != 'pk':
-                methods.append('iexact')
-            for method in methods:
-                kwargs = default_kwargs.copy()
-                kwargs['%s__%s' % (field, method)] = token
-                try:
-                    return model.objects.get(**kwargs)
-                except (model.DoesNotExist, ValueError):
-                    pass
-
-    def _tokens_to_sqs(self, tokens, sqs):
-        """
-        Turns a list of tokens and a SearchQuerySet into a SQS representing
-        those tokens.
-
-        """
-        clean = sqs.query.clean
-        for token in tokens:
-            if isinstance(token, basestring):
-                method = sqs.filter
-                negative = False
-                if token[0] == '-':
-                    negative = True
-                    method = sqs.exclude
-                    token = token[1:]
-                if ':' not in token:
-                    sqs = method(content=clean(token))
-                else:
-                    # possibly a special keyword
-                    keyword, rest = token.split(':', 1)
-                    keyword = keyword.lower()
-                    if keyword == 'category':
-                        category = self._get_object(Category, rest,
-                                               'name', 'slug', 'pk')
-                        if category is not None:
-                            sqs = method(categories=category.pk)
-                    elif keyword == 'feed':
-                        feed = self._get_object(Feed, rest,
-                                           'name', 'pk')
-                        if feed is not None:
-                            sqs = method(feed=feed.pk)
-                    elif keyword == 'search':
-                        search = self._get_object(SavedSearch, rest,
-                                             'query_string', 'pk')
-                        if search is not None:
-                            sqs = method(search=search.pk)
-                    elif keyword == 'tag':
-                        tag = self._get_object(Tag, rest, 'name')
-                        if tag is not None:
-                            sqs = method(tags=tag)
-                    elif keyword == 'user':
-                        user = self._get_object(User, rest,
-                                           'username', 'pk')
-                        if user is not None:
-                            if not negative:
-                                sqs = sqs.filter(SQ(user=user.pk) |
-                                                 SQ(authors=user.pk))
-                            else:
-                                sqs = sqs.exclude(user=user.pk).exclude(
-                                        authors=user.pk)
-                    elif keyword == 'playlist':
-                        playlist = self._get_object(Playlist, rest, 'pk')
-                        if playlist is None and '/' in rest:
-                            # user/slug
-                            user, slug = rest.split('/', 1)
-                            try:
-                                playlist = Playlist.objects.get(
-                                    user__username=user,
-                                    slug=slug)
-                            except Playlist.DoesNotExist:
-                                pass
-                        if playlist is not None:
-                            sqs = method(playlists=playlist.pk)
-                    else:
-                        sqs = method(content=clean(token))
-            else:
-                # or block
-                clone = sqs._clone()
-                for or_token in token:
-                    sqs = sqs | _tokens_to_sqs([or_token], clone)
-
-        return sqs
+            sq = SQ(**{node[2]: node[3]})
+        if negative:
+            sq = ~sq
+        return sq
 
     def auto_query(self, query_string):
         """
         Performs a best guess constructing the search query.
 
         """
-        return self._tokens_to_sqs(self.tokenize(query_string), self)
+        sqs = self
+        clean = sqs.query.clean
+        for node in self.compile(query_string):
+            sqs = sqs.filter(self._plan_to_sq(node, clean))
+        return sqs
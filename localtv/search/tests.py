@@ -15,13 +15,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import itertools
+import json
+
+import mock
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from haystack import site
+from haystack.query import SearchQuerySet
 
 from localtv.tests import BaseTestCase
 
-from localtv import search
-from localtv.models import Video, SavedSearch, Feed
+from localtv import search, tasks, utils
+from localtv.management.commands import update_index_incremental
+from localtv.models import (Video, SavedSearch, Feed, QueuedIndexUpdate,
+                            Category, bump_videos_cache_version)
 from localtv.playlists.models import Playlist
+from localtv.search import keywords, typeahead
+from localtv.search.query import SmartSearchQuerySet
+from localtv.search.utils import get_result_count
 
 class SearchTokenizeTestCase(BaseTestCase):
     """
@@ -332,3 +348,503 @@ class AutoQueryTestCase(BaseTestCase):
             self.assertFalse('and' in result.text.lower(), result.text)
             self.assertTrue(('import' in result.text.lower()) or
                             ('repair' in result.text.lower()), result.text)
+
+
+    def test_compile_cached(self):
+        """
+        Keywords should be resolved with the keyword index, and compiled
+        queries should be cached until one of the objects they could refer
+        to changes.
+        """
+        # Don't use plans cached by other tests.
+        utils.bump_cache_version(*[keywords.version_name(model)
+                                   for model in keywords.FIELDS])
+        category = Category.objects.filter(site=settings.SITE_ID)[0]
+        feed = Feed.objects.all()[0]
+        admin = User.objects.get(username='admin')
+        query = u'foo -category:%s {feed:%i user:admin} -"bar baz"' % (
+            category.slug, feed.pk)
+        sqs = SmartSearchQuerySet()
+        # One query to index each of the three models.
+        with self.assertNumQueries(3):
+            plan = sqs.compile(query)
+        self.assertEqual(plan, [
+                ('content', False, u'foo'),
+                ('field', True, 'categories', category.pk),
+                ('or', [('field', False, 'feed', feed.pk),
+                        ('user', False, admin.pk)]),
+                ('content', True, u'bar baz')])
+        with self.assertNumQueries(0):
+            self.assertEqual(sqs.compile(u' %s ' % query), plan)
+        category.name = u'%s renamed' % category.name
+        category.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(sqs.compile(query), plan)
+
+    def test_compile_cached_per_keyword(self):
+        """
+        Compiled queries should only be invalidated by changes to the models
+        which their keywords refer to.
+        """
+        category = Category.objects.filter(site=settings.SITE_ID)[0]
+        query = u'foo category:%s' % category.slug
+        sqs = SmartSearchQuerySet()
+        plan = sqs.compile(query)
+        User.objects.create(username='new')
+        with self.assertNumQueries(0):
+            self.assertEqual(sqs.compile(query), plan)
+
+
+class KeywordIndexTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['categories']
+
+    def test_lookup(self):
+        """
+        Exact lookups should return every matching pk, only for the current
+        site.
+        """
+        category = Category.objects.filter(site=settings.SITE_ID)[0]
+        other = Category.objects.create(site=Site.objects.create(
+                domain='example.org', name='Other'), name=category.name,
+                                        slug=category.slug)
+        index = keywords.get_index(Category)
+        self.assertEqual(index.lookup('slug', category.slug), [category.pk])
+        self.assertEqual(index.lookup('pk', str(category.pk)), [category.pk])
+        self.assertEqual(index.lookup('pk', str(other.pk)), [])
+        self.assertEqual(index.lookup('name', category.name.upper()), [])
+
+    def test_resolve(self):
+        """
+        Resolving a keyword should try each field exactly, then
+        case-insensitively, then the pk.
+        """
+        category = Category.objects.filter(site=settings.SITE_ID)[0]
+        index = keywords.get_index(Category)
+        self.assertEqual(index.resolve(category.name.upper()), category.pk)
+        self.assertEqual(index.resolve(category.slug), category.pk)
+        self.assertEqual(index.resolve(str(category.pk)), category.pk)
+        self.assertTrue(index.resolve('not a category') is None)
+
+    def test_invalidated(self):
+        """
+        Saving an object should update the index.
+        """
+        self.assertNumQueries(1, keywords.get_index, Category)
+        self.assertNumQueries(0, keywords.get_index, Category)
+        category = Category.objects.create(site=self.site_location.site,
+                                           name='New', slug='new')
+        self.assertEqual(keywords.get_index(Category).lookup('slug', 'new'),
+                         [category.pk])
+
+    def test_unindexed_fields(self):
+        """
+        Saving an object without changing its indexed fields, like a user
+        logging in, shouldn't invalidate the index.
+        """
+        version = utils.get_cache_versions(keywords.version_name(User))[0]
+        keywords.get_index(User)
+        user = User.objects.get(username='user')
+        user.last_login = datetime.datetime.now()
+        user.save()
+        self.assertEqual(
+            utils.get_cache_versions(keywords.version_name(User))[0],
+            version)
+        self.assertNumQueries(0, keywords.get_index, User)
+
+        user.username = 'renamed'
+        user.save()
+        self.assertEqual(keywords.get_index(User).lookup('username',
+                                                         'renamed'),
+                         [user.pk])
+
+    def test_lookups(self):
+        """
+        Users and tags should be looked up one value at a time rather than
+        all loaded, and the results, including misses, should be remembered
+        until an object of the model changes.
+        """
+        index = keywords.get_index(User)
+        self.assertTrue(index.resolve('nobody') is None)
+        with self.assertNumQueries(0):
+            self.assertTrue(index.resolve('nobody') is None)
+        user = User.objects.create(username='Nobody')
+        self.assertEqual(keywords.get_index(User).resolve('nobody'), user.pk)
+
+
+
+class ResultCountTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['videos']
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        # Don't use counts cached by other tests.
+        utils.bump_cache_version('site:%i' % settings.SITE_ID)
+        self.sqs = SearchQuerySet().models(Video).filter(
+            site=settings.SITE_ID)
+        self.count = len(self.sqs._clone())
+        self.counted = []
+        original = SearchQuerySet.__len__
+        def __len__(sqs):
+            self.counted.append(sqs)
+            return original(sqs)
+        patcher = mock.patch.object(SearchQuerySet, '__len__', __len__)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        """
+        Counts should be cached regardless of the sort, until a video
+        changes.
+        """
+        self.assertEqual(get_result_count(self.sqs._clone()), self.count)
+        self.assertEqual(get_result_count(self.sqs.order_by('-best_date')),
+                         self.count)
+        self.assertEqual(len(self.counted), 1)
+        Video.objects.filter(status=Video.ACTIVE)[0].save()
+        get_result_count(self.sqs._clone())
+        self.assertEqual(len(self.counted), 2)
+
+    def test_estimate(self):
+        """
+        With a max_age, a count from before the last change should be used.
+        """
+        get_result_count(self.sqs._clone())
+        Video.objects.filter(status=Video.ACTIVE)[0].save()
+        self.assertEqual(get_result_count(self.sqs._clone(), max_age=60),
+                         self.count)
+        self.assertEqual(len(self.counted), 1)
+        get_result_count(self.sqs._clone())
+        self.assertEqual(len(self.counted), 2)
+
+    def test_per_site(self):
+        """
+        Sites sharing a cache shouldn't be given each other's counts, even as
+        estimates.
+        """
+        get_result_count(self.sqs._clone())
+        with mock.patch.object(settings, 'SITE_ID', settings.SITE_ID + 1):
+            get_result_count(self.sqs._clone(), max_age=60)
+        self.assertEqual(len(self.counted), 2)
+
+
+class TypeaheadTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['categories', 'videos']
+
+    def test_keywords(self):
+        """
+        Keywords should be suggested by prefix, and their values suggested
+        after the colon.
+        """
+        suggestions = typeahead.suggest('blender cat')
+        self.assertEqual(suggestions[0], {'type': 'keyword',
+                                          'label': 'category:',
+                                          'query': 'blender category:'})
+        self.assertEqual(typeahead.suggest('-category:LIN'), [
+                {'type': 'category', 'label': 'Linux',
+                 'query': '-category:linux'}])
+        Video.objects.filter(status=Video.ACTIVE)[0].authors.add(
+            User.objects.get(username='admin'))
+        self.assertEqual(typeahead.suggest('user:adm')[0]['query'],
+                         'user:admin')
+
+    def test_authors(self):
+        """
+        Only the authors of active videos on the site should be suggested.
+        """
+        user = User.objects.get(username='user')
+        self.assertEqual(typeahead.suggest('user:use'), [])
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.authors.add(user)
+        self.assertEqual(typeahead.suggest('user:use')[0]['query'],
+                         'user:user')
+        video.status = Video.REJECTED
+        video.save()
+        self.assertEqual(typeahead.suggest('user:use'), [])
+
+    def test_tags(self):
+        """
+        Only the tags of active videos on the site should be suggested.
+        Tagging a video should update the index, rather than rebuild it.
+        """
+        unapproved = Video.objects.filter(status=Video.UNAPPROVED)[0]
+        unapproved.tags = 'secret'
+        self.assertEqual(typeahead.suggest('tag:sec'), [])
+        index = typeahead._indexes[('tag', settings.SITE_ID)]
+
+        Video.objects.filter(status=Video.ACTIVE)[0].tags = 'secret'
+        self.assertEqual(typeahead.suggest('tag:sec'), [
+                {'type': 'tag', 'label': 'secret', 'query': 'tag:secret'}])
+        self.assertTrue(typeahead._indexes[('tag', settings.SITE_ID)] is index)
+
+    def test_video_titles(self):
+        """
+        Active videos should be suggested by the start of any word of their
+        title.
+        """
+        video = Video.objects.get(pk=13) # Blender Tutorial - Jump in the GE
+        suggestions = typeahead.suggest('jump in')
+        self.assertEqual(suggestions, [
+                {'type': 'video', 'label': video.name,
+                 'url': video.get_absolute_url()}])
+        self.assertEqual(typeahead.suggest('text in blender'), [])
+        video.name = 'Jumping'
+        video.save()
+        self.assertEqual(typeahead.suggest('jump in'), [])
+
+    def test_no_queries(self):
+        """
+        Once the indexes are built, suggestions shouldn't need any queries.
+        """
+        typeahead.suggest('li')
+        self.assertNumQueries(0, typeahead.suggest, 'li')
+
+    @mock.patch('localtv.settings.KEYWORD_INDEX_CHECK_INTERVAL', 0)
+    def test_not_rebuilt_for_watches(self):
+        """
+        Indexing watches, which bumps the site's popularity cache version,
+        shouldn't make the indexes be rebuilt.
+        """
+        typeahead.suggest('li')
+        utils.bump_cache_version('popularity:%i' % settings.SITE_ID)
+        self.assertNumQueries(0, typeahead.suggest, 'li')
+
+    @mock.patch('localtv.settings.KEYWORD_INDEX_CHECK_INTERVAL', 0)
+    def test_updated_with_changed_videos(self):
+        """
+        When videos are changed by another process, the indexes should be
+        updated with just those videos, rather than rebuilt.
+        """
+        typeahead.suggest('jump')
+        index = typeahead._indexes[('video', settings.SITE_ID)]
+        Video.objects.filter(pk=13).update(name='Jumping in')
+        bump_videos_cache_version(settings.SITE_ID, [13])
+        self.assertEqual(typeahead.suggest('jump'), [
+                {'type': 'video', 'label': 'Jumping in',
+                 'url': Video.objects.get(pk=13).get_absolute_url()}])
+        self.assertTrue(
+            typeahead._indexes[('video', settings.SITE_ID)] is index)
+
+    def test_view(self):
+        """
+        The suggestions should be returned as JSON.
+        """
+        response = self.client.get(reverse('localtv_search_suggest'),
+                                   {'q': 'li'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        data = json.loads(response.content)
+        self.assertEqual(data['query'], 'li')
+        self.assertEqual(data['suggestions'][0]['label'], 'Linux')
+
+
+class IndexQueueTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['feeds', 'videos']
+
+    @mock.patch('localtv.tasks.cache.add', mock.Mock(return_value=False))
+    def test_updates_are_coalesced(self):
+        """
+        Saving an instance several times should queue a single index update,
+        which haystack_batch_update writes to the index.
+        """
+        QueuedIndexUpdate.objects.all().delete()
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.name = 'Coalescedname'
+        video.save()
+        video.save()
+        self.assertEqual(QueuedIndexUpdate.objects.count(), 1)
+        self.assertFalse(SearchQuerySet().filter(content='coalescedname'))
+
+        tasks.haystack_batch_update()
+        self.assertFalse(QueuedIndexUpdate.objects.exists())
+        results = SearchQuerySet().filter(content='coalescedname')
+        self.assertEqual([int(result.pk) for result in results], [video.pk])
+
+    @mock.patch('localtv.tasks.cache.add', mock.Mock(return_value=False))
+    def test_removal(self):
+        """
+        Videos which are no longer active should be removed from the index.
+        """
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.status = Video.REJECTED
+        video.save()
+        tasks.haystack_batch_update()
+        self.assertFalse(SearchQuerySet().models(Video).filter(
+                pk_hack=video.pk))
+
+    @mock.patch('localtv.tasks.haystack_batch_update.apply_async')
+    def test_watch_updates(self, apply_async):
+        """
+        Index updates which were only queued because of watches should bump
+        the popularity cache version rather than the site's, unless the
+        video was also saved.
+        """
+        QueuedIndexUpdate.objects.all().delete()
+        names = ('site:%i' % settings.SITE_ID,
+                 'popularity:%i' % settings.SITE_ID)
+        utils.bump_cache_version(*names)
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        opts = Video._meta
+        tasks.enqueue_index_update(opts.app_label, opts.module_name,
+                                   video.pk, False, watches_only=True)
+        site_version, popularity_version = utils.get_cache_versions(*names)
+        tasks.haystack_batch_update()
+        versions = utils.get_cache_versions(*names)
+        self.assertEqual(versions[0], site_version)
+        self.assertNotEqual(versions[1], popularity_version)
+
+        tasks.enqueue_index_update(opts.app_label, opts.module_name,
+                                   video.pk, False, watches_only=True)
+        video.save()
+        self.assertFalse(QueuedIndexUpdate.objects.get().watches_only)
+        tasks.haystack_batch_update()
+        self.assertNotEqual(utils.get_cache_versions(*names)[0],
+                            site_version)
+
+
+    @mock.patch('localtv.tasks.cache.add', mock.Mock(return_value=False))
+    def test_related_updates(self):
+        """
+        Changing the fields of a feed or user which are stored with their
+        videos should queue the videos for reindexing; other changes, like
+        polling a feed, shouldn't.
+        """
+        QueuedIndexUpdate.objects.all().delete()
+        feed = Feed.objects.get(pk=2)
+        feed.last_updated = datetime.datetime.now()
+        feed.save()
+        self.assertFalse(QueuedIndexUpdate.objects.exists())
+
+        feed.name = 'Renamed feed'
+        feed.save()
+        self.assertEqual(
+            set(QueuedIndexUpdate.objects.values_list('object_pk',
+                                                      flat=True)),
+            set(Video.objects.filter(feed=feed).values_list('pk',
+                                                            flat=True)))
+
+        QueuedIndexUpdate.objects.all().delete()
+        user = User.objects.get(username='user')
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.authors = [user]
+        QueuedIndexUpdate.objects.all().delete()
+        user.last_login = datetime.datetime.now()
+        user.save()
+        self.assertFalse(QueuedIndexUpdate.objects.exists())
+
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertEqual(list(QueuedIndexUpdate.objects.values_list(
+                    'object_pk', flat=True)), [video.pk])
+
+
+class VideoIndexTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['categories', 'videos']
+
+    def test_index_queryset_prefetches_related_pks(self):
+        """
+        Videos from the index_queryset should be prepared without any further
+        queries, and with the same m2m values as an unprefetched video.
+        """
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.categories = [1, 2]
+        video.authors = [User.objects.get(username='user')]
+        video.tags = 'foo bar'
+        index = site.get_index(Video)
+        fields = ('tags', 'categories', 'authors', 'playlists')
+
+        videos = list(index.index_queryset())
+        prepared = {}
+        def prepare():
+            for v in videos:
+                prepared[v.pk] = dict((field, sorted(index._prepare_field(
+                                v, field))) for field in fields)
+        self.assertNumQueries(0, prepare)
+
+        for v in Video.objects.filter(status=Video.ACTIVE):
+            expected = dict((field, sorted(int(rel.pk) for rel in
+                                           getattr(v, field).all()))
+                            for field in fields)
+            self.assertEqual(prepared[v.pk], expected)
+        self.assertEqual(prepared[video.pk]['categories'], [1, 2])
+        self.assertEqual(len(prepared[video.pk]['tags']), 2)
+
+    def test_read_queryset_prefetches_related(self):
+        """
+        Videos loaded for search results should have their foreign keys,
+        tags, categories and authors fetched up front, in order.
+        """
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.categories = [1, 2]
+        video.authors = [User.objects.get(username='user')]
+        video.tags = 'foo bar'
+        index = site.get_index(Video)
+        pks = list(Video.objects.filter(status=Video.ACTIVE).values_list(
+                'pk', flat=True)[:15])
+
+        videos = index.read_queryset().in_bulk(pks)
+        related = {}
+        def access():
+            for v in videos.values():
+                v.feed, v.search, v.user, v.site
+                related[v.pk] = (v.tag_list, v.category_list, v.author_list)
+        self.assertNumQueries(0, access)
+
+        for pk in pks:
+            v = Video.objects.get(pk=pk)
+            self.assertEqual(related[pk], (list(v.tags.all()),
+                                           list(v.categories.all()),
+                                           list(v.authors.all())))
+        self.assertEqual([tag.name for tag in related[video.pk][0]],
+                         ['bar', 'foo'])
+
+    def test_update_index_incremental(self):
+        """
+        The update_index_incremental command should remove videos which have
+        stopped being active since the last run, and save a checkpoint.
+        """
+        call_command('update_index_incremental', verbosity=0)
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        # update() doesn't send signals, so only the command will notice.
+        Video.objects.filter(pk=video.pk).update(
+            status=Video.REJECTED,
+            when_modified=datetime.datetime.now() + datetime.timedelta(
+                minutes=5))
+        self.assertTrue(SearchQuerySet().models(Video).filter(
+                django_id__in=[video.pk]).count())
+        call_command('update_index_incremental', verbosity=0)
+        self.assertFalse(SearchQuerySet().models(Video).filter(
+                django_id__in=[video.pk]).count())
+        self.assertEqual(update_index_incremental.read_checkpoint()[1],
+                         video.pk)
+
+    def test_update_index_full_workers(self):
+        """
+        With --workers, full updates should have the documents prepared by a
+        pool of processes, and write them from the command's own process.
+        """
+        class Pool(object):
+            # Runs the "workers" in this process.
+            def __init__(self, processes):
+                pass
+
+            def imap(self, func, iterable):
+                return itertools.imap(func, iterable)
+
+            def close(self):
+                pass
+            terminate = join = close
+
+        site.get_index(Video).backend.clear(models=[Video])
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        Video.objects.filter(pk=video.pk).update(status=Video.REJECTED)
+        with mock.patch('multiprocessing.Pool', Pool):
+            call_command('update_index_incremental', full=True, workers=2,
+                         batch_size=5, verbosity=0)
+        self.assertEqual(
+            set(int(result.pk) for result in SearchQuerySet().models(Video)),
+            set(Video.objects.filter(status=Video.ACTIVE).values_list(
+                    'pk', flat=True)))
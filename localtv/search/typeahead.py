@@ -0,0 +1,468 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2012 Participatory Culture Foundation
+#
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Suggestions for completing search queries, served from sorted in-process
+arrays so that they never touch the search backend.
+
+Each kind of suggestion has its own :class:`PrefixIndex` per site, which is
+built on its own when the objects it lists change. Like
+:mod:`localtv.search.keywords`, changes in this process take effect
+immediately, and changes in other processes are noticed through shared
+cache versions which are checked at most every
+``LOCALTV_KEYWORD_INDEX_CHECK_INTERVAL`` seconds. The indexes built from a
+site's videos are updated with just the videos which changed, as recorded by
+:func:`localtv.models.bump_videos_cache_version`, rather than rebuilt.
+
+"""
+
+import bisect
+import itertools
+import operator
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.template.defaultfilters import slugify
+from tagging.models import Tag, TaggedItem
+
+from localtv import settings as lsettings
+from localtv import utils
+from localtv.models import (Category, Feed, Video, TRACKED_FIELDS,
+                            get_changed_videos, tracked_fields_changed)
+from localtv.search import keywords
+from localtv.search.query import KEYWORDS
+
+#: The most suggestions which are returned for a query.
+SUGGESTION_LIMIT = 10
+_indexes = {}
+# Indexes are updated in place, so they're only used with this held.
+_lock = threading.Lock()
+
+
+class PrefixIndex(object):
+    """
+    A sorted array of keys, each of which has an entry, which can be searched
+    for the entries of the keys starting with a prefix.
+
+    Indexes are built from ``(owner, key, entry)`` tuples. The keys of an
+    owner other than ``None``, such as a video, can be replaced when it
+    changes without rebuilding the whole index.
+
+    """
+    #: Changes to more keys than this are made by merging them into new
+    #: arrays, rather than by inserting and deleting them one by one.
+    MERGE_SIZE = 100
+
+    def __init__(self, items, version):
+        self.owners = {}
+        pairs = sorted(self._own(items))
+        self.keys = [key for key, entry in pairs]
+        self.entries = [entry for key, entry in pairs]
+        self.version = version
+        self.checked = time.time()
+
+    def _own(self, items):
+        for owner, key, entry in items:
+            if owner is not None:
+                self.owners.setdefault(owner, []).append((key, entry))
+            yield key, entry
+
+    def replace(self, owners, items):
+        """
+        Removes the keys of ``owners``, then adds ``items``.
+
+        """
+        removed = []
+        for owner in owners:
+            removed.extend(self.owners.pop(owner, ()))
+        added = list(self._own(items))
+        if len(removed) + len(added) > self.MERGE_SIZE:
+            removed = set(removed)
+            pairs = [pair for pair in itertools.izip(self.keys, self.entries)
+                     if pair not in removed]
+            # Both runs are already sorted, so this is a merge.
+            pairs.extend(sorted(added))
+            pairs.sort(key=operator.itemgetter(0))
+            self.keys = [key for key, entry in pairs]
+            self.entries = [entry for key, entry in pairs]
+            return
+        for key, entry in removed:
+            index = bisect.bisect_left(self.keys, key)
+            while self.entries[index] != entry:
+                index += 1
+            del self.keys[index]
+            del self.entries[index]
+        for key, entry in added:
+            index = bisect.bisect_right(self.keys, key)
+            self.keys.insert(index, key)
+            self.entries.insert(index, entry)
+
+    def search(self, prefix, limit):
+        """
+        Returns up to ``limit`` distinct entries for the keys which start with
+        ``prefix``, in the order of their keys.
+
+        """
+        results = []
+        index = bisect.bisect_left(self.keys, prefix)
+        while (index < len(self.keys) and len(results) < limit and
+               self.keys[index].startswith(prefix)):
+            entry = self.entries[index]
+            if entry not in results:
+                results.append(entry)
+            index += 1
+        return results
+
+
+class VideoItemIndex(PrefixIndex):
+    """
+    A :class:`PrefixIndex` of things which active videos have, such as users
+    or tags, owned by their pks. It also keeps track of which active videos
+    have each of them, so that it can be updated when videos change.
+
+    """
+    def __init__(self, items, version, video_items):
+        super(VideoItemIndex, self).__init__(items, version)
+        self.video_items = {}
+        self.item_videos = {}
+        for video_pk, item_pk in video_items:
+            self.video_items.setdefault(video_pk, set()).add(item_pk)
+            self.item_videos.setdefault(item_pk, set()).add(video_pk)
+
+    def update(self, video_pks, video_items, get_items):
+        """
+        Replaces what the videos in ``video_pks`` have with ``video_items``,
+        ``(video_pk, item_pk)`` tuples. Items which no active video has any
+        more are removed, and items which weren't in the index before are
+        added with the index items returned by ``get_items(item_pks)``.
+
+        """
+        removed = set()
+        for video_pk in video_pks:
+            for item_pk in self.video_items.pop(video_pk, ()):
+                videos = self.item_videos[item_pk]
+                videos.discard(video_pk)
+                if not videos:
+                    del self.item_videos[item_pk]
+                    removed.add(item_pk)
+        added = set()
+        for video_pk, item_pk in video_items:
+            self.video_items.setdefault(video_pk, set()).add(item_pk)
+            if item_pk in removed:
+                removed.discard(item_pk)
+            elif item_pk not in self.item_videos:
+                added.add(item_pk)
+            self.item_videos.setdefault(item_pk, set()).add(video_pk)
+        if removed or added:
+            self.replace(removed, get_items(added) if added else ())
+
+
+def _fold(value):
+    return u' '.join(value.lower().split())
+
+
+def _quote(value):
+    if len(value.split()) > 1:
+        return u'"%s"' % value.replace('"', '')
+    return value
+
+
+def _active_videos(site_id):
+    return Video.objects.filter(site=site_id, status=Video.ACTIVE)
+
+
+def _video_items(videos):
+    # Titles can be matched from the start of any of their words.
+    for pk, name in videos.values_list('pk', 'name'):
+        words = _fold(name).split(' ')
+        for start in xrange(len(words)):
+            yield pk, u' '.join(words[start:]), (pk, name)
+
+
+def _build_videos(site_id, version):
+    return PrefixIndex(_video_items(_active_videos(site_id)), version)
+
+
+def _update_videos(index, site_id, video_pks):
+    index.replace(video_pks, _video_items(_active_videos(site_id).filter(
+                pk__in=video_pks)))
+
+
+def _build_categories(site_id, version):
+    def items():
+        for slug, name in Category.objects.filter(site=site_id).values_list(
+                'slug', 'name'):
+            yield None, _fold(name), (slug, name)
+            yield None, slug.lower(), (slug, name)
+    return PrefixIndex(items(), version)
+
+
+def _tag_items(tags):
+    for pk, name in tags.values_list('pk', 'name'):
+        yield pk, _fold(name), name
+
+
+def _video_tags(site_id):
+    return TaggedItem._default_manager.filter(
+        content_type=ContentType.objects.get_for_model(Video),
+        object_id__in=_active_videos(site_id).order_by().values('pk')
+        ).values_list('object_id', 'tag')
+
+
+def _build_tags(site_id, version):
+    # Only the tags of active videos on the site, so that the tags of other
+    # sites and of unapproved videos aren't shown.
+    tags = Tag.objects.filter(
+        items__content_type=ContentType.objects.get_for_model(Video),
+        items__object_id__in=_active_videos(site_id).order_by().values('pk'))
+    return VideoItemIndex(_tag_items(tags.distinct()), version,
+                          _video_tags(site_id))
+
+
+def _update_tags(index, site_id, video_pks):
+    index.update(
+        video_pks, _video_tags(site_id).filter(object_id__in=video_pks),
+        lambda tag_pks: _tag_items(Tag.objects.filter(pk__in=tag_pks)))
+
+
+def _author_items(users):
+    for pk, username, first_name, last_name in users.values_list(
+            'pk', 'username', 'first_name', 'last_name'):
+        full_name = u' '.join((first_name, last_name)).strip()
+        entry = (username, full_name or username)
+        yield pk, username.lower(), entry
+        if full_name:
+            yield pk, _fold(full_name), entry
+
+
+def _video_authors(site_id):
+    return Video.authors.through._default_manager.filter(
+        video__site=site_id, video__status=Video.ACTIVE,
+        user__is_active=True).values_list('video', 'user')
+
+
+def _build_authors(site_id, version):
+    # Only the authors of videos on the site, so that the endpoint can't be
+    # used to list every account.
+    return VideoItemIndex(_author_items(User.objects.filter(
+                is_active=True, authored_set__site=site_id,
+                authored_set__status=Video.ACTIVE).distinct()),
+                          version, _video_authors(site_id))
+
+
+def _update_authors(index, site_id, video_pks):
+    index.update(
+        video_pks, _video_authors(site_id).filter(video__in=video_pks),
+        lambda user_pks: _author_items(User.objects.filter(pk__in=user_pks)))
+
+
+def _build_feeds(site_id, version):
+    def items():
+        for pk, name in Feed.objects.filter(site=site_id).values_list(
+                'pk', 'name'):
+            if name:
+                yield None, _fold(name), (pk, name)
+    return PrefixIndex(items(), version)
+
+
+def _video_suggestion(entry, head):
+    pk, name = entry
+    return {'type': 'video', 'label': name,
+            'url': reverse('localtv_view_video',
+                           kwargs={'video_id': pk,
+                                   'slug': slugify(name)[:30]})}
+
+
+def _category_suggestion(entry, head):
+    slug, name = entry
+    return {'type': 'category', 'label': name,
+            'query': u'%scategory:%s' % (head, slug)}
+
+
+def _tag_suggestion(name, head):
+    return {'type': 'tag', 'label': name,
+            'query': u'%stag:%s' % (head, _quote(name))}
+
+
+def _author_suggestion(entry, head):
+    username, name = entry
+    return {'type': 'author', 'label': name,
+            'query': u'%suser:%s' % (head, username)}
+
+
+def _feed_suggestion(entry, head):
+    pk, name = entry
+    return {'type': 'feed', 'label': name,
+            'query': u'%sfeed:%s' % (head, _quote(name))}
+
+
+#: The kinds of suggestions, in the order they're made when the word being
+#: completed isn't a keyword. Each has the models it depends on, a function
+#: returning the names of the cache versions for a site, a function building
+#: an index for a site with a version, a function updating an index for the
+#: given changed videos (or ``None``) and a function turning an entry into a
+#: suggestion. Indexes which can be updated have the site's videos cache
+#: version last.
+SOURCES = (
+    ('category', (Category,),
+     lambda site_id: [keywords.version_name(Category)],
+     _build_categories, None, _category_suggestion),
+    ('tag', (Tag, Video, TaggedItem),
+     lambda site_id: [keywords.version_name(Tag), 'videos:%i' % site_id],
+     _build_tags, _update_tags, _tag_suggestion),
+    ('author', (User, Video),
+     lambda site_id: [keywords.version_name(User), 'videos:%i' % site_id],
+     _build_authors, _update_authors, _author_suggestion),
+    ('feed', (Feed,), lambda site_id: [keywords.version_name(Feed)],
+     _build_feeds, None, _feed_suggestion),
+    ('video', (Video,), lambda site_id: ['videos:%i' % site_id],
+     _build_videos, _update_videos, _video_suggestion),
+)
+_sources = dict((source[0], source) for source in SOURCES)
+#: The sources whose suggestions complete the value of each keyword.
+KEYWORD_SOURCES = {
+    'category': 'category',
+    'tag': 'tag',
+    'user': 'author',
+    'feed': 'feed',
+}
+
+
+def get_index(name):
+    """
+    Returns an up-to-date :class:`PrefixIndex` for the source called
+    ``name`` on the current site. This must be called with the index lock
+    held.
+
+    """
+    name, models, get_version_names, build, update, make_suggestion = (
+        _sources[name])
+    site_id = settings.SITE_ID
+    key = (name, site_id)
+    index = _indexes.get(key)
+    now = time.time()
+    if (index is not None and
+        now - index.checked < lsettings.KEYWORD_INDEX_CHECK_INTERVAL):
+        return index
+    version = utils.get_cache_versions(*get_version_names(site_id))
+    if (index is not None and index.version != version and
+        update is not None and index.version[:-1] == version[:-1]):
+        # Only the site's videos have changed.
+        video_pks = get_changed_videos(site_id, index.version[-1],
+                                       version[-1])
+        if video_pks is not None:
+            update(index, site_id, video_pks)
+            index.version = version
+    if index is None or index.version != version:
+        index = build(site_id, version)
+        _indexes[key] = index
+    index.checked = now
+    return index
+
+
+def _search(name, prefix, head, limit):
+    make_suggestion = _sources[name][5]
+    with _lock:
+        entries = get_index(name).search(prefix, limit)
+    return [make_suggestion(entry, head) for entry in entries]
+
+
+def suggest(query, limit=SUGGESTION_LIMIT):
+    """
+    Returns a list of up to ``limit`` suggestions for completing the last
+    word of ``query``. Each is a dictionary with a ``type``, a ``label`` and
+    either the ``query`` to search for instead or, for videos, the ``url`` to
+    go to. Video titles are matched against all of the query's plain words,
+    rather than just the last one.
+
+    """
+    parts = query.rsplit(None, 1)
+    if not parts or query[-1:].isspace():
+        return []
+    head = query[:len(query) - len(parts[-1])]
+    word = parts[-1]
+    negated = word.startswith('-')
+    if negated:
+        head, word = head + '-', word[1:]
+    prefix = _fold(word.strip('"\''))
+
+    if ':' in prefix:
+        keyword, rest = prefix.split(':', 1)
+        name = KEYWORD_SOURCES.get(keyword)
+        if name is None:
+            return []
+        return _search(name, rest, head, limit)
+
+    suggestions = [{'type': 'keyword', 'label': u'%s:' % keyword_name,
+                    'query': u'%s%s:' % (head, keyword_name)}
+                   for keyword_name in sorted(KEYWORDS)
+                   if prefix and keyword_name.startswith(prefix)]
+    for source in SOURCES:
+        name = source[0]
+        if not prefix or len(suggestions) >= limit:
+            break
+        if name == 'video':
+            if negated:
+                continue
+            prefix = _fold(u' '.join(part.strip('"\'')
+                                     for part in query.split()
+                                     if ':' not in part and
+                                     not part.startswith('-')))
+        suggestions.extend(_search(name, prefix, head,
+                                   limit - len(suggestions)))
+    return suggestions[:limit]
+
+
+def clear_cache():
+    """Forgets every index built by this process."""
+    with _lock:
+        _indexes.clear()
+
+
+def _model_indexes_signal_listener(sender, instance=None, **kwargs):
+    if sender is Video.authors.through or sender is TaggedItem:
+        sender = Video
+    elif (sender is User and
+          not tracked_fields_changed(instance, TRACKED_FIELDS[User],
+                                     kwargs.get('signal'))):
+        # Users are saved every time they log in.
+        return
+    with _lock:
+        for name, models, get_version_names, build, update, \
+                make_suggestion in SOURCES:
+            if sender not in models:
+                continue
+            for key, index in _indexes.items():
+                if key[0] != name:
+                    continue
+                if sender is Video and update is not None:
+                    # Have the changed videos' cache versions checked the next
+                    # time the index is used, so that it's updated with them.
+                    index.checked = 0
+                else:
+                    del _indexes[key]
+
+for model in set(model for source in SOURCES for model in source[1]):
+    post_save.connect(_model_indexes_signal_listener, sender=model)
+    post_delete.connect(_model_indexes_signal_listener, sender=model)
+m2m_changed.connect(_model_indexes_signal_listener,
+                    sender=Video.authors.through)
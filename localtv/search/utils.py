@@ -15,38 +15,219 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import base64
 from datetime import datetime
+import hashlib
+import json
+import time
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.db.models.fields import FieldDoesNotExist
 from haystack.backends import SQ
 from tagging.models import Tag
 
-from localtv.models import Video, Feed, Category
+from localtv import settings as lsettings
+from localtv import utils
+from localtv.models import Video, Feed, Category, POPULARITY_UPDATED_KEY
 from localtv.playlists.models import Playlist
+from localtv.search import keywords
 from localtv.search.forms import SmartSearchForm, FilterForm
 
 
+CURSOR_DATETIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def make_cursor(value, skip):
+    """
+    Returns an opaque token for a position in sorted results: after the first
+    ``skip`` results whose sort field is ``value``.
+
+    """
+    if isinstance(value, datetime):
+        value = 'd%s' % value.strftime(CURSOR_DATETIME_FORMAT)
+    else:
+        value = 'i%i' % value
+    return base64.urlsafe_b64encode('%s.%i' % (value, skip)).rstrip('=')
+
+
+def parse_cursor(token):
+    """
+    Returns the ``(value, skip)`` tuple for a token made by
+    :func:`make_cursor`, or ``None`` if the token isn't valid.
+
+    """
+    if not token:
+        return None
+    try:
+        token = str(token)
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, skip = data.rsplit('.', 1)
+        if value[0] == 'd':
+            value = datetime.strptime(value[1:], CURSOR_DATETIME_FORMAT)
+        elif value[0] == 'i':
+            value = int(value[1:])
+        else:
+            return None
+        skip = int(skip)
+    except (TypeError, ValueError, IndexError, UnicodeEncodeError):
+        return None
+    if skip < 0:
+        return None
+    return value, skip
+
+
+def get_sort_version_names(sort):
+    """
+    Returns the names of the cache versions (see
+    :func:`localtv.utils.get_cache_versions`) for results with the given
+    sort. Changes to videos bump the site's version; changes to their watch
+    counts only bump the popularity version, which only matters to popularity
+    sorts.
+
+    """
+    names = ['site:%i' % settings.SITE_ID]
+    if 'popular' in (sort or ''):
+        names.append('popularity:%i' % settings.SITE_ID)
+    return names
+
+
+def get_result_count(searchqueryset, max_age=0):
+    """
+    Returns the number of results for ``searchqueryset``. Counts are cached
+    by the query and filters, ignoring the sort, until a video on the site
+    changes.
+
+    If ``max_age`` is given, a count made before the latest changes is used
+    as an estimate, as long as it's no more than ``max_age`` seconds old.
+
+    """
+    query = searchqueryset.query.build_query()
+    if not isinstance(query, basestring):
+        # Xapian queries are objects.
+        query = str(query)
+    models = sorted(model._meta.object_name
+                    for model in searchqueryset.query.models)
+    key = 'localtv:result_count:%i:%s' % (settings.SITE_ID, hashlib.md5(
+            repr((query, models,
+                  sorted(searchqueryset.query.narrow_queries)))).hexdigest())
+    version = utils.get_cache_versions('site:%i' % settings.SITE_ID)[0]
+    cached = cache.get(key)
+    if cached is not None:
+        cached_version, count, counted = cached
+        if cached_version == version or time.time() - counted <= max_age:
+            return count
+    count = len(searchqueryset)
+    cache.set(key, (version, count, time.time()),
+              lsettings.RESULT_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+class IndexedAuthor(object):
+    """
+    Stands in for an author's :class:`User` in an :class:`IndexedVideo`.
+
+    """
+    def __init__(self, pk, username, first_name, last_name):
+        self.pk = self.id = pk
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+
+    def get_full_name(self):
+        return (u'%s %s' % (self.first_name, self.last_name)).strip()
+
+
+class IndexedFeed(object):
+    """
+    Stands in for a :class:`Feed` in an :class:`IndexedVideo`.
+
+    """
+    has_thumbnail = False
+
+    def __init__(self, pk, name):
+        self.pk = self.id = pk
+        self.name = name
+
+
+class IndexedVideo(object):
+    """
+    Stands in for a :class:`Video` in listing templates, using the fields
+    which :class:`localtv.search_indexes.VideoIndex` stores, so that the
+    video doesn't have to be loaded from the database. Anything else is
+    loaded from the video itself.
+
+    """
+    def __init__(self, result):
+        self._result = result
+        self.pk = self.id = int(result.pk)
+        self.name = result.name
+        self.description = result.description
+        self.watch_count = result.watch_count
+        self.last_featured = result.last_featured
+        if self.last_featured == SortFilterMixin._empty_value['featured']:
+            self.last_featured = None
+        self.thumbnail_urls = json.loads(result.thumbnail_urls)
+        byline = json.loads(result.byline)
+        self.author_list = [IndexedAuthor(*author)
+                            for author in byline['authors']]
+        self.feed = byline['feed'] and IndexedFeed(*byline['feed'])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._result.object, name)
+
+    def get_absolute_url(self):
+        return self._result.absolute_url
+
+    def when(self):
+        return self._result.best_date
+
+    def when_prefix(self):
+        return self._result.when_prefix
+
+
 class SearchQuerysetSliceHack(object):
     """
     Wraps a haystack SearchQueryset so that slice operations and __getitem__
     calls return :class:`localtv.models.Video` instances efficiently instead of
     returning result objects. This is a hack for backwards compatibility.
 
+    If ``from_index`` is ``True``, :class:`IndexedVideo` instances are
+    returned instead, and the searchqueryset shouldn't use ``load_all``.
+    ``count_max_age`` is passed to :func:`get_result_count` when the results
+    are counted.
+
     """
-    def __init__(self, searchqueryset):
+    #: The search results of the last slice, for working out the cursor of
+    #: the page which follows them.
+    last_results = None
+
+    def __init__(self, searchqueryset, from_index=False, count_max_age=0):
         self.searchqueryset = searchqueryset
+        self.from_index = from_index
+        self.count_max_age = count_max_age
+
+    def _video(self, result):
+        # Results which were indexed before the listing fields were added
+        # are loaded as usual until the index is rebuilt.
+        if self.from_index and getattr(result, 'byline', None) is not None:
+            return IndexedVideo(result)
+        return result.object
 
     def __getitem__(self, k):
         results = self.searchqueryset[k]
         if isinstance(results, list):
-            return [result.object for result in results
+            self.last_results = results
+            return [self._video(result) for result in results
                     if result is not None]
-        return result.object
+        return self._video(results)
 
     def __len__(self):
-        return len(self.searchqueryset)
+        return get_result_count(self.searchqueryset, self.count_max_age)
 
     def __iter__(self):
         return iter(self.searchqueryset)
@@ -128,6 +309,65 @@ class SortFilterMixin(object):
                             ''.join(('-' if desc else '', order_by)))
         return searchqueryset
 
+    def _seek(self, searchqueryset, sort, cursor):
+        """
+        Restricts a searchqueryset which was sorted by :meth:`_sort` to
+        ``cursor`` (a tuple from :func:`parse_cursor`) and returns a
+        (``searchqueryset``, ``start``) tuple. The results which follow the
+        cursor begin at ``start``, which is the number of results with the
+        cursor's value which were already seen. This keeps the cost of a page
+        independent of how deep it is, without relying on the backend to
+        break ties in the sort, which Whoosh can't do.
+
+        If the sort can't be used with a cursor, ``None`` is returned for
+        ``start``.
+
+        """
+        sort, desc = self._process_sort(sort)
+        order_by = self.sorts.get(sort, None)
+        if order_by is None or cursor is None:
+            return searchqueryset, None
+        value, skip = cursor
+        lookup = '%s__%s' % (order_by, 'lte' if desc else 'gte')
+        return searchqueryset.filter(**{lookup: value}), skip
+
+    def _get_next_cursor(self, sort, results, cursor=None,
+                         searchqueryset=None, start=0):
+        """
+        Returns the cursor tuple for the results which follow ``results``, a
+        list of search results which began at ``cursor``. Returns ``None`` if
+        the sort can't be used with a cursor or there are no results.
+
+        Without a cursor, the results are taken to begin at the offset
+        ``start`` in ``searchqueryset``; if they're all tied, the tie may
+        have begun before them, so the results ahead of it are counted.
+
+        """
+        sort, desc = self._process_sort(sort)
+        order_by = self.sorts.get(sort, None)
+        end = start + len(results or ())
+        results = [result for result in results or () if result is not None]
+        if order_by is None or not results:
+            return None
+        value = getattr(results[-1], order_by, None)
+        if value is None:
+            return None
+        skip = 0
+        for result in reversed(results):
+            if getattr(result, order_by, None) != value:
+                break
+            skip += 1
+        else:
+            # Every result had the cursor's value, so the ones before them
+            # were skipped as well.
+            if cursor is not None:
+                if cursor[0] == value:
+                    skip += cursor[1]
+            elif start and searchqueryset is not None:
+                lookup = '%s__%s' % (order_by, 'gt' if desc else 'lt')
+                skip = end - searchqueryset.filter(**{lookup: value}).count()
+        return value, skip
+
     def _get_filter_objects(self, model_class, **kwargs):
         try:
             model_class._meta.get_field_by_name('site')
@@ -137,6 +377,22 @@ class SortFilterMixin(object):
             kwargs['site'] = Site.objects.get_current()
         return model_class._default_manager.filter(**kwargs)
 
+    def _get_filter_pks(self, model_class, **kwargs):
+        """
+        Returns a list of the pks of the ``model_class`` instances which
+        :meth:`_get_filter_objects` would return. A lookup on a single field
+        which is in the :mod:`keyword index <localtv.search.keywords>` doesn't
+        query the database.
+
+        """
+        if len(kwargs) == 1 and model_class in keywords.FIELDS:
+            field, value = kwargs.items()[0]
+            index = keywords.get_index(model_class)
+            if field == 'pk' or field in index.fields:
+                return index.lookup(field, value)
+        return list(self._get_filter_objects(model_class, **kwargs
+                                             ).values_list('pk', flat=True))
+
     def _filter(self, searchqueryset, **kwargs):
         """
         Sets up the searchqueryset to use the specified filter(s) and returns a
@@ -146,7 +402,8 @@ class SortFilterMixin(object):
 
         Any ``kwargs`` which are valid filter names are expected to be either an
         iterable of filter objects or dictionaries to be passed as ``kwargs``
-        to :meth:`_get_filter_objects`.
+        to :meth:`_get_filter_pks`. For dictionaries, the filter objects are
+        a lazy queryset, which is only evaluated if it's used.
 
         """
         clean_filter_dict = {}
@@ -154,16 +411,18 @@ class SortFilterMixin(object):
             filter_def = self.filters.get(filter_name, None)
             if filter_def is not None:
                 if isinstance(filter_objects, dict):
-                    new_filter_objects = self._get_filter_objects(
-                            filter_def['model'], **filter_objects)
+                    model_class = filter_def['model']
+                    pks = self._get_filter_pks(model_class, **filter_objects)
+                    new_filter_objects = model_class._default_manager.filter(
+                        pk__in=pks)
                 else:
                     try:
                         new_filter_objects = list(filter_objects)
                     except TypeError:
                         new_filter_objects = []
-                clean_filter_dict[filter_name] = new_filter_objects
-                if new_filter_objects:
                     pks = [obj.pk for obj in new_filter_objects]
+                clean_filter_dict[filter_name] = new_filter_objects
+                if pks:
                     sq = None
 
                     for field in filter_def['fields']:
@@ -199,6 +458,14 @@ class SortFilterViewMixin(SortFilterMixin):
         """Fetches the sort for the current request."""
         return request.GET.get('sort', self.default_sort)
 
+    def _get_cursor(self, request):
+        """
+        Fetches the cursor tuple for the current request from its ``after``
+        parameter, or ``None`` if there isn't a valid one.
+
+        """
+        return parse_cursor(request.GET.get('after'))
+
     def _get_filter_info(self, request, default=None):
         """
         Returns a ``(filter_dict, filter_form)`` tuple. ``filter_form`` is used
@@ -217,3 +484,53 @@ class SortFilterViewMixin(SortFilterMixin):
             filter_dict[self.default_filter] = default
 
         return filter_dict, filter_form
+
+    def _get_last_modified(self, request, *args, **kwargs):
+        """
+        Returns the time of the last change which could affect the results,
+        for conditional requests. This is the last change to any video, or
+        for popularity sorts the last popularity update if that was later.
+
+        """
+        if not hasattr(request, '_localtv_last_modified'):
+            last_modified = Video.objects.get_last_modified()
+            if 'popular' in (self._get_sort(request) or ''):
+                popularity_updated = cache.get(
+                    POPULARITY_UPDATED_KEY % settings.SITE_ID)
+                if popularity_updated is not None:
+                    last_modified = max(last_modified, popularity_updated)
+            request._localtv_last_modified = last_modified
+        return request._localtv_last_modified
+
+    def _get_last_modified_header(self, request, *args, **kwargs):
+        """
+        Returns the time to send as the Last-Modified header, or ``None`` if
+        there shouldn't be one. Without change stamps, the last change is
+        read from the videos which are left, so it doesn't move when a video
+        is deleted; only the ETag can be trusted then.
+
+        """
+        if not lsettings.ENABLE_CHANGE_STAMPS:
+            return None
+        return self._get_last_modified(request, *args, **kwargs)
+
+    def _get_etag_parts(self, request, *args, **kwargs):
+        """
+        Returns a list of everything other than the results' last change
+        which the response depends on. This includes the site's cache
+        version, which also changes when videos are deleted or the site's
+        settings are saved.
+
+        """
+        return [self.__class__.__name__, self.default_sort,
+                self.default_filter, request.path, sorted(request.GET.lists()),
+                utils.get_cache_versions(*get_sort_version_names(
+                        self._get_sort(request)))]
+
+    def _get_etag(self, request, *args, **kwargs):
+        last_modified = self._get_last_modified(request)
+        if last_modified is None:
+            return None
+        parts = self._get_etag_parts(request, *args, **kwargs)
+        return hashlib.md5(repr(parts +
+                                [last_modified.isoformat()])).hexdigest()
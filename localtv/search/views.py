@@ -0,0 +1,33 @@
+# Miro Community - Easiest way to make a video website
+#
+# Copyright (C) 2012 Participatory Culture Foundation
+#
+# Miro Community is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or (at your
+# option) any later version.
+#
+# Miro Community is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from django.http import HttpResponse
+
+from localtv.search import typeahead
+
+
+def suggest(request):
+    """
+    Returns JSON suggestions for completing the last word of the ``q``
+    parameter. See :func:`localtv.search.typeahead.suggest`.
+
+    """
+    query = request.GET.get('q', '')
+    data = {'query': query, 'suggestions': typeahead.suggest(query)}
+    return HttpResponse(json.dumps(data), mimetype='application/json')
@@ -15,15 +15,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.db.models import Count, signals
+import json
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import signals
 from django.forms.models import model_to_dict
 from django.utils.encoding import force_unicode
+from tagging.models import TaggedItem
 
 from haystack import indexes
 from haystack import site
-from localtv.models import Video, Watch
+from localtv.models import (Video, VideoQuerySet, Watch, WatchBucket,
+                            WatchCount, Feed, SavedSearch,
+                            tracked_fields_changed)
+from localtv.playlists.models import PlaylistItem
 from localtv.search.utils import SortFilterMixin
-from localtv.tasks import haystack_update_index
+from localtv.tasks import enqueue_index_update
+from localtv.templatetags.localtv_thumbnail import thumbnail_url
 
 from django.conf import settings
 CELERY_USING = getattr(settings, 'LOCALTV_CELERY_USING', 'default')
@@ -47,7 +56,7 @@ class QueuedSearchIndex(indexes.SearchIndex):
     def _enqueue_removal(self, instance, **kwargs):
         self._enqueue_instance(instance, True)
 
-    def _enqueue_instance(self, instance, is_removal):
+    def _get_queue_using(self, instance):
         using = instance._state.db
         if using == 'default':
             # This gets called from both Celery and from the MC application.
@@ -55,11 +64,123 @@ class QueuedSearchIndex(indexes.SearchIndex):
             # need to use CELERY_USING as our database.  If they're the same,
             # or we're not using separate databases, this is a no-op.
             using = CELERY_USING
-        haystack_update_index.delay(instance._meta.app_label,
-                                    instance._meta.module_name,
-                                    instance.pk,
-                                    is_removal,
-                                    using=using)
+        return using
+
+    def _enqueue_instance(self, instance, is_removal, watches_only=False):
+        using = self._get_queue_using(instance)
+        # Updates are coalesced and written to the index in batches by
+        # localtv.tasks.haystack_batch_update.
+        enqueue_index_update(instance._meta.app_label,
+                             instance._meta.module_name,
+                             instance.pk,
+                             is_removal,
+                             using=using,
+                             watches_only=watches_only)
+
+
+class BatchPrefetchQuerySet(VideoQuerySet):
+    """
+    Hands the videos it returns to :meth:`_prefetch` in batches of
+    :attr:`prefetch_batch_size`, so that related rows can be fetched with one
+    query per relation for each batch rather than for each video.
+
+    """
+    prefetch_batch_size = 200
+
+    def iterator(self):
+        batch = []
+        for video in super(BatchPrefetchQuerySet, self).iterator():
+            batch.append(video)
+            if len(batch) >= self.prefetch_batch_size:
+                self._prefetch(batch)
+                for prefetched in batch:
+                    yield prefetched
+                batch = []
+        if batch:
+            self._prefetch(batch)
+            for prefetched in batch:
+                yield prefetched
+
+    def _prefetch(self, videos):
+        pass
+
+
+class VideoIndexQuerySet(BatchPrefetchQuerySet):
+    """
+    Fetches the pks of the tags, categories, authors and playlists of the
+    videos it returns. The pks are stored on the videos for
+    :meth:`VideoIndex._prepare_field`.
+
+    """
+    def _prefetch(self, videos):
+        videos_by_pk = {}
+        for video in videos:
+            video._index_related_pks = {'tags': [], 'categories': [],
+                                        'authors': [], 'playlists': []}
+            videos_by_pk[video.pk] = video
+        pks = videos_by_pk.keys()
+        content_type = ContentType.objects.db_manager(self.db
+                                                      ).get_for_model(Video)
+        related = (
+            ('tags', TaggedItem._default_manager.filter(
+                    content_type=content_type, object_id__in=pks
+                    ).values_list('object_id', 'tag')),
+            ('categories', Video.categories.through._default_manager.filter(
+                    video__in=pks).values_list('video', 'category')),
+            ('playlists', PlaylistItem._default_manager.filter(
+                    video__in=pks).values_list('video', 'playlist')),
+        )
+        for field, pairs in related:
+            for video_pk, related_pk in pairs.using(self.db):
+                videos_by_pk[video_pk]._index_related_pks[field].append(
+                    int(related_pk))
+        # The authors themselves are needed for VideoIndex.prepare_byline.
+        for video in videos:
+            video._related_lists = {'authors': []}
+        for row in Video.authors.through._default_manager.filter(
+                video__in=pks).select_related('user').order_by('pk').using(
+                self.db):
+            video = videos_by_pk[row.video_id]
+            video._index_related_pks['authors'].append(int(row.user_id))
+            video._related_lists['authors'].append(row.user)
+
+
+class VideoReadQuerySet(BatchPrefetchQuerySet):
+    """
+    Fetches the tags, categories and authors of the videos it returns, for
+    :attr:`Video.tag_list <localtv.models.Video.tag_list>` and friends. This
+    is what search results are loaded with, so that a page of results takes
+    the same few queries however many videos are on it.
+
+    """
+    def _prefetch(self, videos):
+        videos_by_pk = {}
+        for video in videos:
+            video._related_lists = {'tags': [], 'categories': [],
+                                    'authors': []}
+            videos_by_pk[video.pk] = video
+        pks = videos_by_pk.keys()
+        content_type = ContentType.objects.db_manager(self.db
+                                                      ).get_for_model(Video)
+        # Ordered as the related models' own querysets would be.
+        related = (
+            ('tags', 'tag', TaggedItem._default_manager.filter(
+                    content_type=content_type, object_id__in=pks
+                    ).select_related('tag').order_by('tag__name'),
+             'object_id'),
+            ('categories', 'category',
+             Video.categories.through._default_manager.filter(
+                    video__in=pks).select_related('category').order_by(
+                    'category__name'),
+             'video_id'),
+            ('authors', 'user', Video.authors.through._default_manager.filter(
+                    video__in=pks).select_related('user').order_by('pk'),
+             'video_id'),
+        )
+        for field, attr, rows, video_attr in related:
+            for row in rows.using(self.db):
+                videos_by_pk[getattr(row, video_attr)]._related_lists[
+                    field].append(getattr(row, attr))
 
 
 class VideoIndex(QueuedSearchIndex):
@@ -88,41 +209,109 @@ class VideoIndex(QueuedSearchIndex):
     when_approved = indexes.DateTimeField(model_attr='when_approved',
                             default=SortFilterMixin._empty_value['approved'])
 
+    # Stored but not indexed, so that listings can be rendered from search
+    # results (see LOCALTV_LISTING_FROM_INDEX and
+    # localtv.search.utils.IndexedVideo).
+    name = indexes.CharField(model_attr='name', indexed=False)
+    description = indexes.CharField(model_attr='description', indexed=False)
+    absolute_url = indexes.CharField(indexed=False)
+    when_prefix = indexes.CharField(indexed=False)
+    thumbnail_urls = indexes.CharField(indexed=False)
+    byline = indexes.CharField(indexed=False)
+
+    #: The video field for each model whose fields are stored with the
+    #: videos (see :meth:`prepare_byline` and :meth:`prepare_thumbnail_urls`),
+    #: and the stored fields.
+    related_stored_fields = {
+        User: ('authors', ('username', 'first_name', 'last_name')),
+        Feed: ('feed', ('name', 'has_thumbnail', 'thumbnail_extension')),
+        SavedSearch: ('search', ('has_thumbnail', 'thumbnail_extension')),
+    }
+
     def _setup_save(self, model):
         super(VideoIndex, self)._setup_save(model)
         signals.post_save.connect(self._enqueue_watch_update,
                                   sender=Watch)
+        for sender in self.related_stored_fields:
+            signals.post_save.connect(self._enqueue_related_update,
+                                      sender=sender)
+        # Deleting a user removes them from their videos without sending
+        # m2m_changed. Feeds and searches take their videos with them.
+        signals.pre_delete.connect(self._enqueue_related_removal,
+                                   sender=User)
 
     def _teardown_save(self, model):
         super(VideoIndex, self)._teardown_save(model)
         signals.post_save.disconnect(self._enqueue_watch_update,
                                      sender=Watch)
+        for sender in self.related_stored_fields:
+            signals.post_save.disconnect(self._enqueue_related_update,
+                                         sender=sender)
+        signals.pre_delete.disconnect(self._enqueue_related_removal,
+                                      sender=User)
 
     def _enqueue_watch_update(self, instance, **kwargs):
-        self._enqueue_instance(instance.video, False)
+        self._enqueue_instance(instance.video, False, watches_only=True)
+
+    def _enqueue_related_update(self, sender, instance, created=False,
+                                raw=False, **kwargs):
+        field_names = self.related_stored_fields[sender][1]
+        if (not created and not raw and
+            tracked_fields_changed(instance, field_names)):
+            self._enqueue_related_videos(sender, instance)
+
+    def _enqueue_related_removal(self, sender, instance, **kwargs):
+        self._enqueue_related_videos(sender, instance)
+
+    def _enqueue_related_videos(self, sender, instance):
+        """
+        Queues index updates for the videos which store fields of
+        ``instance``, an instance of one of the
+        :attr:`related_stored_fields` models.
+
+        """
+        videos = self.model._default_manager.using(instance._state.db).filter(
+            **{self.related_stored_fields[sender][0]: instance.pk})
+        using = self._get_queue_using(instance)
+        for pk in videos.values_list('pk', flat=True):
+            enqueue_index_update(self.model._meta.app_label,
+                                 self.model._meta.module_name, pk, False,
+                                 using=using)
+
+    def _active_videos(self):
+        return self.model._default_manager.filter(status=self.model.ACTIVE
+                                         ).with_recent_watches()
 
     def index_queryset(self):
         """
         Custom queryset to only search active videos and to annotate them
-        with the watch_count.
+        with the watch_count. The pks for the m2m fields are fetched in
+        batches by :class:`VideoIndexQuerySet`, and the feed and search are
+        selected for the stored thumbnail URLs and byline.
 
         """
-        return self.model._default_manager.filter(status=self.model.ACTIVE
-                                         ).annotate(watch_count=Count('watch'))
+        return self._active_videos().select_related('feed', 'search'
+                                         )._clone(klass=VideoIndexQuerySet)
 
     def read_queryset(self):
         """
         Adds a select_related call to the normal :meth:`.index_queryset`; the
         related items only need to be in the index by id, but on read we will
-        probably need more.
+        probably need more. Rather than the m2m pks, the related tags,
+        categories and authors are fetched in bulk by
+        :class:`VideoReadQuerySet`.
 
         """
-        return self.index_queryset().select_related('feed', 'user', 'search')
+        return self._active_videos().select_related(
+            'feed', 'search', 'user', 'site')._clone(klass=VideoReadQuerySet)
 
     def get_updated_field(self):
         return 'when_modified'
 
     def _prepare_field(self, video, field):
+        related_pks = getattr(video, '_index_related_pks', None)
+        if related_pks is not None:
+            return related_pks[field]
         return [int(rel.pk) for rel in getattr(video, field).all()]
 
     def prepare_tags(self, video):
@@ -137,19 +326,49 @@ class VideoIndex(QueuedSearchIndex):
     def prepare_playlists(self, video):
         return self._prepare_field(video, 'playlists')
 
+    def prepare_absolute_url(self, video):
+        return video.get_absolute_url()
+
+    def prepare_when_prefix(self, video):
+        return video.when_prefix()
+
+    def prepare_thumbnail_urls(self, video):
+        return json.dumps(dict(('%ix%i' % size, thumbnail_url(video, size))
+                               for size in video.THUMB_SIZES))
+
+    def prepare_byline(self, video):
+        """
+        Returns the authors (or the feed, for videos without any) which
+        listings credit the video to, as JSON.
+
+        """
+        byline = {
+            'authors': [[author.pk, author.username, author.first_name,
+                         author.last_name] for author in video.author_list],
+            'feed': None,
+        }
+        if video.feed_id is not None:
+            byline['feed'] = [video.feed_id, video.feed.name]
+        return json.dumps(byline)
+
     def prepare_watch_count(self, video):
         # video.watch_count is set during :meth:`~VideoIndex.index_queryset`.
-        # If for some reason that isn't available, do a manual count.
+        # If for some reason that isn't available, use the WatchCount.
         try:
             return video.watch_count
         except AttributeError:
-            return video.watch_set.count()
+            try:
+                return video.watchcount.recent
+            except WatchCount.DoesNotExist:
+                return video.watch_set.filter(
+                    timestamp__gte=WatchBucket.window_start()).count()
 
-    def _enqueue_instance(self, instance, is_removal):
+    def _enqueue_instance(self, instance, is_removal, watches_only=False):
         if (not instance.name and not instance.description
             and not instance.website_url and not instance.file_url):
             # fake instance for testing. TODO: This should probably not be done.
             return
-        super(VideoIndex, self)._enqueue_instance(instance, is_removal)
+        super(VideoIndex, self)._enqueue_instance(instance, is_removal,
+                                                  watches_only)
 
 site.register(Video, VideoIndex)
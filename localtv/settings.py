@@ -21,6 +21,8 @@ from django.conf import settings
 #: Default: 2 hours. (2 * 60 * 60 seconds)
 POPULAR_QUERY_TIMEOUT =  getattr(settings, 'LOCALTV_POPULAR_QUERY_TIMEOUT',
                                  2 * 60 * 60)
+#: The number of days of watches which make a video popular. Default: 7.
+POPULAR_WINDOW = getattr(settings, 'LOCALTV_POPULAR_WINDOW', 7)
 ENABLE_ORIGINAL_VIDEO = not getattr(settings,
                                     'LOCALTV_DONT_LOG_REMOTE_VIDEO_HISTORY',
                                     None)
@@ -32,6 +34,109 @@ DISABLE_TIERS_ENFORCEMENT = getattr(settings,
 SHOW_ADMIN_DASHBOARD = getattr(settings, 'LOCALTV_SHOW_ADMIN_DASHBOARD', True)
 SHOW_ADMIN_ACCOUNT_LEVEL = getattr(settings, 'LOCALTV_SHOW_ADMIN_ACCOUNT_LEVEL',
                                    True)
+#: The number of videos from a feed or search which are handled by a single
+#: import task. Default: 50.
+IMPORT_CHUNK_SIZE = getattr(settings, 'LOCALTV_IMPORT_CHUNK_SIZE', 50)
+#: How often, in seconds, stalled imports are checked for completion. Imports
+#: normally complete as soon as their last video is handled. Default: 300.
+IMPORT_CHECK_INTERVAL = getattr(settings, 'LOCALTV_IMPORT_CHECK_INTERVAL', 300)
+#: How long, in seconds, search index updates are collected before they are
+#: written to the index in a single batch. Default: 10.
+INDEX_UPDATE_DELAY = getattr(settings, 'LOCALTV_INDEX_UPDATE_DELAY', 10)
+#: The maximum number of queued index updates processed in one batch.
+#: Default: 500.
+INDEX_UPDATE_BATCH_SIZE = getattr(settings, 'LOCALTV_INDEX_UPDATE_BATCH_SIZE',
+                                  500)
+#: If ``True``, watches are buffered in the cache and written to the database
+#: in bulk, rather than saved on every video view. This requires a cache which
+#: supports ``incr`` and is shared between processes, such as memcached; the
+#: locmem cache can't be used, and a Celery worker must be running to run
+#: :func:`localtv.tasks.flush_watches`. Default: ``False``.
+BUFFER_WATCHES = getattr(settings, 'LOCALTV_BUFFER_WATCHES', False)
+#: How long, in seconds, buffered watches are kept before they are flushed to
+#: the database. Default: 60.
+WATCH_FLUSH_INTERVAL = getattr(settings, 'LOCALTV_WATCH_FLUSH_INTERVAL', 60)
+#: The maximum number of buffered watches flushed at once. Default: 1000.
+WATCH_FLUSH_BATCH_SIZE = getattr(settings, 'LOCALTV_WATCH_FLUSH_BATCH_SIZE',
+                                 1000)
+#: The number of resized thumbnails which are written to storage at once.
+#: Default: 4.
+THUMBNAIL_WRITE_THREADS = getattr(settings, 'LOCALTV_THUMBNAIL_WRITE_THREADS',
+                                  4)
+#: The number of related videos worked out for each video. Default: 9.
+RELATED_VIDEOS_COUNT = getattr(settings, 'LOCALTV_RELATED_VIDEOS_COUNT', 9)
+#: Videos are related by being watched by the same people within this many
+#: days. Default: 30.
+RELATED_VIDEOS_WATCH_WINDOW = getattr(settings,
+                                      'LOCALTV_RELATED_VIDEOS_WATCH_WINDOW', 30)
+#: The largest number of items a feed will return, whatever its ``count``.
+#: Default: 1000.
+FEED_MAX_COUNT = getattr(settings, 'LOCALTV_FEED_MAX_COUNT', 1000)
+#: Feeds with more items than this are streamed as they are rendered, this
+#: many items at a time, instead of being rendered in memory and cached.
+#: Default: 100.
+FEED_STREAMING_THRESHOLD = getattr(settings,
+                                   'LOCALTV_FEED_STREAMING_THRESHOLD', 100)
+#: How long, in seconds, rendered feeds are cached. Cached feeds are
+#: invalidated as soon as anything they list changes, so this can be long.
+#: Default: 6 hours.
+FEED_CACHE_TIMEOUT = getattr(settings, 'LOCALTV_FEED_CACHE_TIMEOUT',
+                             60 * 60 * 6)
+#: How long, in seconds, each video's rendered feed item is cached. Items
+#: include relative times (e.g. "3 hours ago" in JSON feeds), so this should
+#: be short. Default: 5 minutes.
+FEED_ITEM_CACHE_TIMEOUT = getattr(settings, 'LOCALTV_FEED_ITEM_CACHE_TIMEOUT',
+                                  60 * 5)
+#: Whether listing pages and the ``get_video_list_*`` template tags render
+#: videos from the fields stored in the search index, without loading them
+#: from the database. Anything the templates use beyond what the index stores
+#: is still loaded. Videos are reindexed when the names or thumbnails they
+#: show from their authors, feed or search change, so listings catch up
+#: within ``LOCALTV_INDEX_UPDATE_DELAY``. Default: False.
+LISTING_FROM_INDEX = getattr(settings, 'LOCALTV_LISTING_FROM_INDEX', False)
+#: How long, in seconds, the ``get_video_list_*`` template tags cache lists
+#: which have a ``limit``. Cached lists are invalidated as soon as a video on
+#: the site changes. 0 disables the cache. Default: 0.
+VIDEO_LIST_CACHE_TIMEOUT = getattr(settings,
+                                   'LOCALTV_VIDEO_LIST_CACHE_TIMEOUT', 0)
+#: How long, in seconds, compiled search queries are cached. They are
+#: invalidated as soon as a category, feed, saved search, tag, user or
+#: playlist changes, if the query has a keyword for it. Default: 1 day.
+SEARCH_PLAN_CACHE_TIMEOUT = getattr(settings,
+                                    'LOCALTV_SEARCH_PLAN_CACHE_TIMEOUT',
+                                    60 * 60 * 24)
+#: How long, in seconds, counts of search results are cached. Cached counts
+#: are invalidated as soon as a video on the site changes. Default: 1 day.
+RESULT_COUNT_CACHE_TIMEOUT = getattr(settings,
+                                     'LOCALTV_RESULT_COUNT_CACHE_TIMEOUT',
+                                     60 * 60 * 24)
+#: How old, in seconds, a count of search results can be and still be used
+#: to paginate listing pages after videos have changed. Listings don't show
+#: the exact number of results, so an estimate is usually good enough. 0
+#: always counts exactly. Default: 0.
+RESULT_COUNT_ESTIMATE_AGE = getattr(settings,
+                                    'LOCALTV_RESULT_COUNT_ESTIMATE_AGE', 0)
+#: How often, in seconds, a process checks whether the objects which search
+#: keywords, filters and search suggestions refer to were changed by another
+#: process. Default: 5.
+KEYWORD_INDEX_CHECK_INTERVAL = getattr(settings,
+                                       'LOCALTV_KEYWORD_INDEX_CHECK_INTERVAL',
+                                       5)
+#: The number of lookups of users and tags by search keywords and filters
+#: which each process remembers. Unlike categories, feeds, saved searches
+#: and playlists, these aren't all loaded into memory. Default: 1000.
+KEYWORD_LOOKUP_CACHE_SIZE = getattr(settings,
+                                    'LOCALTV_KEYWORD_LOOKUP_CACHE_SIZE', 1000)
+#: How long, in seconds, SiteLocations are kept in the shared cache. They are
+#: invalidated as soon as they are saved. Default: 1 day.
+SITE_LOCATION_CACHE_TIMEOUT = getattr(settings,
+                                      'LOCALTV_SITE_LOCATION_CACHE_TIMEOUT',
+                                      60 * 60 * 24)
+#: How often, in seconds, a process checks whether the SiteLocation it has
+#: loaded was changed by another process. Default: 5.
+SITE_LOCATION_CHECK_INTERVAL = getattr(settings,
+                                       'LOCALTV_SITE_LOCATION_CHECK_INTERVAL',
+                                       5)
 
 
 def voting_enabled():
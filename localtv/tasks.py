@@ -19,12 +19,17 @@ import datetime
 import os
 import logging
 import random
+import traceback
 
 from celery.exceptions import MaxRetriesExceededError
 from celery.task import task
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Sum
 from django.db.models.loading import get_model
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from haystack import site
 from haystack.query import SearchQuerySet
 
@@ -45,9 +50,18 @@ except ImportError:
         Dummy exception; nothing raises me.
         """
 
-from localtv import utils
+import tagging
+
+from localtv import related, utils
+from localtv import settings as lsettings
 from localtv.exceptions import CannotOpenImageUrl
-from localtv.models import Video, Feed, SiteLocation, SavedSearch, Category
+from localtv.models import (Video, Feed, SiteLocation, SavedSearch, Category,
+                            OriginalVideo, QueuedIndexUpdate, RelatedVideo,
+                            Watch, WatchBucket, WatchCount,
+                            bump_videos_cache_version,
+                            POPULARITY_UPDATED_KEY,
+                            WATCH_COUNTER_TIMEOUT, WATCH_FLUSH_SCHEDULED_KEY)
+from localtv.signals import post_video_from_vidscraper
 from localtv.tiers import Tier
 
 
@@ -128,48 +142,14 @@ def search_update(search_id, using='default'):
     search.update(using=using, clear_rejected=True)
 
 
-@task(ignore_result=True, max_retries=None, default_retry_delay=30)
-@patch_settings
-def mark_import_pending(import_app_label, import_model, import_pk,
-                        using='default'):
+def _approve_import_videos(source_import, using='default'):
     """
-    Checks whether an import's first stage is complete. If it's not, retries
-    the task with a countdown of 30.
+    Moves the import's pending videos to either active or unapproved, based on
+    the import's ``auto_approve`` setting and the site's tier limits. Videos
+    which have already left the pending state are left alone, so this is safe
+    to call more than once.
 
     """
-    import_class = get_model(import_app_label, import_model)
-    try:
-        source_import = import_class._default_manager.using(using).get(
-                                                    pk=import_pk,
-                                                    status=import_class.STARTED)
-    except import_class.DoesNotExist:
-        logging.debug('Expected %s instance (pk=%r) missing.',
-                      import_class.__name__, import_pk)
-        # If this is the problem, don't retry indefinitely.
-        if mark_import_pending.request.retries > 10:
-            raise MaxRetriesExceededError
-        mark_import_pending.retry()
-    source_import.last_activity = datetime.datetime.now()
-    if source_import.total_videos is None:
-        source_import.save()
-        mark_import_pending.retry()
-    # get the correct counts from the database, rather than the race-condition
-    # prone count fields
-    import_count = source_import.indexes.count()
-    skipped_count = source_import.errors.filter(is_skip=True).count()
-    if import_count != source_import.videos_imported:
-        source_import.videos_imported = import_count
-    if skipped_count != source_import.videos_skipped:
-        source_import.videos_skipped = skipped_count
-    if (source_import.videos_imported + source_import.videos_skipped
-        < source_import.total_videos):
-        # Then the import is incomplete. Requeue it.
-        source_import.save()
-        # Retry raises an exception, ending task execution.
-        mark_import_pending.retry()
-
-    # Otherwise the first stage is complete. Check whether they can take all the
-    # videos.
     active_set = None
     unapproved_set = source_import.get_videos(using).filter(
         status=Video.PENDING)
@@ -194,48 +174,187 @@ def mark_import_pending(import_app_label, import_model, import_pk,
                     when_submitted__lt=when_submitted)
                 unapproved_set = unapproved_set.filter(
                     when_submitted__gte=when_submitted)
+    # Bump when_modified, since update() doesn't; incremental index updates
+    # rely on it.
+    now = datetime.datetime.now()
     if unapproved_set is not None:
-        unapproved_set.update(status=Video.UNAPPROVED)
+        unapproved_set.update(status=Video.UNAPPROVED, when_modified=now)
     if active_set is not None:
-        active_set.update(status=Video.ACTIVE)
+        active_pks = list(active_set.values_list('pk', flat=True))
+        active_set.update(status=Video.ACTIVE, when_modified=now)
+        # update() doesn't send signals, so the search suggestions have to be
+        # told about the new videos.
+        bump_videos_cache_version(settings.SITE_ID, active_pks)
+
+
+def _bump_site_cache_version():
+    """
+    Invalidates the cached feeds for the current site. This is called after
+    the index is written rather than when videos are saved, since the feeds
+    are read from the index.
+
+    """
+    utils.bump_cache_version('site:%i' % settings.SITE_ID)
 
-    source_import.status = import_class.PENDING
-    source_import.save()
 
-    active_pks = source_import.get_videos(using).filter(
-                         status=Video.ACTIVE).values_list('pk', flat=True)
-    if active_pks:
+def _bump_popularity_cache_version():
+    """
+    Invalidates only what's cached for the current site's popularity sorts.
+    This is called instead of :func:`_bump_site_cache_version` when the index
+    was only written because watch counts changed, which happens all the time.
+
+    """
+    utils.bump_cache_version('popularity:%i' % settings.SITE_ID)
+
+
+def _index_import_videos(source_import, using='default'):
+    """
+    Adds the import's active videos to the search index, with one backend
+    update per ``LOCALTV_IMPORT_CHUNK_SIZE`` videos. Returns ``True`` on
+    success. If the index is locked, an index update is queued for each video
+    instead and ``False`` is returned.
+
+    """
+    active_pks = list(source_import.get_videos(using).filter(
+                         status=Video.ACTIVE).values_list('pk', flat=True))
+    search_index = site.get_index(Video)
+    try:
+        for i in xrange(0, len(active_pks), lsettings.IMPORT_CHUNK_SIZE):
+            chunk = active_pks[i:i + lsettings.IMPORT_CHUNK_SIZE]
+            search_index.backend.update(search_index,
+                                        search_index.index_queryset().using(
+                                            using).filter(pk__in=chunk))
+    except (DatabaseLockError, LockError), e:
+        logging.debug('Indexing %s videos individually due to %s',
+                      source_import, e.__class__.__name__)
         opts = Video._meta
         for pk in active_pks:
-            haystack_update_index.delay(opts.app_label, opts.module_name,
-                                        pk, is_removal=False,
-                                        using=using)
+            enqueue_index_update(opts.app_label, opts.module_name, pk,
+                                 is_removal=False, using=using)
+        return False
+    _bump_site_cache_version()
+    return True
+
+
+def _complete_import(source_import, using='default'):
+    import_class = source_import.__class__
+    import_class._default_manager.using(using).filter(pk=source_import.pk
+        ).update(status=import_class.COMPLETE,
+                 last_activity=datetime.datetime.now())
+    opts = import_class._meta
+    if opts.app_label == 'localtv' and opts.module_name == 'feedimport':
+        source_import.source.status = source_import.source.ACTIVE
+        source_import.source.save()
+
+
+def finish_import(import_app_label, import_model, import_pk, using='default'):
+    """
+    Ends the first stage of an import if all of its videos have been imported
+    or skipped. The import is moved from started to pending with a single
+    conditional update, so only one caller can claim it; that caller then
+    approves and indexes the import's videos and marks the import complete.
+
+    Returns ``True`` if this call claimed the import.
+
+    """
+    import_class = get_model(import_app_label, import_model)
+    claimed = import_class._default_manager.using(using).filter(
+        pk=import_pk,
+        status=import_class.STARTED,
+        total_videos__isnull=False,
+        total_videos__lte=F('videos_imported') + F('videos_skipped')
+    ).update(status=import_class.PENDING,
+             last_activity=datetime.datetime.now())
+    if not claimed:
+        return False
+    source_import = import_class._default_manager.using(using).get(
+                                                            pk=import_pk)
+    _approve_import_videos(source_import, using)
+    if _index_import_videos(source_import, using):
+        _complete_import(source_import, using)
+    else:
+        mark_import_complete.delay(import_app_label, import_model, import_pk,
+                                   using=using)
+    return True
+
+
+@task(ignore_result=True, max_retries=None,
+      default_retry_delay=lsettings.IMPORT_CHECK_INTERVAL)
+@patch_settings
+def mark_import_pending(import_app_label, import_model, import_pk,
+                        using='default'):
+    """
+    Safety net for an import's first stage, which normally ends as soon as its
+    last video is handled (see :func:`finish_import`). If the import's
+    counters haven't caught up, the stage is ended based on the import's
+    index and error rows instead; otherwise the task retries with a countdown
+    of ``LOCALTV_IMPORT_CHECK_INTERVAL``.
 
-    mark_import_complete.delay(import_app_label, import_model, import_pk,
-                               using=using)
+    """
+    if finish_import(import_app_label, import_model, import_pk, using=using):
+        return
+    import_class = get_model(import_app_label, import_model)
+    imports = import_class._default_manager.using(using)
+    try:
+        source_import = imports.get(pk=import_pk, status=import_class.STARTED)
+    except import_class.DoesNotExist:
+        if imports.filter(pk=import_pk).exists():
+            # The stage has already ended.
+            return
+        logging.debug('Expected %s instance (pk=%r) missing.',
+                      import_class.__name__, import_pk)
+        # If this is the problem, don't retry indefinitely.
+        if mark_import_pending.request.retries > 10:
+            raise MaxRetriesExceededError
+        mark_import_pending.retry(countdown=30)
+    imports.filter(pk=import_pk).update(last_activity=datetime.datetime.now())
+    if source_import.total_videos is None:
+        mark_import_pending.retry()
+    # get the correct counts from the database, in case the count fields were
+    # never updated for some videos.
+    import_count = source_import.indexes.count()
+    skipped_count = source_import.errors.filter(is_skip=True).count()
+    if import_count + skipped_count < source_import.total_videos:
+        # Then the import is incomplete. Retry raises an exception, ending
+        # task execution.
+        mark_import_pending.retry()
+    imports.filter(pk=import_pk, status=import_class.STARTED).update(
+                                        videos_imported=import_count,
+                                        videos_skipped=skipped_count)
+    finish_import(import_app_label, import_model, import_pk, using=using)
 
 
-@task(ignore_result=True, max_retries=None, default_retry_delay=30)
+@task(ignore_result=True, max_retries=None,
+      default_retry_delay=lsettings.IMPORT_CHECK_INTERVAL)
 @patch_settings
 def mark_import_complete(import_app_label, import_model, import_pk,
                          using='default'):
     """
-    Checks whether an import's second stage is complete. If it's not, retries
-    the task with a countdown of 30.
+    Safety net for an import's second stage, which normally ends as soon as
+    its videos are approved and indexed (see :func:`finish_import`). Checks
+    whether all of the import's active videos are in the search index and
+    retries with a countdown of ``LOCALTV_IMPORT_CHECK_INTERVAL`` until they
+    are.
 
     """
     import_class = get_model(import_app_label, import_model)
+    imports = import_class._default_manager.using(using)
     try:
-        source_import = import_class._default_manager.using(using).get(
-                                                    pk=import_pk,
-                                                    status=import_class.PENDING)
+        source_import = imports.get(pk=import_pk, status=import_class.PENDING)
     except import_class.DoesNotExist:
+        if imports.filter(pk=import_pk).exists():
+            # The stage has already ended.
+            return
         logging.warn('Expected %s instance (pk=%r) missing.',
                      import_class.__name__, import_pk)
         # If this is the problem, don't retry indefinitely.
         if mark_import_complete.request.retries > 10:
             raise MaxRetriesExceededError
-        mark_import_complete.retry()
+        mark_import_complete.retry(countdown=30)
+
+    if source_import.get_videos(using).filter(status=Video.PENDING).exists():
+        # The import was claimed, but approval never finished.
+        _approve_import_videos(source_import, using)
 
     video_pks = list(source_import.get_videos(using).filter(
                             status=Video.ACTIVE).values_list('pk', flat=True))
@@ -257,15 +376,10 @@ def mark_import_complete(import_app_label, import_model, import_pk,
                    '%i, haystack_count: %i'), import_app_label, import_model,
                    import_pk, using, video_count, haystack_count)
     if haystack_count >= video_count:
-        source_import.status = import_class.COMPLETE
-        if import_app_label == 'localtv' and import_model == 'feedimport':
-            source_import.source.status = source_import.source.ACTIVE
-            source_import.source.save()
-
-    source_import.last_activity = datetime.datetime.now()
-    source_import.save()
-
-    if source_import.status == import_class.PENDING:
+        _complete_import(source_import, using)
+    else:
+        imports.filter(pk=import_pk).update(
+                                    last_activity=datetime.datetime.now())
         mark_import_complete.retry()
 
 
@@ -341,25 +455,8 @@ def video_from_vidscraper_video(vidscraper_video, site_pk,
         if author_pks:
             authors = User.objects.using(using).filter(pk__in=author_pks)
         else:
-            if vidscraper_video.user:
-                name = vidscraper_video.user
-                if ' ' in name:
-                    first, last = name.split(' ', 1)
-                else:
-                    first, last = name, ''
-                author, created = User.objects.db_manager(using).get_or_create(
-                    username=name[:30],
-                    defaults={'first_name': first[:30],
-                              'last_name': last[:30]})
-                if created:
-                    author.set_unusable_password()
-                    author.save()
-                    utils.get_profile_model().objects.db_manager(using).create(
-                       user=author,
-                       website=vidscraper_video.user_url or '')
-                authors = [author]
-            else:
-                authors = []
+            author = _get_vidscraper_author(vidscraper_video, using)
+            authors = [author] if author is not None else []
 
         # Since we check above whether the vidscraper_video is valid, we don't
         # catch InvalidVideo here, since it would be unexpected.
@@ -379,6 +476,247 @@ def video_from_vidscraper_video(vidscraper_video, site_pk,
                                    with_exception=True)
         raise # so it shows up in the Celery log
 
+
+def _get_vidscraper_author(vidscraper_video, using='default'):
+    """
+    Returns a :class:`User` for the user on the original video service, or
+    ``None`` if there isn't one. The user is created if necessary.
+
+    """
+    if not vidscraper_video.user:
+        return None
+    name = vidscraper_video.user
+    if ' ' in name:
+        first, last = name.split(' ', 1)
+    else:
+        first, last = name, ''
+    author, created = User.objects.db_manager(using).get_or_create(
+        username=name[:30],
+        defaults={'first_name': first[:30],
+                  'last_name': last[:30]})
+    if created:
+        author.set_unusable_password()
+        author.save()
+        utils.get_profile_model().objects.db_manager(using).create(
+           user=author,
+           website=vidscraper_video.user_url or '')
+    return author
+
+
+def _bulk_tag_videos(videos, using='default'):
+    """
+    Tags each of the given :class:`Video` instances with the tags from the
+    :mod:`vidscraper` video it was built from. Missing tags are created
+    individually; the tagged items are inserted in bulk. If original videos
+    are being tracked, their tags are inserted as well.
+
+    :param videos: A list of ``(video, vidscraper_video)`` tuples.
+
+    """
+    if settings.FORCE_LOWERCASE_TAGS:
+        fix = lambda t: t.lower().strip()
+    else:
+        fix = lambda t: t.strip()
+    video_tags = []
+    for video, vidscraper_video in videos:
+        names = set(fix(tag) for tag in (vidscraper_video.tags or [])
+                    if tag.strip())
+        if names:
+            video_tags.append((video, names))
+    if not video_tags:
+        return
+
+    tag_manager = tagging.models.Tag._default_manager.db_manager(using)
+    all_names = set()
+    for video, names in video_tags:
+        all_names.update(names)
+    tags = dict((tag.name, tag)
+                for tag in tag_manager.filter(name__in=all_names))
+    for name in all_names - set(tags):
+        tags[name], created = tag_manager.get_or_create(name=name)
+
+    if lsettings.ENABLE_ORIGINAL_VIDEO:
+        originals = dict(OriginalVideo.objects.using(using).filter(
+                video__in=[video.pk for video, names in video_tags]
+            ).values_list('video', 'pk'))
+    else:
+        originals = {}
+
+    content_types = ContentType.objects.db_manager(using)
+    video_ct = content_types.get_for_model(Video)
+    original_ct = content_types.get_for_model(OriginalVideo)
+    TaggedItem = tagging.models.TaggedItem
+    tagged_items = []
+    for video, names in video_tags:
+        tag_pks = set(tags[name].pk for name in names)
+        for tag_pk in tag_pks:
+            tagged_items.append(TaggedItem(tag_id=tag_pk,
+                                           content_type_id=video_ct.pk,
+                                           object_id=video.pk))
+            if video.pk in originals:
+                tagged_items.append(TaggedItem(tag_id=tag_pk,
+                                        content_type_id=original_ct.pk,
+                                        object_id=originals[video.pk]))
+    utils.bulk_insert(TaggedItem, tagged_items, using=using)
+
+
+@task(ignore_result=True, max_retries=6, default_retry_delay=10)
+@patch_settings
+def video_from_vidscraper_videos(vidscraper_videos, site_pk,
+                                 import_app_label=None, import_model=None,
+                                 import_pk=None, status=None, author_pks=None,
+                                 category_pks=None, clear_rejected=False,
+                                 using='default'):
+    """
+    Batched version of :func:`video_from_vidscraper_video`. Every video in
+    ``vidscraper_videos`` is loaded and validated; duplicates are then found
+    with a single query for the whole chunk, and the new videos' authors,
+    categories, tags and import indexes are created in bulk.
+
+    """
+    import_class = get_model(import_app_label, import_model)
+    try:
+        source_import = import_class.objects.using(using).get(
+           pk=import_pk,
+           status=import_class.STARTED)
+    except import_class.DoesNotExist:
+        logging.warn('Retrying chunk of %i videos: expected %s instance '
+                     '(pk=%r) missing.', len(vidscraper_videos),
+                     import_class.__name__, import_pk)
+        video_from_vidscraper_videos.retry()
+
+    skips = []
+    def skip(message, with_exception=False):
+        skips.append((message,
+                      traceback.format_exc() if with_exception else ''))
+
+    loaded = []
+    for vidscraper_video in vidscraper_videos:
+        try:
+            vidscraper_video.load()
+        except Exception:
+            skip('Skipped %r: Could not load video data.' %
+                 vidscraper_video.url, with_exception=True)
+            continue
+
+        if not vidscraper_video.title:
+            skip('Skipped %r: Failed to scrape basic data.' %
+                 vidscraper_video.url)
+            continue
+
+        if ((vidscraper_video.file_url_expires or
+             not vidscraper_video.file_url)
+            and not vidscraper_video.embed_code):
+            skip('Skipping %r: no file or embed code.' % vidscraper_video.url)
+            continue
+        loaded.append(vidscraper_video)
+
+    try:
+        guids = set(v.guid for v in loaded if v.guid)
+        links = set(v.link for v in loaded if v.link)
+        seen_guids, seen_links = set(), set()
+        if guids or links:
+            site_videos = Video.objects.using(using).filter(
+                Q(guid__in=guids) | Q(website_url__in=links), site=site_pk)
+            if clear_rejected:
+                site_videos.filter(status=Video.REJECTED).delete()
+            for guid, link in site_videos.values_list('guid', 'website_url'):
+                seen_guids.add(guid)
+                seen_links.add(link)
+
+        new_videos = []
+        for vidscraper_video in loaded:
+            if vidscraper_video.guid:
+                if vidscraper_video.guid in seen_guids:
+                    skip('Skipping %r: duplicate guid.' % vidscraper_video.url)
+                    continue
+                seen_guids.add(vidscraper_video.guid)
+            if vidscraper_video.link:
+                if vidscraper_video.link in seen_links:
+                    skip('Skipping %r: duplicate link.' % vidscraper_video.url)
+                    continue
+                seen_links.add(vidscraper_video.link)
+            new_videos.append(vidscraper_video)
+
+        categories = list(Category.objects.using(using).filter(
+                                                pk__in=category_pks or []))
+        if author_pks:
+            authors = list(User.objects.using(using).filter(pk__in=author_pks))
+        else:
+            authors = None
+    except Exception:
+        for vidscraper_video in loaded:
+            skip('Unknown error during import of %r' % vidscraper_video.url,
+                 with_exception=True)
+        source_import.handle_skips(skips, using=using)
+        raise # so it shows up in the Celery log
+
+    created = []
+    video_authors = {}
+    for vidscraper_video in new_videos:
+        try:
+            if authors is None:
+                author = _get_vidscraper_author(vidscraper_video, using)
+                these_authors = [author] if author is not None else []
+            else:
+                these_authors = authors
+            # Since we check above whether the vidscraper_video is valid, we
+            # don't check for InvalidVideo here.
+            video = Video.from_vidscraper_video(vidscraper_video,
+                                                status=status,
+                                                commit=False,
+                                                using=using,
+                                                source_import=source_import,
+                                                site_pk=site_pk)
+            video.save(using=using)
+        except Exception:
+            skip('Unknown error during import of %r' % vidscraper_video.url,
+                 with_exception=True)
+            continue
+        logging.debug('Made video %i: %r', video.pk, video.name)
+        video_authors[video.pk] = these_authors
+        created.append((video, vidscraper_video))
+
+    try:
+        through = Video.authors.through
+        utils.bulk_insert(through, [through(video_id=created_video.pk,
+                                            user_id=video_author.pk)
+                                    for created_video, _ in created
+                                    for video_author in
+                                    video_authors[created_video.pk]],
+                          using=using)
+        through = Video.categories.through
+        utils.bulk_insert(through, [through(video_id=created_video.pk,
+                                            category_id=category.pk)
+                                    for created_video, _ in created
+                                    for category in categories],
+                          using=using)
+        _bulk_tag_videos(created, using=using)
+    except Exception:
+        # The videos themselves exist, so they still count as imported.
+        source_import.handle_error(('Error while adding authors, categories '
+                                    'and tags to %i imported videos' %
+                                    len(created)),
+                                   using=using, with_exception=True)
+    if created:
+        # The bulk inserts don't send signals, so the search suggestions
+        # have to be told about the new videos' authors and tags.
+        bump_videos_cache_version(site_pk, [created_video.pk
+                                            for created_video, _ in created])
+
+    source_import.handle_videos(created, using=using)
+    source_import.handle_skips(skips, using=using)
+
+    for video, vidscraper_video in created:
+        post_video_from_vidscraper.send(sender=Video, instance=video,
+                                        vidscraper_video=vidscraper_video,
+                                        using=using)
+        if video.thumbnail_url:
+            video_save_thumbnail.delay(video.pk, using=using)
+
+    finish_import(import_app_label, import_model, import_pk, using=using)
+
+
 @task(ignore_result=True)
 @patch_settings
 def video_save_thumbnail(video_pk, using='default'):
@@ -444,3 +782,243 @@ def haystack_update_index(app_label, model_name, pk, is_removal,
                        model_name, pk, is_removal, using, e.__class__.__name__,
                        countdown)
         haystack_update_index.retry(countdown=countdown)
+    else:
+        _bump_site_cache_version()
+
+
+def _index_queue_key(using):
+    return 'localtv:haystack_batch_update:%s' % using
+
+
+def enqueue_index_update(app_label, model_name, pk, is_removal,
+                         using='default', watches_only=False):
+    """
+    Queues an index update for the given instance, replacing any update which
+    is already queued for it, and makes sure that a
+    :func:`haystack_batch_update` will run within
+    ``LOCALTV_INDEX_UPDATE_DELAY`` seconds to process it. ``watches_only``
+    should be ``True`` if the update is only needed because the instance's
+    watch counts changed.
+
+    """
+    QueuedIndexUpdate.enqueue(app_label, model_name, pk, is_removal,
+                              using=using, watches_only=watches_only)
+    if cache.add(_index_queue_key(using), True,
+                 lsettings.INDEX_UPDATE_DELAY * 10):
+        haystack_batch_update.apply_async(
+            kwargs={'using': using},
+            countdown=lsettings.INDEX_UPDATE_DELAY)
+
+
+@task(ignore_result=True, max_retries=None)
+@patch_settings
+def haystack_batch_update(using='default'):
+    """
+    Processes up to ``LOCALTV_INDEX_UPDATE_BATCH_SIZE`` queued index updates.
+    The instances to update are loaded with one :meth:`index_queryset` query
+    per model and written with a single backend update; anything which is
+    queued for removal, or which is no longer in the :meth:`index_queryset`,
+    is removed from the index.
+
+    """
+    # Clear the key first, so that anything queued from here on will schedule
+    # another run.
+    cache.delete(_index_queue_key(using))
+    started = datetime.datetime.now()
+    queued = QueuedIndexUpdate.objects.using(using).order_by('queued')
+    updates = list(queued[:lsettings.INDEX_UPDATE_BATCH_SIZE])
+    if not updates:
+        return
+
+    by_model = {}
+    for update in updates:
+        by_model.setdefault((update.app_label, update.model_name),
+                            []).append(update)
+    try:
+        for (app_label, model_name), model_updates in by_model.items():
+            model_class = get_model(app_label, model_name)
+            search_index = site.get_index(model_class)
+            update_pks = set(update.object_pk for update in model_updates
+                             if not update.is_removal)
+            instances = []
+            if update_pks:
+                instances = list(search_index.index_queryset().using(using
+                                 ).filter(pk__in=update_pks))
+                search_index.backend.update(search_index, instances)
+            removal_pks = (set(update.object_pk for update in model_updates) -
+                           set(instance.pk for instance in instances))
+            for pk in removal_pks:
+                search_index.remove_object(model_class(pk=pk))
+    except (DatabaseLockError, LockError), e:
+        # maximum wait is ~30s
+        exp = min(haystack_batch_update.request.retries, 4)
+        countdown = random.random() * (2 ** exp)
+        logging.debug(('haystack_batch_update(using=%r) retrying due to %s '
+                       'with countdown %r'), using, e.__class__.__name__,
+                       countdown)
+        haystack_batch_update.retry(countdown=countdown)
+    if all(update.watches_only for update in updates):
+        _bump_popularity_cache_version()
+    else:
+        _bump_site_cache_version()
+
+    # Anything which was queued again while we worked is left for the next
+    # run.
+    queued.filter(pk__in=[update.pk for update in updates],
+                  queued__lt=started).delete()
+    if len(updates) == lsettings.INDEX_UPDATE_BATCH_SIZE:
+        haystack_batch_update.delay(using=using)
+
+
+@task(ignore_result=True)
+@patch_settings
+def flush_watches(using='default'):
+    """
+    Writes the watches buffered by :meth:`Watch.buffer` to the database, and
+    queues a single index update for each video which was watched.
+
+    """
+    # Clear the key first, so that watches buffered from here on will
+    # schedule another flush.
+    cache.delete(WATCH_FLUSH_SCHEDULED_KEY % settings.SITE_ID)
+    video_pks, more = Watch.flush_buffer(using=using)
+    opts = Video._meta
+    for pk in video_pks:
+        enqueue_index_update(opts.app_label, opts.module_name, pk,
+                             is_removal=False, using=using,
+                             watches_only=True)
+    if more is None:
+        # Another flush is running; try again once it's done.
+        flush_watches.apply_async(kwargs={'using': using},
+                                  countdown=lsettings.WATCH_FLUSH_INTERVAL)
+    elif more:
+        flush_watches.delay(using=using)
+
+
+@task(ignore_result=True)
+@patch_settings
+def update_popularity(using='default'):
+    """
+    Adds the watches which were saved without being buffered to the videos'
+    counts (see :meth:`Watch.count_saved`), rolls up the :class:`WatchBucket`
+    records in the popularity window into :attr:`WatchCount.recent`, deletes
+    the buckets which have left the window, and queues index updates for the
+    videos whose popularity changed. This should be run periodically, e.g.
+    hourly with the ``update_popularity`` management command.
+
+    """
+    opts = Video._meta
+    watched_pks = set()
+    more = True
+    while more:
+        video_pks, more = Watch.count_saved(using=using)
+        watched_pks.update(video_pks)
+    for video_pk in watched_pks:
+        enqueue_index_update(opts.app_label, opts.module_name, video_pk,
+                             is_removal=False, using=using,
+                             watches_only=True)
+
+    start = WatchBucket.window_start()
+    buckets = WatchBucket.objects.using(using)
+    buckets.filter(hour__lt=start).delete()
+    recent = dict(buckets.order_by().values_list('video').annotate(
+            Sum('count')))
+    watch_counts = WatchCount.objects.using(using)
+    current = dict(watch_counts.filter(recent__gt=0).values_list('video',
+                                                                 'recent'))
+    changed = {}
+    for video_pk in set(recent) | set(current):
+        difference = recent.get(video_pk, 0) - current.get(video_pk, 0)
+        if difference:
+            changed.setdefault(difference, []).append(video_pk)
+    for difference, video_pks in changed.items():
+        # Keep the IN clauses short enough for SQLite.
+        for i in xrange(0, len(video_pks), 500):
+            chunk = video_pks[i:i + 500]
+            # Apply the difference, rather than setting the count, so that
+            # watches added since the counts were read aren't lost.
+            if watch_counts.filter(video__in=chunk).update(
+                recent=F('recent') + difference) < len(chunk):
+                # Videos whose watches were recorded without adding to a
+                # WatchCount, e.g. ones loaded from fixtures.
+                existing = set(watch_counts.filter(
+                        video__in=chunk).values_list('video', flat=True))
+                utils.bulk_insert(WatchCount, [
+                        WatchCount(video_id=video_pk,
+                                   recent=recent.get(video_pk, 0),
+                                   total=Watch.objects.using(using).filter(
+                                video=video_pk, counted=True).count())
+                        for video_pk in chunk if video_pk not in existing],
+                                  using=using)
+        for video_pk in video_pks:
+            enqueue_index_update(opts.app_label, opts.module_name, video_pk,
+                                 is_removal=False, using=using,
+                                 watches_only=True)
+    if changed or watched_pks:
+        cache.set(POPULARITY_UPDATED_KEY % settings.SITE_ID,
+                  datetime.datetime.now(), WATCH_COUNTER_TIMEOUT)
+
+
+@task(ignore_result=True)
+@patch_settings
+def update_related_videos(full=False, using='default'):
+    """
+    Works out the :class:`RelatedVideo` records for the active videos on the
+    current site with :mod:`localtv.related`.
+
+    Unless ``full`` is ``True``, only the videos which have been modified
+    since the last run, or which haven't been scored yet, are updated, along
+    with the videos whose related videos they change (see
+    :func:`localtv.related.get_changed_related_videos`). Videos which aren't
+    related to any others get a single record without a related video, so
+    that they aren't scored again on every run. Changes to which videos are
+    watched together, and to how rare each feature is, are only picked up by
+    full updates. This should be run periodically, e.g. hourly with the
+    ``update_related_videos`` management command and daily with its
+    ``--full`` option.
+
+    """
+    started = datetime.datetime.now()
+    site_id = settings.SITE_ID
+    updated_key = 'localtv:related_videos_updated:%i' % site_id
+    last_updated = cache.get(updated_key)
+    videos = Video.objects.using(using).filter(site=site_id,
+                                                status=Video.ACTIVE)
+    relations = RelatedVideo.objects.using(using)
+    # Videos which aren't active any more don't need related videos.
+    relations.filter(video__site=site_id).exclude(
+        video__status=Video.ACTIVE).delete()
+    if full or last_updated is None:
+        vectors = related.get_feature_vectors(site_id, using)
+        related_videos = related.get_related_videos(
+            vectors, vectors.keys(), lsettings.RELATED_VIDEOS_COUNT)
+    else:
+        video_pks = set(videos.filter(
+                when_modified__gte=last_updated).values_list('pk', flat=True))
+        # Videos which have never been scored.
+        video_pks.update(videos.filter(relations__isnull=True).values_list(
+                'pk', flat=True))
+        removed_pks = set(Video.objects.using(using).filter(
+                site=site_id, when_modified__gte=last_updated).exclude(
+                status=Video.ACTIVE).values_list('pk', flat=True))
+        if not video_pks and not removed_pks:
+            cache.set(updated_key, started, utils.CACHE_VERSION_TIMEOUT)
+            return
+        related_videos = related.get_changed_related_videos(
+            site_id, video_pks, removed_pks, lsettings.RELATED_VIDEOS_COUNT,
+            using)
+    related_videos = related_videos.items()
+    # Each batch is replaced in a transaction, so that the video page never
+    # sees a video without its related videos.
+    for i in xrange(0, len(related_videos), 500):
+        batch = related_videos[i:i + 500]
+        with transaction.commit_on_success(using=using):
+            relations.filter(video__in=[video_pk for video_pk, neighbours
+                                        in batch]).delete()
+            utils.bulk_insert(RelatedVideo, [
+                    RelatedVideo(video_id=video_pk, related_id=related_pk,
+                                 score=score)
+                    for video_pk, neighbours in batch
+                    for score, related_pk in neighbours or [(0, None)]],
+                              using=using)
+    cache.set(updated_key, started, utils.CACHE_VERSION_TIMEOUT)
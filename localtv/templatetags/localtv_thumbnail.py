@@ -39,28 +39,18 @@ class ThumbnailNode(template.Node):
             return thumbnail_url
 
     def get_thumbnail_url(self, video, context):
-        if video.pk is None:
+        indexed_urls = getattr(video, 'thumbnail_urls', None)
+        if indexed_urls is not None:
+            # A video rendered from the search index, which stores its
+            # thumbnail URLs.
+            url = indexed_urls.get('%ix%i' % self.size)
+        elif video.pk is None:
             return video.thumbnail_url
+        else:
+            url = thumbnail_url(video, self.size)
 
-        thumbnail = None
-
-        if video.has_thumbnail:
-            thumbnail = video
-        elif video.feed and video.feed.has_thumbnail:
-            thumbnail = video.feed
-        elif video.search and video.search.has_thumbnail:
-            thumbnail = video.search
-
-        if not thumbnail:
+        if url is None:
             return settings.STATIC_URL + 'localtv/images/default_vid.gif'
-
-        url = default_storage.url(
-            thumbnail.get_resized_thumb_storage_path(*self.size))
-
-        if thumbnail._meta.get_latest_by:
-            key = hex(hash(getattr(thumbnail,
-                                   thumbnail._meta.get_latest_by)))[-8:]
-            url = '%s?%s' % (url, key)
         if not self.absolute or url.startswith(('http://', 'https://')):
             # full URL, return it
             return url
@@ -73,6 +63,37 @@ class ThumbnailNode(template.Node):
                 scheme = 'http'
             domain = Site.objects.get_current().domain
             return '%s://%s%s' % (scheme, domain, url)
+
+
+def thumbnail_url(video, size):
+    """
+    Returns the URL of the thumbnail for ``video`` at ``size``, which is the
+    thumbnail of its feed or search if it doesn't have one of its own, or
+    ``None`` if none of them has a thumbnail.
+
+    """
+    thumbnail = None
+
+    if video.has_thumbnail:
+        thumbnail = video
+    elif video.feed and video.feed.has_thumbnail:
+        thumbnail = video.feed
+    elif video.search and video.search.has_thumbnail:
+        thumbnail = video.search
+
+    if not thumbnail:
+        return None
+
+    url = default_storage.url(
+        thumbnail.get_resized_thumb_storage_path(*size))
+
+    if thumbnail._meta.get_latest_by:
+        key = hex(hash(getattr(thumbnail,
+                               thumbnail._meta.get_latest_by)))[-8:]
+        url = '%s?%s' % (url, key)
+    return url
+
+
 @register.tag('get_thumbnail_url')
 def get_thumbnail_url(parser, token):
     tokens = token.split_contents()
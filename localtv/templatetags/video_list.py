@@ -15,11 +15,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Miro Community.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+
 from django import template
+from django.core.cache import cache
+from django.db import models
 from django.utils.functional import curry
 
+from localtv import settings as lsettings
+from localtv import utils
 from localtv.search.forms import VideoSearchForm
-from localtv.search.utils import SortFilterMixin, SearchQuerysetSliceHack
+from localtv.search.utils import (SortFilterMixin, SearchQuerysetSliceHack,
+                                  get_sort_version_names)
 
 
 register = template.Library()
@@ -32,8 +39,13 @@ class BaseVideoListNode(template.Node, SortFilterMixin):
 
     Syntax::
 
-        {% get_video_list_FOO as <varname> %}
-        {% get_video_list_for_FOO <foo_instance> as <varname> %}
+        {% get_video_list_FOO as <varname> [limit <count>] %}
+        {% get_video_list_for_FOO <foo_instance> as <varname> [limit <count>] %}
+
+    With a ``limit``, only that many videos are fetched, and the list is
+    cached for ``LOCALTV_VIDEO_LIST_CACHE_TIMEOUT`` seconds, until a video on
+    the site changes. Either way, the list is only looked up once per request
+    for each set of arguments.
 
     """
     form_class = VideoSearchForm
@@ -50,6 +62,10 @@ class BaseVideoListNode(template.Node, SortFilterMixin):
         bits = token.split_contents()
         tag_name = bits[0]
         bits = bits[1:]
+        limit = None
+        if len(bits) > 2 and bits[-2] == 'limit':
+            limit = parser.compile_filter(bits[-1])
+            bits = bits[:-2]
         argument_count = int(cls.takes_argument) + 2
         if len(bits) != argument_count:
             raise template.TemplateSyntaxError(
@@ -62,23 +78,62 @@ class BaseVideoListNode(template.Node, SortFilterMixin):
             raise template.TemplateSyntaxError(
                     "%s argument in %r tag must be 'as'" % (
                         "Third" if cls.takes_argument else "Second", tag_name))
-        return cls(item=item, as_varname=bits[1])
+        return cls(item=item, as_varname=bits[1], limit=limit)
 
-    def __init__(self, item=None, as_varname=None):
+    def __init__(self, item=None, as_varname=None, limit=None):
         self.item = item
         self.as_varname = as_varname
+        self.limit = limit
 
     def render(self, context):
-        context[self.as_varname] = self.get_video_list(context)
+        item = None
+        if self.item is not None:
+            item = self.item.resolve(context)
+        limit = None
+        if self.limit is not None:
+            try:
+                limit = int(self.limit.resolve(context))
+            except (TypeError, ValueError):
+                pass
+
+        # Themes often use the same list more than once on a page.
+        if isinstance(item, models.Model):
+            vary = (self.__class__.__name__, item._meta.object_name, item.pk,
+                    limit)
+        else:
+            vary = (self.__class__.__name__, item, limit)
+        request = context.get('request')
+        memo = getattr(request, '_localtv_video_lists', None)
+        if memo is None:
+            memo = {}
+            if request is not None:
+                request._localtv_video_lists = memo
+        if vary not in memo:
+            memo[vary] = self._get_limited_video_list(vary, item, limit)
+        context[self.as_varname] = memo[vary]
         return ''
 
-    def get_video_list(self, context):
+    def _get_limited_video_list(self, vary, item, limit):
+        if limit is None:
+            return self.get_video_list(item)
+        if not lsettings.VIDEO_LIST_CACHE_TIMEOUT:
+            return self.get_video_list(item)[:limit]
+        vary += (lsettings.LISTING_FROM_INDEX,
+                 utils.get_cache_versions(*get_sort_version_names(
+                        self.sort)))
+        key = 'localtv_video_list:%s' % hashlib.md5(repr(vary)).hexdigest()
+        videos = cache.get(key)
+        if videos is None:
+            videos = self.get_video_list(item)[:limit]
+            cache.set(key, videos, lsettings.VIDEO_LIST_CACHE_TIMEOUT)
+        return videos
+
+    def get_video_list(self, item=None):
         sqs = self._query("")
         sqs = self._sort(sqs, self.sort)
         if self.search_filter is not None:
             filter_dict = self.filters.get(self.search_filter, None)
             if filter_dict is not None:
-                item = self.item.resolve(context)
                 val = None
                 if isinstance(item, filter_dict['model']):
                     val = [item]
@@ -87,6 +142,8 @@ class BaseVideoListNode(template.Node, SortFilterMixin):
                 if val is not None:
                     sqs, xxx = self._filter(sqs, **{self.search_filter:
                                                            val})
+        if lsettings.LISTING_FROM_INDEX:
+            return SearchQuerysetSliceHack(sqs, from_index=True)
         sqs = sqs.load_all()
         return SearchQuerysetSliceHack(sqs)
 
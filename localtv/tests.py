@@ -17,14 +17,18 @@
 
 import json
 import datetime
+import hashlib
 import os.path
 import shutil
+import StringIO
 import tempfile
 from urllib import quote_plus, urlencode
+import urllib2
 
 import mock
 
 import feedparser
+import Image
 import vidscraper
 
 from django.conf import settings
@@ -34,26 +38,34 @@ Comment = get_model()
 CommentForm = get_form()
 
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.files.base import File
 from django.core.files import storage
 from django.core import mail
+from django.core.signals import request_finished
 from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import HttpRequest
+from django.template import Context, Template
 from django.test import TestCase
 from django.test.client import Client, RequestFactory
 
 from haystack.query import SearchQuerySet
 
+import localtv.exceptions
 import localtv.settings
 import localtv.templatetags.filters
+from localtv.templatetags import video_list
 from localtv.middleware import UserIsAdminMiddleware
 from localtv import models
 from localtv.models import (Watch, Category, SiteLocation, Video, TierInfo,
                             Feed, OriginalVideo, SavedSearch, FeedImport,
-                            Source)
-from localtv import utils
+                            Source, RelatedVideo)
+from localtv import tasks, utils
 import localtv.feeds.views
+from localtv.listing.views import VideoSearchView
+from localtv import context_processors
+from localtv.search import keywords, typeahead
 
 from notification import models as notification
 from tagging.models import Tag
@@ -94,6 +106,8 @@ class BaseTestCase(TestCase):
         self.old_DISABLE = localtv.settings.DISABLE_TIERS_ENFORCEMENT
         localtv.settings.DISABLE_TIERS_ENFORCEMENT = False
         SiteLocation.objects.clear_cache()
+        keywords.clear_cache()
+        typeahead.clear_cache()
         self.site_location = SiteLocation.objects.get_current()
         self.tier_info = TierInfo.objects.get_current()
 
@@ -283,6 +297,75 @@ class FeedImportTestCase(BaseTestCase):
                                                              flat=True)
         self.assertEqual(list(parsed_guids), list(db_guids))
 
+    @mock.patch('localtv.settings.IMPORT_CHUNK_SIZE', 2)
+    def test_import_in_chunks(self):
+        """
+        Videos should be imported correctly (and in feed order) when the feed
+        is split into several chunks.
+        """
+        feed = Feed.objects.get(pk=1)
+        self._update_with_video_iter(self._parsed_feed, feed)
+        feed_import = FeedImport.objects.filter(source=feed).latest()
+        self.assertEqual(feed_import.videos_imported, 5)
+        self.assertEqual(feed_import.videos_skipped, 0)
+        parsed_guids = [entry.guid for entry in self._parsed_feed]
+        db_guids = Video.objects.in_feed_order().values_list('guid',
+                                                             flat=True)
+        self.assertEqual(list(parsed_guids), list(db_guids))
+
+    def test_import_completes_when_last_chunk_finishes(self):
+        """
+        Once every video has been imported or skipped, the import should be
+        approved, indexed and marked complete by the last chunk, without
+        waiting for the polling tasks.
+        """
+        feed = Feed.objects.get(pk=1)
+        feed_import = FeedImport.objects.create(source=feed,
+                                                auto_approve=True,
+                                                total_videos=5)
+        tasks.video_from_vidscraper_videos(
+            self._parsed_feed, site_pk=feed.site_id,
+            import_app_label='localtv', import_model='feedimport',
+            import_pk=feed_import.pk, status=Video.PENDING)
+        feed_import = FeedImport.objects.get(pk=feed_import.pk)
+        self.assertEqual(feed_import.status, FeedImport.COMPLETE)
+        self.assertEqual(feed_import.videos_imported, 5)
+        self.assertEqual(Video.objects.filter(status=Video.ACTIVE).count(), 5)
+        self.assertEqual(SearchQuerySet().models(Video).count(), 5)
+
+        # The safety net has nothing left to do.
+        tasks.mark_import_pending('localtv', 'feedimport', feed_import.pk)
+        tasks.mark_import_complete('localtv', 'feedimport', feed_import.pk)
+        feed_import = FeedImport.objects.get(pk=feed_import.pk)
+        self.assertEqual(feed_import.status, FeedImport.COMPLETE)
+
+    @mock.patch('localtv.settings.KEYWORD_INDEX_CHECK_INTERVAL', 0)
+    def test_import_updates_suggestions(self):
+        """
+        Approving imported videos doesn't send signals, but their titles
+        should still be suggested as soon as the import completes.
+        """
+        approve = tasks._approve_import_videos
+        def suggest_and_approve(*args, **kwargs):
+            # The indexes are built once the videos exist, but before they
+            # are approved.
+            self.assertEqual(typeahead.suggest('glassco'), [])
+            return approve(*args, **kwargs)
+
+        feed = Feed.objects.get(pk=1)
+        feed_import = FeedImport.objects.create(source=feed,
+                                                auto_approve=True,
+                                                total_videos=5)
+        with mock.patch('localtv.tasks._approve_import_videos',
+                        suggest_and_approve):
+            tasks.video_from_vidscraper_videos(
+                self._parsed_feed, site_pk=feed.site_id,
+                import_app_label='localtv', import_model='feedimport',
+                import_pk=feed_import.pk, status=Video.PENDING)
+        self.assertEqual([suggestion['label']
+                          for suggestion in typeahead.suggest('glassco')],
+                         ['Dave Glassco Supports Miro'])
+
     def test_ignore_duplicate_guid(self):
         """
         If an item with a certain GUID is in a feed twice, but not in the
@@ -604,6 +687,59 @@ University South Carolina, answers questions about teen pregnancy prevention.")
         v2 = feed.video_set.get()
         self.assertEqual(v.pk, v2.pk)
 
+    @mock.patch('localtv.tasks.video_from_vidscraper_videos.delay',
+                mock.Mock(wraps=tasks.video_from_vidscraper_videos.delay))
+    def test_reimport_skips_duplicates_without_tasks(self):
+        """
+        Re-importing a feed whose videos have all been imported should mark
+        them as skipped without creating any import tasks; rejected copies
+        should be deleted and imported again.
+        """
+        delay = tasks.video_from_vidscraper_videos.delay
+        feed = Feed.objects.get(pk=1)
+        self._update_with_video_iter(self._parsed_feed, feed)
+        self.assertEqual(delay.call_count, 1)
+        self._update_with_video_iter(self._parsed_feed, feed)
+        self.assertEqual(delay.call_count, 1)
+        feed_import = feed.imports.latest()
+        self.assertEqual(feed_import.videos_skipped, 5)
+        self.assertEqual(feed_import.videos_imported, 0)
+
+        rejected = Video.objects.in_feed_order()[0]
+        rejected.status = Video.REJECTED
+        rejected.save()
+        self._update_with_video_iter(self._parsed_feed, feed)
+        feed_import = feed.imports.latest()
+        self.assertEqual(feed_import.videos_skipped, 4)
+        self.assertEqual(feed_import.videos_imported, 1)
+        self.assertFalse(Video.objects.filter(pk=rejected.pk).exists())
+        self.assertEqual(Video.objects.count(), 5)
+        self.assertEqual(delay.call_count, 2)
+
+    def test_duplicate_index(self):
+        """
+        Rejected copies of a video should be returned for deletion even if
+        another copy makes it a duplicate, and new videos shouldn't make
+        later copies of them duplicates before they're saved.
+        """
+        site = self.site_location.site
+        rejected = Video.objects.create(site=site, name='Rejected',
+                                        guid='guid', status=Video.REJECTED)
+        Video.objects.create(site=site, name='Live',
+                             website_url='http://example.com/live',
+                             status=Video.ACTIVE)
+        duplicates = models.VideoDuplicateIndex(site.pk)
+        self.assertEqual(duplicates.classify(
+                mock.Mock(guid='guid', link='http://example.com/live'),
+                clear_rejected=True),
+                         (models.VideoDuplicateIndex.DUPLICATE_LINK,
+                          [rejected.pk]))
+
+        new = mock.Mock(guid='new', link='http://example.com/new')
+        for i in range(2):
+            self.assertEqual(duplicates.classify(new),
+                             (models.VideoDuplicateIndex.NEW, []))
+
     def test_video_service(self):
         """
         Feed.video_service() should return the name of the video service that
@@ -1077,6 +1213,24 @@ class ViewTestCase(BaseTestCase):
                           'localtv/category.html')
         self.assertEqual(response.context['category'], category)
 
+    def test_conditional_get_category(self):
+        """
+        A category's listing should get a new ETag when the category is
+        saved, since the page shows the category.
+        """
+        category = Category.objects.get(slug='miro')
+        c = Client()
+        response = c.get(category.get_absolute_url())
+        self.assertStatusCodeEquals(response, 200)
+        etag = response['ETag']
+
+        category.name = 'Miro Video Player'
+        category.save()
+        response = c.get(category.get_absolute_url(),
+                         HTTP_IF_NONE_MATCH=etag)
+        self.assertStatusCodeEquals(response, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_author_index(self):
         """
         The author_index view should render the
@@ -1152,6 +1306,85 @@ class ListingViewTestCase(BaseTestCase):
                           list(Video.objects.get_latest_videos(
                               self.site_location)[:15]))
 
+    def test_latest_videos_after(self):
+        """
+        Following the ``next_page_url`` cursor from the first page of new
+        videos should give the same videos as the second page.
+        """
+        c = Client()
+        response = c.get(reverse('localtv_list_new'))
+        next_page_url = response.context['next_page_url']
+        self.assertTrue('after=' in next_page_url)
+
+        response = c.get(reverse('localtv_list_new') + next_page_url)
+        self.assertStatusCodeEquals(response, 200)
+        self.assertEqual(response.context['next_page_url'], None)
+        expected = c.get(reverse('localtv_list_new'), {'page': 2})
+        self.assertEqual(list(response.context['page_obj'].object_list),
+                         list(expected.context['page_obj'].object_list))
+
+    def test_this_week_cutoff(self):
+        """
+        The this-week listing should count from the start of the day, so that
+        its query and cached result count don't change on every request.
+        """
+        view = VideoSearchView(approved_since=datetime.timedelta(days=7))
+        today = datetime.datetime.combine(datetime.date.today(),
+                                          datetime.time())
+        self.assertEqual(view._get_approved_cutoff(),
+                         today - datetime.timedelta(days=7))
+
+    def test_popular_videos_after_page(self):
+        """
+        Following the ``next_page_url`` cursor from a numbered page should
+        continue from the end of that page, even if the tie at the end of the
+        page began on an earlier one.
+        """
+        c = Client()
+        url = reverse('localtv_list_popular')
+        seen = []
+        for page in (1, 2):
+            response = c.get(url, {'count': 3, 'page': page})
+            seen.extend(response.context['page_obj'].object_list)
+        next_page_url = response.context['next_page_url']
+        self.assertTrue('after=' in next_page_url)
+        # Most of the videos haven't been watched, so they're tied.
+        self.assertEqual(len(set(video.watch_count for video in seen)), 1)
+
+        response = c.get(url + next_page_url)
+        videos = list(response.context['page_obj'].object_list)
+        self.assertEqual(len(videos), 3)
+        self.assertFalse(set(videos) & set(seen))
+        expected = c.get(url, {'count': 3, 'page': 3})
+        self.assertEqual(videos,
+                         list(expected.context['page_obj'].object_list))
+
+    @mock.patch('localtv.settings.LISTING_FROM_INDEX', True)
+    def test_latest_videos_from_index(self):
+        """
+        With LOCALTV_LISTING_FROM_INDEX, the listing should be rendered from
+        the search index, without loading the videos.
+        """
+        self._rebuild_index()
+        c = Client()
+        response = c.get(reverse('localtv_list_new'))
+        self.assertStatusCodeEquals(response, 200)
+        indexed = list(response.context['page_obj'].object_list)
+        expected = list(Video.objects.get_latest_videos(
+                self.site_location)[:15])
+        self.assertEqual([video.pk for video in indexed],
+                         [video.pk for video in expected])
+
+        def listing_fields(videos):
+            return [(video.name, video.get_absolute_url(),
+                     video.when_prefix(),
+                     [author.pk for author in video.author_list],
+                     video.feed and video.feed.pk) for video in videos]
+        fields = []
+        self.assertNumQueries(0, lambda: fields.extend(
+                listing_fields(indexed)))
+        self.assertEqual(fields, listing_fields(expected))
+
     def test_popular_videos(self):
         """
         The popular_videos view should render the
@@ -1161,6 +1394,8 @@ class ListingViewTestCase(BaseTestCase):
         for w in Watch.objects.all():
             w.timestamp = datetime.datetime.now()
             w.save()
+        models.WatchBucket.rebuild()
+        tasks.update_popularity()
 
         c = Client()
         response = c.get(reverse('localtv_list_popular'))
@@ -1175,6 +1410,58 @@ class ListingViewTestCase(BaseTestCase):
                                      watch__timestamp__gte=datetime.datetime.min
                                  ).distinct()))
 
+    def test_conditional_get(self):
+        """
+        A request for an unchanged listing with a matching ETag should get a
+        304.
+        """
+        c = Client()
+        response = c.get(reverse('localtv_list_new'))
+        self.assertStatusCodeEquals(response, 200)
+        response = c.get(reverse('localtv_list_new'),
+                         HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertStatusCodeEquals(response, 304)
+
+    def test_conditional_get_authenticated(self):
+        """
+        If-Modified-Since alone shouldn't get a logged-in user a 304, since
+        the page can differ for each user.
+        """
+        old_ENABLE_CHANGE_STAMPS = localtv.settings.ENABLE_CHANGE_STAMPS
+        localtv.settings.ENABLE_CHANGE_STAMPS = True
+        try:
+            c = Client()
+            response = c.get(reverse('localtv_list_new'))
+            self.assertTrue('Cookie' in response['Vary'])
+            last_modified = response['Last-Modified']
+            response = c.get(reverse('localtv_list_new'),
+                             HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertStatusCodeEquals(response, 304)
+
+            c.login(username='user', password='password')
+            response = c.get(reverse('localtv_list_new'),
+                             HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertStatusCodeEquals(response, 200)
+            self.assertFalse(response.has_header('Last-Modified'))
+        finally:
+            localtv.settings.ENABLE_CHANGE_STAMPS = old_ENABLE_CHANGE_STAMPS
+
+    def test_conditional_get_without_change_stamps(self):
+        """
+        Without change stamps, the last change doesn't move when a video is
+        deleted, so listings should only be sent an ETag.
+        """
+        c = Client()
+        response = c.get(reverse('localtv_list_new'))
+        self.assertStatusCodeEquals(response, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        Video.objects.filter(status=Video.ACTIVE).order_by('pk')[0].delete()
+        response = c.get(reverse('localtv_list_new'),
+                         HTTP_IF_NONE_MATCH=etag)
+        self.assertStatusCodeEquals(response, 200)
+
     def test_featured_videos(self):
         """
         The featured_videos view should render the
@@ -1622,6 +1909,113 @@ COALESCE(localtv_video.when_approved,localtv_video.when_submitted)"""}
             self.assertFalse(storage.default_storage.exists(path),
                              '%s was not deleted' % path)
 
+    @mock.patch('urllib2.urlopen')
+    def test_thumbnail_not_modified(self, urlopen):
+        """
+        If the thumbnail was downloaded before, it should be requested
+        conditionally, and a 304 should leave the stored thumbnail alone.
+        """
+        v = Video.objects.get(pk=11)
+        v.save_thumbnail_from_file(File(file(self._data_file('logo.png'))))
+        v.thumbnail_url = 'http://example.com/thumbnail.png'
+        models.RemoteThumbnail.objects.create(
+            url_hash=hashlib.sha1(v.thumbnail_url).hexdigest(),
+            etag='"thumbnail"', content_hash=v.thumbnail_hash)
+        urlopen.side_effect = urllib2.HTTPError(
+            v.thumbnail_url, 304, 'Not Modified', {}, None)
+
+        with mock.patch.object(Video, 'save_thumbnail_from_file') as save:
+            v.save_thumbnail()
+        self.assertEqual(urlopen.call_count, 1)
+        request = urlopen.call_args[0][0]
+        self.assertEqual(request.get_header('If-none-match'), '"thumbnail"')
+        self.assertFalse(save.called)
+
+    @mock.patch('urllib2.urlopen')
+    def test_thumbnail_http_errors(self, urlopen):
+        """
+        Client errors like a 404 should only be logged, since retrying won't
+        help, but other HTTP errors should raise CannotOpenImageUrl, so that
+        the thumbnail is tried again later.
+        """
+        v = Video.objects.get(pk=11)
+        v.thumbnail_url = 'http://example.com/thumbnail.png'
+        urlopen.side_effect = urllib2.HTTPError(
+            v.thumbnail_url, 404, 'Not Found', {}, None)
+        with mock.patch.object(Video, 'save_thumbnail_from_file') as save:
+            v.save_thumbnail()
+        self.assertFalse(save.called)
+
+        urlopen.side_effect = urllib2.HTTPError(
+            v.thumbnail_url, 503, 'Service Unavailable', {}, None)
+        self.assertRaises(localtv.exceptions.CannotOpenImageUrl,
+                          v.save_thumbnail)
+
+    @mock.patch('localtv.models.delete_if_exists')
+    def test_hashed_thumbnail_not_replaced(self, delete_if_exists):
+        """
+        If a video's thumbnail is already stored under its hash, by a video
+        which hasn't been marked as having it yet, the stored files should be
+        used rather than deleted and saved again.
+        """
+        v1 = Video.objects.get(pk=11)
+        v2 = Video.objects.get(pk=12)
+        v1.save_thumbnail_from_file(File(file(self._data_file('logo.png'))))
+        Video.objects.filter(pk=v1.pk).update(has_thumbnail=False)
+        v2.save_thumbnail_from_file(File(file(self._data_file('logo.png'))))
+        self.assertTrue(v2.has_thumbnail)
+        self.assertEqual(v1.get_original_thumb_storage_path(),
+                         v2.get_original_thumb_storage_path())
+        self.assertFalse([args for args, kwargs
+                          in delete_if_exists.call_args_list
+                          if 'by_hash' in args[0]])
+        # No copies were saved under other names.
+        directory = os.path.dirname(v1.get_original_thumb_storage_path())
+        self.assertEqual(len(storage.default_storage.listdir(directory)[1]),
+                         len(set(Video.THUMB_SIZES)) + 1)
+
+    def test_identical_thumbnails_shared(self):
+        """
+        Videos with identical thumbnails should share one set of files, which
+        are only deleted once no video uses them.
+        """
+        v1 = Video.objects.get(pk=11)
+        v2 = Video.objects.get(pk=12)
+        v1.save_thumbnail_from_file(File(file(self._data_file('logo.png'))))
+        v2.save_thumbnail_from_file(File(file(self._data_file('logo.png'))))
+        self.assertTrue(v2.has_thumbnail)
+        self.assertEqual(v1.thumbnail_hash, v2.thumbnail_hash)
+        self.assertEqual(v1.get_original_thumb_storage_path(),
+                         v2.get_original_thumb_storage_path())
+
+        paths = [v1.get_original_thumb_storage_path()]
+        for size in Video.THUMB_SIZES:
+            paths.append(v1.get_resized_thumb_storage_path(*size))
+
+        v1.delete()
+        for path in paths:
+            self.assertTrue(storage.default_storage.exists(path),
+                            '%s was deleted' % path)
+        v2.delete()
+        for path in paths:
+            self.assertFalse(storage.default_storage.exists(path),
+                             '%s was not deleted' % path)
+
+    def test_resize_thumbnail_from_large_image(self):
+        """
+        Each of the resized thumbnails should have its own size, even when
+        they are resized from a downscaled copy of a large image.
+        """
+        image = Image.new('RGB', (2000, 1500), (255, 0, 0))
+        resized = utils.resize_image_returning_list_of_strings(
+            image, Video.THUMB_SIZES)
+        self.assertEqual([size for size, data in resized],
+                         [size[:2] for size in Video.THUMB_SIZES])
+        for size, data in resized:
+            thumb = Image.open(StringIO.StringIO(data))
+            self.assertEqual(thumb.size, size)
+            self.assertEqual(thumb.format, 'PNG')
+
     def test_original_video_created(self):
         """
         When an Video object is a created, an OriginalVideo object should also
@@ -1766,6 +2160,218 @@ class WatchModelTestCase(BaseTestCase):
         self.assertEqual(w.video, video)
         self.assertEqual(w.ip_address, '0.0.0.0')
 
+    def test_add_updates_watch_count(self):
+        """
+        Watch.add() should only save the watch; update_popularity() should
+        add the saved watches to the video's WatchCount.
+        """
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '123.123.123.123'
+        video = Video.objects.get(pk=1)
+
+        with self.assertNumQueries(1):
+            Watch.add(request, video)
+        Watch.add(request, video)
+        self.assertFalse(models.WatchCount.objects.filter(
+                video=video, total__gt=0).exists())
+        tasks.update_popularity()
+        self.assertEqual(models.WatchCount.objects.get(video=video).total, 2)
+        self.assertEqual(Watch.objects.filter(counted=False).count(), 0)
+        self.assertEqual(Video.objects.get_query_set().with_total_watches(
+                ).get(pk=1).watch_count, 2)
+
+    @mock.patch('localtv.settings.BUFFER_WATCHES', True)
+    @mock.patch('localtv.tasks.flush_watches.apply_async')
+    def test_add_buffered(self, apply_async):
+        """
+        If LOCALTV_BUFFER_WATCHES is set, Watch.add() should only buffer the
+        watch; flush_watches should write the buffered watches in bulk.
+        """
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '123.123.123.123'
+        request.user = User.objects.get(username='user')
+        video = Video.objects.get(pk=1)
+        # Flush anything left over in the cache.
+        tasks.flush_watches()
+        Watch.objects.all().delete()
+
+        for i in range(3):
+            Watch.add(request, video)
+        self.assertEqual(Watch.objects.count(), 0)
+        self.assertEqual(apply_async.call_count, 1)
+
+        tasks.flush_watches()
+        self.assertEqual(Watch.objects.filter(video=video,
+                                              user=request.user).count(), 3)
+        self.assertEqual(models.WatchCount.objects.get(video=video).total, 3)
+        watch = Watch.objects.all()[0]
+        self.assertEqual(watch.ip_address, request.META['REMOTE_ADDR'])
+        self.assertTrue(datetime.datetime.now() - watch.timestamp <
+                        datetime.timedelta(seconds=5))
+
+    @mock.patch('localtv.settings.BUFFER_WATCHES', True)
+    @mock.patch('localtv.models.logging')
+    def test_add_buffer_failed(self, logging):
+        """
+        If the cache can't buffer the watch, Watch.add() should log a warning
+        and save the watch directly.  Other errors should propagate.
+        """
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '123.123.123.123'
+        video = Video.objects.get(pk=1)
+        Watch.objects.all().delete()
+
+        with mock.patch.object(Watch, 'buffer',
+                               mock.Mock(side_effect=ValueError)):
+            Watch.add(request, video)
+        self.assertEqual(Watch.objects.filter(video=video).count(), 1)
+        self.assertEqual(logging.warning.call_count, 1)
+
+        with mock.patch.object(Watch, 'buffer',
+                               mock.Mock(side_effect=TypeError)):
+            self.assertRaises(TypeError, Watch.add, request, video)
+        self.assertEqual(Watch.objects.filter(video=video).count(), 1)
+
+    @mock.patch('localtv.tasks.flush_watches.apply_async')
+    def test_buffer_schedule_failed(self, apply_async):
+        """
+        If the flush can't be scheduled, the watch should stay buffered and
+        the next watch should try to schedule the flush again.
+        """
+        Watch.flush_buffer()
+        Watch.objects.all().delete()
+        scheduled_key = models.WATCH_FLUSH_SCHEDULED_KEY % settings.SITE_ID
+        cache.delete(scheduled_key)
+        apply_async.side_effect = IOError
+        Watch.buffer(1, None, '123.123.123.123')
+        self.assertEqual(cache.get(scheduled_key), None)
+
+        apply_async.side_effect = None
+        Watch.buffer(1, None, '123.123.123.123')
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(Watch.flush_buffer(), ([1], False))
+        self.assertEqual(Watch.objects.count(), 2)
+
+    @mock.patch('localtv.tasks.flush_watches.apply_async')
+    def test_flush_buffer_missing_slot(self, apply_async):
+        """
+        A flush should stop at a slot which hasn't been written yet, and only
+        skip it once a later watch is older than the grace period.
+        """
+        Watch.flush_buffer()
+        Watch.objects.all().delete()
+        # A slot which has been numbered but not written yet.
+        sequence_key = models.WATCH_SEQUENCE_KEY % settings.SITE_ID
+        cache.add(sequence_key, 0)
+        cache.incr(sequence_key)
+        Watch.buffer(1, None, '123.123.123.123')
+        self.assertEqual(Watch.flush_buffer(), ([], False))
+        self.assertEqual(Watch.objects.count(), 0)
+
+        sequence = cache.get(sequence_key)
+        key = models.WATCH_SLOT_KEY % (settings.SITE_ID, sequence)
+        watch = cache.get(key)
+        cache.set(key, watch[:3] + (watch[3] - datetime.timedelta(
+                    seconds=60),))
+        self.assertEqual(Watch.flush_buffer(), ([1], False))
+        self.assertEqual(Watch.objects.count(), 1)
+
+    def test_flush_buffer_locked(self):
+        """
+        Only one flush should claim buffered watches at a time.
+        """
+        Watch.flush_buffer()
+        lock_key = models.WATCH_FLUSH_LOCK_KEY % settings.SITE_ID
+        cache.add(lock_key, True)
+        self.addCleanup(cache.delete, lock_key)
+        self.assertEqual(Watch.flush_buffer(), ([], None))
+
+    @mock.patch('localtv.tasks.flush_watches.apply_async')
+    def test_flush_buffer_sites(self, apply_async):
+        """
+        Each site's watches should be buffered separately, and only flushed
+        by that site's flush.
+        """
+        other_site_id = settings.SITE_ID + 1
+        for site_id in settings.SITE_ID, other_site_id:
+            with mock.patch.object(settings, 'SITE_ID', site_id):
+                Watch.flush_buffer()
+            cache.delete(models.WATCH_FLUSH_SCHEDULED_KEY % site_id)
+        Watch.objects.all().delete()
+
+        with mock.patch.object(settings, 'SITE_ID', other_site_id):
+            Watch.buffer(2, None, '123.123.123.123')
+        Watch.buffer(1, None, '123.123.123.123')
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(Watch.flush_buffer(), ([1], False))
+        self.assertEqual(list(Watch.objects.values_list('video', flat=True)),
+                         [1])
+
+        with mock.patch.object(settings, 'SITE_ID', other_site_id):
+            self.assertEqual(Watch.flush_buffer(), ([2], False))
+        self.assertEqual(Watch.objects.filter(video=2).count(), 1)
+
+    def test_update_popularity(self):
+        """
+        Watches should be counted towards a video's popularity until they
+        leave the LOCALTV_POPULAR_WINDOW, when update_popularity() drops them.
+        """
+        request = HttpRequest()
+        request.META['REMOTE_ADDR'] = '123.123.123.123'
+        video = Video.objects.get(pk=2)
+        Watch.add(request, video)
+        Watch.add(request, video)
+        tasks.update_popularity()
+        self.assertEqual(models.WatchCount.objects.get(video=video).recent, 2)
+        self.assertEqual(models.WatchBucket.objects.get(video=video).count, 2)
+        self.assertEqual(list(Video.objects.get_popular_videos()[:1]), [video])
+
+        # An old bucket is removed and no longer counted.
+        models.WatchBucket.objects.filter(video=video).update(
+            hour=datetime.datetime.now() - datetime.timedelta(days=8))
+        models.WatchBucket.add(video.pk, datetime.datetime.now(), 1)
+        tasks.update_popularity()
+        self.assertEqual(models.WatchCount.objects.get(video=video).recent, 1)
+        self.assertEqual(models.WatchCount.objects.get(video=video).total, 2)
+        self.assertEqual(models.WatchBucket.objects.filter(
+                video=video).count(), 1)
+
+    def test_popularity_updated_per_site(self):
+        """
+        update_popularity() should only record the popularity update time of
+        the site it's run for.
+        """
+        other_site_id = settings.SITE_ID + 1
+        for site_id in settings.SITE_ID, other_site_id:
+            cache.delete(models.POPULARITY_UPDATED_KEY % site_id)
+        Watch.objects.create(video=Video.objects.get(pk=2),
+                             ip_address='123.123.123.123')
+        with mock.patch.object(settings, 'SITE_ID', other_site_id):
+            tasks.update_popularity()
+        self.assertEqual(cache.get(
+                models.POPULARITY_UPDATED_KEY % settings.SITE_ID), None)
+        self.assertNotEqual(cache.get(
+                models.POPULARITY_UPDATED_KEY % other_site_id), None)
+
+    def test_popular_videos_without_watchcount(self):
+        """
+        Videos without a WatchCount shouldn't be among the popular videos, and
+        update_popularity() should create the WatchCounts of videos which were
+        watched without one.
+        """
+        video = Video.objects.get(pk=2)
+        models.WatchCount.objects.filter(video=video).delete()
+        self.assertFalse(video in Video.objects.get_popular_videos())
+
+        Watch.objects.create(video=video, ip_address='123.123.123.123')
+        models.WatchCount.objects.filter(video=video).delete()
+        models.WatchBucket.rebuild()
+        tasks.update_popularity()
+        watch_count = models.WatchCount.objects.get(video=video)
+        self.assertEqual(watch_count.recent, 1)
+        self.assertEqual(watch_count.total, 1)
+        self.assertEqual(list(Video.objects.get_popular_videos()[:1]), [video])
+
 
 # -----------------------------------------------------------------------------
 # SavedSearch model tests
@@ -2146,6 +2752,280 @@ class TestWmodeFilter(BaseTestCase):
         self.assertEqual(output,
                          localtv.templatetags.filters.wmode_transparent(input))
                 
+class VideoListTagTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['videos']
+
+    def setUp(self):
+        BaseTestCase.setUp(self)
+        self.lookups = []
+        original = video_list.BaseVideoListNode.get_video_list
+        def get_video_list(node, item=None):
+            self.lookups.append(item)
+            return original(node, item)
+        patcher = mock.patch.object(video_list.BaseVideoListNode,
+                                    'get_video_list', get_video_list)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.template = Template(
+            '{% load video_list %}'
+            '{% get_video_list_new as first limit 3 %}'
+            '{% get_video_list_new as second limit 3 %}'
+            '{% for video in first %}{{ video.pk }} {% endfor %}'
+            '{% ifequal first second %}same{% endifequal %}')
+
+    def render(self):
+        return self.template.render(Context({
+                    'request': self.factory.get('/')}))
+
+    def test_memoized_per_request(self):
+        """
+        Using a video list tag twice in one request should only look the list
+        up once, and a limited list should only have that many videos.
+        """
+        expected = ''.join('%i ' % video.pk for video in
+                           Video.objects.get_latest_videos(
+                               self.site_location)[:3])
+        self.assertEqual(self.render(), expected + 'same')
+        self.assertEqual(len(self.lookups), 1)
+        self.render()
+        self.assertEqual(len(self.lookups), 2)
+
+    @mock.patch('localtv.settings.VIDEO_LIST_CACHE_TIMEOUT', 60)
+    def test_shared_cache(self):
+        """
+        With LOCALTV_VIDEO_LIST_CACHE_TIMEOUT, limited lists should be cached
+        between requests until a video changes.
+        """
+        # Don't use lists cached by other tests.
+        utils.bump_cache_version('site:%i' % settings.SITE_ID)
+        first = self.render()
+        self.assertEqual(self.render(), first)
+        self.assertEqual(len(self.lookups), 1)
+        Video.objects.filter(status=Video.ACTIVE)[0].save()
+        self.render()
+        self.assertEqual(len(self.lookups), 2)
+
+
+class RelatedVideosTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['videos']
+
+    def test_update_related_videos(self):
+        """
+        Videos which share a category should be related to each other, and
+        shown on each other's pages.
+        """
+        first, second, third = Video.objects.filter(
+            status=Video.ACTIVE).order_by('pk')[:3]
+        category = Category.objects.create(site=self.site_location.site,
+                                           name='Related', slug='related')
+        first.categories.add(category)
+        second.categories.add(category)
+        tasks.update_related_videos(full=True)
+
+        related = Video.objects.get_related_videos(first)
+        self.assertEqual(list(related[:1]), [second])
+        self.assertFalse(third in Video.objects.get_related_videos(first))
+
+        response = self.client.get(first.get_absolute_url())
+        self.assertEqual(list(response.context['related_videos'][:1]),
+                         [second])
+
+        # The sidebar's thumbnails come from the feeds and searches, which
+        # should be loaded in the same query.
+        with self.assertNumQueries(1):
+            related = list(Video.objects.get_related_videos(first, limit=1))
+        self.assertEqual(related, [second])
+        self.assertNumQueries(0, lambda: [(video.feed, video.search)
+                                          for video in related])
+
+    def test_inactive_videos_removed(self):
+        """
+        Videos which are no longer active shouldn't have related videos.
+        """
+        first, second = Video.objects.filter(
+            status=Video.ACTIVE).order_by('pk')[:2]
+        category = Category.objects.create(site=self.site_location.site,
+                                           name='Related', slug='related')
+        first.categories.add(category)
+        second.categories.add(category)
+        tasks.update_related_videos(full=True)
+        self.assertTrue(RelatedVideo.objects.filter(video=second).exists())
+
+        second.status = Video.REJECTED
+        second.save()
+        tasks.update_related_videos()
+        self.assertFalse(RelatedVideo.objects.filter(video=second).exists())
+        self.assertFalse(second in Video.objects.get_related_videos(first))
+
+    def test_neighbours_updated(self):
+        """
+        Updating the related videos of a changed video should also update
+        those of the videos which it's now related to.
+        """
+        first, second, third = Video.objects.filter(
+            status=Video.ACTIVE).order_by('pk')[:3]
+        category = Category.objects.create(site=self.site_location.site,
+                                           name='Related', slug='related')
+        first.categories.add(category)
+        second.categories.add(category)
+        tasks.update_related_videos(full=True)
+        self.assertFalse(third in Video.objects.get_related_videos(first))
+
+        third.categories.add(category)
+        third.save()
+        tasks.update_related_videos()
+        self.assertTrue(third in Video.objects.get_related_videos(first))
+        self.assertTrue(second in Video.objects.get_related_videos(first))
+
+    @mock.patch('localtv.settings.RELATED_VIDEOS_COUNT', 1)
+    def test_neighbours_refilled(self):
+        """
+        If a video stops being related to another, the other video's related
+        videos should be refilled from the rest of the videos.
+        """
+        first, second, third = Video.objects.filter(
+            status=Video.ACTIVE).order_by('pk')[:3]
+        categories = [Category.objects.create(site=self.site_location.site,
+                                              name='Related %i' % i,
+                                              slug='related-%i' % i)
+                      for i in range(2)]
+        first.categories.add(*categories)
+        second.categories.add(*categories)
+        third.categories.add(categories[0])
+        tasks.update_related_videos(full=True)
+        self.assertEqual(list(Video.objects.get_related_videos(first)),
+                         [second])
+
+        second.categories.clear()
+        second.save()
+        tasks.update_related_videos()
+        self.assertEqual(list(Video.objects.get_related_videos(first)),
+                         [third])
+
+    def test_unrelated_videos_scored_once(self):
+        """
+        Videos which aren't related to any others should be recorded as
+        scored, so that later updates don't score them again.
+        """
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        tasks.update_related_videos(full=True)
+        self.assertEqual(list(RelatedVideo.objects.filter(
+                    video=video).values_list('related', flat=True)), [None])
+        self.assertEqual(list(Video.objects.get_related_videos(video)), [])
+
+        with mock.patch('localtv.related.get_changed_related_videos') as get:
+            tasks.update_related_videos()
+        self.assertFalse(get.called)
+
+
+class ContextProcessorTestCase(BaseTestCase):
+
+    fixtures = BaseTestCase.fixtures + ['categories', 'videos']
+
+    def test_lazy(self):
+        """
+        The context processor shouldn't make any queries for values which a
+        template doesn't use.
+        """
+        request = self.factory.get('/')
+        with self.assertNumQueries(0):
+            context = context_processors.localtv(request)
+        self.assertFalse(context['user_is_admin']())
+
+    def test_site_values_cached(self):
+        """
+        The root categories and the cache invalidator should be computed once
+        per process, until a category or video changes.
+        """
+        # Don't use values cached by other tests.
+        utils.bump_cache_version('site:%i' % settings.SITE_ID,
+                                 'categories:%i' % settings.SITE_ID)
+        categories = list(Category.objects.filter(site=settings.SITE_ID,
+                                                  parent=None))
+        context = context_processors.localtv(self.factory.get('/'))
+        self.assertNumQueries(1, context['categories'])
+        self.assertEqual(context['categories'](), categories)
+        self.assertNumQueries(1, context['cache_invalidator'])
+
+        context = context_processors.localtv(self.factory.get('/'))
+        self.assertNumQueries(0, context['categories'])
+        self.assertNumQueries(0, context['cache_invalidator'])
+
+        category = Category.objects.create(site=self.site_location.site,
+                                           name='New', slug='new')
+        video = Video.objects.filter(status=Video.ACTIVE)[0]
+        video.save()
+        context = context_processors.localtv(self.factory.get('/'))
+        self.assertTrue(category in context['categories']())
+        self.assertEqual(context['cache_invalidator'](),
+                         str(Video.objects.get(pk=video.pk).when_modified))
+
+
+class SiteLocationCacheTestCase(BaseTestCase):
+
+    def test_cached_between_requests(self):
+        """
+        After the first request, each request should get its own copy of the
+        SiteLocation without querying the database.
+        """
+        request_finished.send(sender=self.__class__)
+        first = SiteLocation.objects.get_current()
+        request_finished.send(sender=self.__class__)
+        with self.assertNumQueries(0):
+            site_location = SiteLocation.objects.get_current()
+        self.assertFalse(site_location is first)
+        self.assertEqual(site_location.pk, first.pk)
+        self.assertTrue(SiteLocation.objects.get_current() is site_location)
+        self.assertTrue(SiteLocation.objects.get(site=settings.SITE_ID)
+                        is site_location)
+
+    @mock.patch('localtv.settings.SITE_LOCATION_CHECK_INTERVAL', 0)
+    def test_invalidated(self):
+        """
+        When another process saves the SiteLocation, this process should load
+        the new version.
+        """
+        SiteLocation.objects.filter(pk=self.site_location.pk).update(
+            tagline='New tagline')
+        self.assertNotEqual(SiteLocation.objects.get_current().tagline,
+                            'New tagline')
+        # This is what the post_save handler in the other process does.
+        utils.bump_cache_version('sitelocation:%i' % settings.SITE_ID)
+        self.assertEqual(SiteLocation.objects.get_current().tagline,
+                         'New tagline')
+
+    def test_save(self):
+        """
+        Saving the current SiteLocation should keep it as the current one.
+        """
+        self.site_location.tagline = 'New tagline'
+        self.site_location.save()
+        self.assertTrue(SiteLocation.objects.get_current() is
+                        self.site_location)
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(SiteLocation.objects.get_current().tagline,
+                         'New tagline')
+
+
+    def test_save_in_transaction(self):
+        """
+        A SiteLocation saved inside a transaction should have its cache
+        version bumped again when the request finishes, after the commit.
+        """
+        name = 'sitelocation:%i' % settings.SITE_ID
+        self.site_location.tagline = 'New tagline'
+        self.site_location.save()
+        version = utils.get_cache_versions(name)[0]
+        request_finished.send(sender=self.__class__)
+        self.assertNotEqual(utils.get_cache_versions(name)[0], version)
+
+        version = utils.get_cache_versions(name)[0]
+        request_finished.send(sender=self.__class__)
+        self.assertEqual(utils.get_cache_versions(name)[0], version)
+
+
 class SiteLocationEnablesRestrictionsAfterPayment(BaseTestCase):
     def test_unit(self):
         self.assertFalse(SiteLocation.enforce_tiers(override_setting=True))
@@ -2257,6 +3137,194 @@ class FeedViewTestCase(BaseTestCase):
         items_from_second_GET = parsed['items']
         self.assertEqual(1, len(items_from_second_GET))
 
+    def test_conditional_get(self):
+        """
+        Feeds should have an ETag, and a request with a matching ETag should
+        get a 304 until a video changes.
+        """
+        fake_request = self.factory.get('?count=10')
+        response = localtv.feeds.views.NewVideosFeed()(fake_request)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        fake_request = self.factory.get('?count=10', HTTP_IF_NONE_MATCH=etag)
+        response = localtv.feeds.views.NewVideosFeed()(fake_request)
+        self.assertEqual(response.status_code, 304)
+
+        Video.objects.filter(status=Video.ACTIVE)[0].save()
+        fake_request = self.factory.get('?count=10', HTTP_IF_NONE_MATCH=etag)
+        response = localtv.feeds.views.NewVideosFeed()(fake_request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_get_object(self):
+        """
+        A feed of an object should get a new ETag when the object is saved.
+        """
+        category = Category.objects.get(slug='linux')
+        fake_request = self.factory.get('?count=10')
+        response = localtv.feeds.views.CategoryVideosFeed()(fake_request,
+                                                            'linux')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        category.name = 'GNU/Linux'
+        category.save()
+        fake_request = self.factory.get('?count=10', HTTP_IF_NONE_MATCH=etag)
+        response = localtv.feeds.views.CategoryVideosFeed()(fake_request,
+                                                            'linux')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_last_modified_change_stamps(self):
+        """
+        Feeds should only be sent Last-Modified if change stamps are enabled.
+        """
+        fake_request = self.factory.get('?count=10')
+        response = localtv.feeds.views.NewVideosFeed()(fake_request)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        old_ENABLE_CHANGE_STAMPS = localtv.settings.ENABLE_CHANGE_STAMPS
+        localtv.settings.ENABLE_CHANGE_STAMPS = True
+        try:
+            fake_request = self.factory.get('?count=10')
+            response = localtv.feeds.views.NewVideosFeed()(fake_request)
+            self.assertTrue(response.has_header('Last-Modified'))
+        finally:
+            localtv.settings.ENABLE_CHANGE_STAMPS = old_ENABLE_CHANGE_STAMPS
+
+    def test_cached_feed_invalidated(self):
+        """
+        Cached feeds should show newly approved videos straight away, and
+        feeds of an object should be invalidated when the object is saved.
+        """
+        fake_request = self.factory.get('?count=50')
+        feed = localtv.feeds.views.NewVideosFeed()
+        parsed = feedparser.parse(feed(fake_request).content)
+        self.assertEqual(len(parsed['items']), 23)
+
+        video = Video.objects.get(pk=1)
+        video.status = Video.ACTIVE
+        video.save()
+        self._rebuild_index()
+        parsed = feedparser.parse(feed(fake_request).content)
+        self.assertEqual(len(parsed['items']), 24)
+
+        feed = localtv.feeds.views.CategoryVideosFeed()
+        cache_key = feed._get_cache_key(fake_request, 'linux')
+        self.assertEqual(feed._get_cache_key(fake_request, 'linux'),
+                         cache_key)
+        Category.objects.get(slug='linux').save()
+        self.assertNotEqual(feed._get_cache_key(fake_request, 'linux'),
+                            cache_key)
+
+    def test_feed_after(self):
+        """
+        Following the ``next`` links of a feed should walk through the same
+        items as one large page, without counting the results.
+        """
+        feed = localtv.feeds.views.NewVideosFeed(json=True)
+        expected = json.loads(feed(self.factory.get('?count=50')).content)
+
+        items = []
+        fake_request = self.factory.get('?count=5')
+        while True:
+            parsed = json.loads(feed(fake_request).content)
+            items.extend(parsed['items'])
+            if 'next' not in parsed:
+                break
+            self.assertTrue('after=' in parsed['next'])
+            fake_request = self.factory.get(parsed['next'])
+        self.assertEqual(items, expected['items'])
+
+    def test_item_fragments_cached(self):
+        """
+        Rendered feed items should be cached, and only rendered again once
+        the video has been saved.
+        """
+        fake_request = self.factory.get('?count=10')
+        feed = localtv.feeds.views.NewVideosFeed()
+        obj = feed.get_object(fake_request)
+        first = feed.get_feed(obj, fake_request).writeString('utf-8')
+
+        feed.item_extra_kwargs = mock.Mock(wraps=feed.item_extra_kwargs)
+        obj = feed.get_object(fake_request)
+        second = feed.get_feed(obj, fake_request).writeString('utf-8')
+        self.assertEqual(first, second)
+        self.assertFalse(feed.item_extra_kwargs.called)
+
+        video = feed.items(feed.get_object(fake_request))[0]
+        video.save()
+        obj = feed.get_object(fake_request)
+        feed.get_feed(obj, fake_request)
+        self.assertEqual(feed.item_extra_kwargs.call_count, 1)
+
+        # Items can depend on the site's settings.
+        self.site_location.save()
+        obj = feed.get_object(fake_request)
+        feed.get_feed(obj, fake_request)
+        self.assertEqual(feed.item_extra_kwargs.call_count, 1 + len(
+                feed.items(obj)))
+
+    @mock.patch('localtv.settings.FEED_STREAMING_THRESHOLD', 3)
+    def test_large_feed_streamed(self):
+        """
+        Feeds with more than LOCALTV_FEED_STREAMING_THRESHOLD items should be
+        streamed a chunk at a time, with the same items as a feed rendered
+        all at once.
+        """
+        fake_request = self.factory.get('?count=10')
+        feed = localtv.feeds.views.NewVideosFeed()
+        feed.streaming = False
+        expected = feedparser.parse(feed(fake_request).content)
+
+        response = localtv.feeds.views.NewVideosFeed()(fake_request)
+        chunks = list(response)
+        self.assertTrue(len(chunks) > 3)
+        parsed = feedparser.parse(''.join(chunks))
+        self.assertEqual([item['link'] for item in parsed['items']],
+                         [item['link'] for item in expected['items']])
+
+    @mock.patch('localtv.settings.FEED_STREAMING_THRESHOLD', 3)
+    def test_large_json_feed_streamed(self):
+        """
+        Streamed JSON feeds should have the same items as a JSON feed rendered
+        all at once.
+        """
+        fake_request = self.factory.get('?count=10')
+        feed = localtv.feeds.views.NewVideosFeed(json=True)
+        feed.streaming = False
+        expected = json.loads(feed(fake_request).content)
+
+        response = localtv.feeds.views.NewVideosFeed(json=True)(fake_request)
+        parsed = json.loads(''.join(response))
+        self.assertEqual(parsed['items'], expected['items'])
+        self.assertEqual(parsed['title'], expected['title'])
+
+    @mock.patch('localtv.settings.FEED_STREAMING_THRESHOLD', 3)
+    def test_large_feed_streamed_by_cursor(self):
+        """
+        Each chunk of a streamed feed with a sort which supports cursors
+        should follow on from the last one, even where the sort has ties.
+        """
+        for video in Video.objects.filter(status=Video.ACTIVE)[:5]:
+            Watch.objects.create(video=video, ip_address='123.123.123.123')
+        tasks.update_popularity()
+        tasks.haystack_batch_update()
+        fake_request = self.factory.get('?count=10&sort=-popular')
+        feed = localtv.feeds.views.NewVideosFeed()
+        feed.streaming = False
+        expected = feedparser.parse(feed(fake_request).content)
+
+        feed = localtv.feeds.views.NewVideosFeed()
+        with mock.patch.object(feed, '_seek', wraps=feed._seek) as seek:
+            parsed = feedparser.parse(''.join(feed(fake_request)))
+        self.assertTrue(seek.call_count > 1)
+        links = [item['link'] for item in parsed['items']]
+        self.assertEqual(len(links), len(set(links)))
+        self.assertEqual(sorted(links),
+                         sorted(item['link'] for item in expected['items']))
+
 if localtv.settings.voting_enabled():
     from voting.models import Vote
 
@@ -169,7 +169,11 @@ def hide_videos_above_limit(future_tier_obj, actually_do_it=False):
 
     # Use a bulk .update() call so it's all done in one SQL query.
     disable_these_videos = localtv.models.Video.objects.filter(pk__in=disable_these_pks)
-    return disable_these_videos.update(status=localtv.models.Video.UNAPPROVED)
+    count = disable_these_videos.update(status=localtv.models.Video.UNAPPROVED,
+                                        when_modified=datetime.datetime.now())
+    localtv.models.bump_videos_cache_version(settings.SITE_ID,
+                                             disable_these_pks)
+    return count
 
 def switch_to_a_bundled_theme_if_necessary(future_tier_obj, actually_do_it=False):
     if uploadtemplate.models.Theme.objects.filter(default=True):
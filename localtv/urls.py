@@ -61,6 +61,11 @@ urlpatterns += patterns(
                         default_sort='-date'
                     ), name='localtv_author'))
 
+# Search patterns
+urlpatterns += patterns(
+    'localtv.search.views',
+    url(r'^search/suggest/$', 'suggest', name='localtv_search_suggest'))
+
 # Comments patterns
 urlpatterns += patterns(
     'localtv.comments.views',
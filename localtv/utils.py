@@ -17,11 +17,13 @@
 
 import hashlib
 import string
+import time
 import urllib
 import types
 import os
 import os.path
 import logging
+from multiprocessing.pool import ThreadPool
 
 import Image
 try:
@@ -32,7 +34,8 @@ except ImportError:
 from django.conf import settings
 from django.core.cache import cache
 from django.core.mail import EmailMessage
-from django.db.models import get_model, Q
+from django.db import connections, transaction
+from django.db.models import get_model, AutoField, Q
 from django.utils.encoding import force_unicode
 import tagging
 import vidscraper
@@ -326,6 +329,38 @@ class MockQueryset(object):
         return MockQueryset(self.objects, self.model, new_filters)
 
 
+def bulk_insert(model, instances, using='default'):
+    """
+    Saves ``instances`` of ``model`` with a single ``executemany`` call, which
+    most backends turn into a multi-row ``INSERT``. This is a stand-in for
+    ``QuerySet.bulk_create``, which isn't available in Django 1.3; like that
+    method, it doesn't send any signals and doesn't set primary keys on the
+    instances. Fields which are already set on an instance keep their value,
+    even if they are ``auto_now_add``.
+
+    """
+    if not instances:
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = [field for field in model._meta.local_fields
+              if not isinstance(field, AutoField)]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+        qn(model._meta.db_table),
+        ', '.join(qn(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)))
+    def prepare(field, instance):
+        value = getattr(instance, field.attname)
+        if value is None:
+            value = field.pre_save(instance, True)
+        return field.get_db_prep_save(value, connection=connection)
+    params = [[prepare(field, instance) for field in fields]
+              for instance in instances]
+    cursor = connection.cursor()
+    cursor.executemany(sql, params)
+    transaction.commit_unless_managed(using=using)
+
+
 def get_profile_model():
     app_label, model_name = settings.AUTH_PROFILE_MODULE.split('.')
     Profile = get_model(app_label, model_name)
@@ -335,6 +370,56 @@ def get_profile_model():
     return Profile
 
 
+#: How long a cache version is kept. Versions are normally bumped long before
+#: this, but an evicted version restarts from the current time rather than
+#: from zero, so that it can't match keys made with an earlier version.
+CACHE_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _cache_version_key(name):
+    return 'localtv:cache_version:%s' % hashlib.md5(
+        force_unicode(name).encode('utf-8')).hexdigest()
+
+
+def get_cache_versions(*names):
+    """
+    Returns a list of the current cache versions for ``names``, in the same
+    order. Versions are used to build cache keys, so that bumping a version
+    (with :func:`bump_cache_version`) invalidates everything cached under it
+    without having to know which keys were used.
+
+    """
+    keys = [_cache_version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if versions.get(key) is None:
+            # If another process got there first, use its version.
+            initial = int(time.time() * 1000)
+            if not cache.add(key, initial, CACHE_VERSION_TIMEOUT):
+                initial = cache.get(key, initial)
+            versions[key] = initial
+    return [versions[key] for key in keys]
+
+
+def bump_cache_version(*names):
+    """
+    Invalidates everything which was cached with the versions for ``names``.
+    Returns a list of their new versions, in the same order.
+
+    """
+    versions = []
+    for name in names:
+        key = _cache_version_key(name)
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # The version isn't set; start it from the current time.
+            version = int(time.time() * 1000)
+            cache.set(key, version, CACHE_VERSION_TIMEOUT)
+        versions.append(version)
+    return versions
+
+
 SAFE_URL_CHARACTERS = string.ascii_letters + string.punctuation
 
 
@@ -342,75 +427,129 @@ def quote_unicode_url(url):
     return urllib.quote(url, safe=SAFE_URL_CHARACTERS)
 
 
+def _thumbnail_source(image, sizes):
+    """
+    Returns a downscaled copy of ``image`` which is still at least twice as
+    large as every one of ``sizes`` needs, so that each size can be resized
+    from it instead of from a (possibly huge) original. If the image isn't
+    large enough for that to help, it is returned unchanged.
+    """
+    if image.mode in ('1', 'P'):
+        # These modes are resized without antialiasing, so an intermediate
+        # would lose detail.
+        return image
+    scale = 0
+    for size in sizes:
+        width, height = size[:2]
+        scale = max(scale, float(width) / image.size[0],
+                    float(height) / image.size[1])
+    scale *= 2
+    if scale >= 1:
+        return image
+    return image.resize((max(1, int(image.size[0] * scale)),
+                         max(1, int(image.size[1] * scale))),
+                        Image.ANTIALIAS)
+
+
+def _resize_image(image, width, height, force_height):
+    # Hackishly copying this constant in for now.
+    FORCE_HEIGHT_CROP = 1 # arguments for thumbnail resizing
+
+    resized_image = image
+    if resized_image.size != (width, height):
+        width_scale = float(resized_image.size[0]) / width
+        if force_height:
+            height_scale = float(resized_image.size[1]) / height
+            if force_height == FORCE_HEIGHT_CROP:
+                # make the resized_image have one side the same as the
+                # thumbnail, and the other bigger so we can crop it
+                if width_scale < height_scale:
+                    new_height = int(resized_image.size[1] /
+                                     width_scale)
+                    new_width = width
+                else:
+                    new_width = int(resized_image.size[0] /
+                                    height_scale)
+                    new_height = height
+            else: # FORCE_HEIGHT_PADDING
+                if width_scale < height_scale:
+                    new_width = int(resized_image.size[0] /
+                                    height_scale)
+                    new_height = height
+                else:
+                    new_height = int(resized_image.size[1] /
+                                     width_scale)
+                    new_width = width
+            resized_image = resized_image.resize(
+                (new_width, new_height),
+                Image.ANTIALIAS)
+            if resized_image.size != (width, height):
+                x = y = 0
+                if force_height == FORCE_HEIGHT_CROP:
+                    if resized_image.size[1] > height:
+                        y = int((height - resized_image.size[1]) / 2)
+                    else:
+                        x = int((width - resized_image.size[0]) / 2)
+                else: # FORCE_HEIGHT_PADDING:
+                    if resized_image.size[1] == height:
+                        x = int((width - resized_image.size[0]) / 2)
+                    else:
+                        y = int((height - resized_image.size[1]) / 2)
+                new_image = Image.new('RGBA',
+                                      (width, height), (0, 0, 0, 0))
+                new_image.paste(resized_image, (x, y))
+                resized_image = new_image
+        elif width_scale > 1:
+            # resize the width, keep the height aspect ratio the same
+            new_height = int(resized_image.size[1] / width_scale)
+            resized_image = resized_image.resize((width, new_height),
+                                                 Image.ANTIALIAS)
+    return resized_image
+
+
 def resize_image_returning_list_of_strings(original_image,
                                            THUMB_SIZES):
-    ret = []
+    """
+    Returns a list of ``((width, height), png_data)`` tuples, one for each of
+    ``THUMB_SIZES``. The original image is decoded once, and all the sizes
+    are resized from a single downscaled intermediate.
+    """
     # Hackishly copying this constant in for now.
     FORCE_HEIGHT_CROP = 1 # arguments for thumbnail resizing
 
+    original_image.load()
+    source = _thumbnail_source(original_image, THUMB_SIZES)
+    ret = []
     for size in THUMB_SIZES:
         if len(size) == 2:
             (width, height), force_height = size, FORCE_HEIGHT_CROP
         else:
             width, height, force_height = size
-        resized_image = original_image.copy()
-        if resized_image.size != (width, height):
-            width_scale = float(resized_image.size[0]) / width
-            if force_height:
-                height_scale = float(resized_image.size[1]) / height
-                if force_height == FORCE_HEIGHT_CROP:
-                    # make the resized_image have one side the same as the
-                    # thumbnail, and the other bigger so we can crop it
-                    if width_scale < height_scale:
-                        new_height = int(resized_image.size[1] /
-                                         width_scale)
-                        new_width = width
-                    else:
-                        new_width = int(resized_image.size[0] /
-                                        height_scale)
-                        new_height = height
-                else: # FORCE_HEIGHT_PADDING
-                    if width_scale < height_scale:
-                        new_width = int(resized_image.size[0] /
-                                        height_scale)
-                        new_height = height
-                    else:
-                        new_height = int(resized_image.size[1] /
-                                         width_scale)
-                        new_width = width
-                resized_image = resized_image.resize(
-                    (new_width, new_height),
-                    Image.ANTIALIAS)
-                if resized_image.size != (width, height):
-                    x = y = 0
-                    if force_height == FORCE_HEIGHT_CROP:
-                        if resized_image.size[1] > height:
-                            y = int((height - resized_image.size[1]) / 2)
-                        else:
-                            x = int((width - resized_image.size[0]) / 2)
-                    else: # FORCE_HEIGHT_PADDING:
-                        if resized_image.size[1] == height:
-                            x = int((width - resized_image.size[0]) / 2)
-                        else:
-                            y = int((height - resized_image.size[1]) / 2)
-                    new_image = Image.new('RGBA',
-                                          (width, height), (0, 0, 0, 0))
-                    new_image.paste(resized_image, (x, y))
-                    resized_image = new_image
-            elif width_scale > 1:
-                # resize the width, keep the height aspect ratio the same
-                new_height = int(resized_image.size[1] / width_scale)
-                resized_image = resized_image.resize((width, new_height),
-                                                     Image.ANTIALIAS)
+        resized_image = _resize_image(source, width, height, force_height)
         sio_img = StringIO.StringIO()
         resized_image.save(sio_img, 'png')
-        sio_img.seek(0)
         ret.append(
             ((width, height),
-             sio_img.read()))
+             sio_img.getvalue()))
     return ret
 
 
+def thread_map(func, iterable, threads):
+    """
+    Like :func:`map`, but ``func`` is called in up to ``threads`` threads at
+    once. This is meant for I/O bound work, such as storage writes.
+    """
+    items = list(iterable)
+    if threads <= 1 or len(items) <= 1:
+        return map(func, items)
+    pool = ThreadPool(min(threads, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
 def touch(filename, override_date=None):
     '''This is like /usr/bin/touch
 
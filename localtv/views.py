@@ -21,7 +21,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
 from django.core.urlresolvers import resolve, Resolver404
 from django.conf import settings
-from django.db.models import Q, Count
+from django.db.models import Q
 from django.http import (Http404, HttpResponsePermanentRedirect,
                          HttpResponseRedirect, HttpResponse)
 from django.shortcuts import render_to_response, get_object_or_404
@@ -68,7 +68,7 @@ def about(request):
 
 @vary_on_headers('User-Agent', 'Referer')
 def view_video(request, video_id, slug=None):
-    video_qs = Video.objects.annotate(watch_count=Count('watch'))
+    video_qs = Video.objects.get_query_set().with_total_watches()
     video = get_object_or_404(video_qs, pk=video_id,
                               site=Site.objects.get_current())
 
@@ -121,6 +121,8 @@ def view_video(request, video_id, slug=None):
         popular_videos = popular_videos.filter(categories=category_obj)
 
     context['popular_videos'] = popular_videos
+    context['related_videos'] = Video.objects.get_related_videos(
+        video, limit=localtv.settings.RELATED_VIDEOS_COUNT)
 
     if video.voting_enabled():
         import voting